@@ -0,0 +1,10 @@
+"""Запуск бота: python -m app"""
+import time
+
+# до импорта app.main: в этап "импорты" лога запуска входит загрузка aiogram, SQLAlchemy и модулей бота
+started = time.perf_counter()
+
+if __name__ == "__main__":
+    from app.main import run
+
+    run(started)
@@ -0,0 +1,85 @@
+import asyncio
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from app.config import settings
+from app.domain.analytics import NO_CATEGORY, TransactionColumns, compute_trend
+from app.domain.money import fmt_money
+from app.infrastructure.database import Database
+
+TOP_CATEGORIES = 5
+
+
+def render_trend(trend: Dict[str, Any]) -> str:
+    today, currency = trend["today"], trend["currency"]
+    text = f"📈 Тренд расходов на {today:%d.%m.%Y} ({currency}):\n\n"
+    text += f"💸 С начала месяца: {fmt_money(trend['month_spent'], 2, currency)}"
+    text += f" (за те же дни прошлого месяца: {fmt_money(trend['prev_month_spent'], 2, currency)})\n"
+    text += f"🔮 Прогноз на конец месяца: {fmt_money(trend['projection'], 2, currency)}\n"
+    text += f"📉 В среднем за 7 дней: {fmt_money(trend['daily_average'], 2, currency)} в день\n"
+    text += "\n🗓 По неделям:\n"
+    for week_start, total in trend["weekly"]:
+        text += f"• с {week_start:%d.%m}: {fmt_money(total, 0, currency)}\n"
+    if trend["categories"]:
+        text += "\n📂 Изменения к прошлому месяцу:\n"
+        for cat in trend["categories"][:TOP_CATEGORIES]:
+            sign = "+" if cat["delta"] >= 0 else "−"
+            current, delta = fmt_money(cat["current"], 0, currency), fmt_money(abs(cat["delta"]), 0, currency)
+            text += f"• {cat['name']}: {current} ({sign}{delta})\n"
+    if trend["missing_rates"]:
+        text += f"\n⚠️ Без операций в {', '.join(trend['missing_rates'])}: нет курса\n"
+    return text
+
+
+class TrendService:
+    """
+    Аналитика расходов для /trend.
+
+    Операции пользователя держатся в памяти столбцами NumPy (LRU на trend_cache_users
+    пользователей) уже пересчитанными в базовую валюту по курсу дня операции, как в /stats.
+    При каждом запросе догружаются только операции с id больше последнего загруженного,
+    все расчёты векторные. Смена базовой валюты или новые курсы (ими пересчитываются и
+    операции, для которых курса раньше не было) — столбцы собираются заново.
+    """
+
+    def __init__(self, db: Database, max_users: Optional[int] = None):
+        self._db = db
+        self._max_users = max_users or settings.trend_cache_users
+        # пользователь -> (базовая валюта и курсы, по которым пересчитаны суммы; столбцы; валюты без курса)
+        self._columns: "OrderedDict[int, Tuple[Tuple, TransactionColumns, Set[str]]]" = OrderedDict()
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._categories: Dict[int, str] = {}
+
+    async def columns(self, user_id: int) -> Tuple[str, TransactionColumns, Set[str]]:
+        """(базовая валюта, столбцы операций в ней, валюты операций, которые не пересчитать)"""
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            base = await self._db.get_base_currency(user_id)
+            version = (base, tuple(sorted((await self._db.get_rates()).items())))
+            entry = self._columns.get(user_id)
+            if entry is None or entry[0] != version:
+                entry = self._columns[user_id] = (version, TransactionColumns(), set())
+                while len(self._columns) > self._max_users:
+                    evicted, _ = self._columns.popitem(last=False)
+                    self._locks.pop(evicted, None)
+            self._columns.move_to_end(user_id)
+            _, cols, missing = entry
+            rows = await self._db.get_transaction_columns(user_id, base, cols.last_id)
+            cols.extend([row[:4] for row in rows if row[3] is not None])
+            missing.update(row[4] for row in rows if row[3] is None)
+            if rows:
+                # операции без курса тоже считаются загруженными: их вернёт пересборка по новым курсам
+                cols.last_id = max(cols.last_id, rows[-1][0])
+            return base, cols, missing
+
+    async def trend(self, user_id: int, today: Optional[date] = None) -> Dict[str, Any]:
+        base, cols, missing = await self.columns(user_id)
+        trend = compute_trend(cols, today or datetime.utcnow().date())
+        trend["currency"] = base
+        trend["missing_rates"] = sorted(missing)
+        if any(c["code"] not in self._categories for c in trend["categories"] if c["code"] != NO_CATEGORY):
+            self._categories = await self._db.get_categories()
+        for cat in trend["categories"]:
+            cat["name"] = self._categories.get(cat["code"], "без категории")
+        return trend
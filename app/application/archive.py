@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.config import settings
+from app.infrastructure.database import Database
+from app.logger import logger
+
+
+def archive_cutoff(now: datetime, after_days: int) -> datetime:
+    """Граница архивации: начало дня, отстоящего от now на after_days дней"""
+    return datetime(now.year, now.month, now.day) - timedelta(days=after_days)
+
+
+class ArchiveJob:
+    """
+    Перенос операций старше archive_after_days из transactions в transactions_archive.
+
+    Операции переносятся пачками по archive_batch_size, каждая — в своей транзакции вместе
+    с пополнением перенесённого остатка счетов, поэтому баланс не меняется ни в какой момент,
+    а прерванная архивация продолжается со следующей пачки. Между пачками пауза, чтобы
+    долгий перенос не отнимал базу у обработчиков.
+    """
+
+    def __init__(self, db: Database):
+        self._db = db
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Ошибка архивации операций")
+            await asyncio.sleep(settings.archive_interval_hours * 3600)
+
+    async def run(self, now: Optional[datetime] = None) -> int:
+        """Перенести в архив все операции старше границы; возвращает их число"""
+        before = archive_cutoff(now or datetime.utcnow(), settings.archive_after_days)
+        batch_size = max(1, settings.archive_batch_size)
+        moved = 0
+        while True:
+            count = await self._db.archive_transactions(before, batch_size)
+            moved += count
+            if count < batch_size:
+                break
+            await asyncio.sleep(settings.archive_pause_seconds)
+        if moved:
+            logger.info("В архив перенесено операций: %d (до %s)", moved, before.date())
+        return moved
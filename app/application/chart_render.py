@@ -0,0 +1,46 @@
+"""Отрисовка графиков статистики. Выполняется в процессах пула: модуль не тянет aiogram и БД."""
+
+import io
+from datetime import date
+from typing import List, Tuple
+
+TOP_SLICES = 6
+
+
+def render_stats_chart(
+    title: str,
+    categories: List[Tuple[str, float]],
+    days: List[date],
+    balances: List[float],
+) -> bytes:
+    """PNG: круговая диаграмма расходов по категориям и линия баланса по дням"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 4.5), dpi=100)
+    pie_ax, line_ax = fig.subplots(1, 2, gridspec_kw={"width_ratios": [1, 1.4]})
+
+    if categories:
+        # мелкие категории сворачиваем в «прочее», чтобы подписи не налезали
+        top = categories[:TOP_SLICES]
+        rest = sum(amount for _, amount in categories[TOP_SLICES:])
+        if rest > 0:
+            top = top + [("прочее", rest)]
+        pie_ax.pie([a for _, a in top], labels=[n for n, _ in top], autopct="%1.0f%%", startangle=90)
+    else:
+        pie_ax.text(0.5, 0.5, "Нет расходов", ha="center", va="center")
+        pie_ax.axis("off")
+    pie_ax.set_title("Расходы по категориям")
+
+    line_ax.plot(days, balances, marker="o", markersize=3)
+    line_ax.set_title("Баланс счетов")
+    line_ax.grid(alpha=0.3)
+    fig.autofmt_xdate()
+    fig.suptitle(title)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.types import BufferedInputFile, Message
+
+from app.application.chart_render import render_stats_chart
+from app.config import settings
+from app.domain.dto import StatsSummary
+from app.infrastructure.database import Database
+from app.logger import logger
+
+
+def balance_points(series: Dict[str, Any], start: date, end: date) -> Tuple[List[date], List[float]]:
+    """Баланс на конец каждого дня [start, end] по остатку на начало и изменениям по дням"""
+    changes = dict(series["days"])
+    days, balances = [], []
+    balance = series["opening"]
+    day = start
+    while day <= end:
+        balance += changes.get(day, 0.0)
+        days.append(day)
+        balances.append(balance)
+        day += timedelta(days=1)
+    return days, balances
+
+
+class StatsCharts:
+    """
+    Графики к статистике.
+
+    Рисование — CPU-bound, поэтому идёт в ProcessPoolExecutor на chart_workers процессов,
+    одновременно в пул отдаётся не больше задач, чем в нём процессов. Отправленный PNG
+    запоминается по file_id с ключом (пользователь, период, день, версия данных): повторный
+    запрос без новых операций переотправляет file_id без рисования и загрузки.
+    """
+
+    def __init__(self, db: Database, max_workers: Optional[int] = None, cache_size: Optional[int] = None):
+        self._db = db
+        self._workers = max_workers or settings.chart_workers
+        self._cache_size = cache_size or settings.chart_cache_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self._workers)
+        self._file_ids: "OrderedDict[Tuple, str]" = OrderedDict()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # процессы запускаются при первом графике; spawn — форк процесса с работающим
+        # event loop и потоками драйвера БД небезопасен
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def render(self, *args) -> bytes:
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor(), render_stats_chart, *args)
+
+    def cached(self, key: Tuple) -> Optional[str]:
+        file_id = self._file_ids.get(key)
+        if file_id is not None:
+            self._file_ids.move_to_end(key)
+        return file_id
+
+    def remember(self, key: Tuple, file_id: str) -> None:
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self._cache_size:
+            self._file_ids.popitem(last=False)
+
+    async def send_stats(self, message: Message, user_id: int, period: str, days: int, stats: StatsSummary) -> None:
+        """Отправить график к статистике за последние days дней (ошибки только логируются)"""
+        try:
+            today = datetime.utcnow().date()
+            start = today - timedelta(days=days)
+            since = datetime.combine(start, time.min)
+            # версия — дешёвый запрос по индексу; сам ряд читается только при промахе кэша
+            key = (user_id, period, today, stats.currency, await self._db.get_balance_version(user_id, since))
+            file_id = self.cached(key)
+            if file_id is not None:
+                await message.answer_photo(file_id)
+                return
+
+            series = await self._db.get_balance_series(user_id, since)
+            categories = [(cat.name, cat.amount) for cat in stats.categories]
+            points, balances = balance_points(series, start, today)
+            title = f"{start:%d.%m}–{today:%d.%m}, {series['currency']}"
+            if series["missing_rates"]:
+                title += f" (без {', '.join(series['missing_rates'])}: нет курса)"
+            png = await self.render(title, categories, points, balances)
+            sent = await message.answer_photo(BufferedInputFile(png, filename="stats.png"))
+            self.remember(key, sent.photo[-1].file_id)
+        except Exception as e:
+            logger.warning("Не удалось отправить график статистики: %s", e)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,50 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from app.config import settings
+from app.infrastructure.database import Database
+from app.logger import logger
+
+
+class CheckpointJob:
+    """
+    Месячные отметки остатка счетов в balance_checkpoints.
+
+    После окончания месяца дописывает остаток на его конец для каждого счёта с операциями.
+    Отметки считаются от предыдущей отметки счёта, поэтому проход читает только операции
+    за новые месяцы. Отметки, которые задним числом поменяли повторяющиеся операции,
+    удаляются при их проведении и пересчитываются здесь же.
+    """
+
+    def __init__(self, db: Database):
+        self._db = db
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Ошибка обновления отметок остатка")
+            await asyncio.sleep(settings.checkpoint_interval_hours * 3600)
+
+    async def run(self, now: Optional[datetime] = None) -> int:
+        """Дописать отметки для всех закончившихся месяцев; возвращает число новых"""
+        until = (now or datetime.utcnow()).date().replace(day=1)
+        added = await self._db.update_balance_checkpoints(until)
+        if added:
+            logger.info("Добавлено отметок остатка: %d (до %s)", added, until)
+        return added
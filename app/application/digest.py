@@ -0,0 +1,123 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+
+from app.application.telegram_send import send_text
+from app.config import settings
+from app.domain.money import fmt_money
+from app.infrastructure.database import Database
+from app.logger import logger
+
+WEEK = "week"
+MONTH = "month"
+
+
+def last_period(kind: str, now: datetime) -> Tuple[datetime, datetime]:
+    """Последний завершённый период [since, until): прошлая неделя (с понедельника) или прошлый месяц"""
+    today = datetime(now.year, now.month, now.day)
+    if kind == WEEK:
+        until = today - timedelta(days=today.weekday())
+        return until - timedelta(days=7), until
+    until = today.replace(day=1)
+    since = (until - timedelta(days=1)).replace(day=1)
+    return since, until
+
+
+def render_digest(kind: str, since: datetime, until: datetime, digest: Dict) -> str:
+    period_name = "неделю" if kind == WEEK else "месяц"
+    last_day = until - timedelta(days=1)
+    text = f"🗓 Итоги за {period_name} ({since:%d.%m}–{last_day:%d.%m}):\n\n"
+    currency = digest["currency"]
+    text += f"💰 Доходы: {fmt_money(digest['income'], 2, currency)}\n"
+    text += f"💸 Расходы: {fmt_money(digest['expense'], 2, currency)}\n"
+    text += f"💵 Разница: {fmt_money(digest['income'] - digest['expense'], 2, currency)}\n"
+    if digest["categories"]:
+        text += "\n📂 Больше всего потрачено:\n"
+        for cat in digest["categories"]:
+            text += f"• {cat['name']}: {fmt_money(cat['amount'], 2, currency)}\n"
+    if digest["missing_rates"]:
+        text += f"\n⚠️ Без операций в {', '.join(digest['missing_rates'])}: нет курса\n"
+    return text
+
+
+class DigestJob:
+    """
+    Рассылка сводок за прошедшую неделю и месяц.
+
+    Данные для всех пользователей считаются парой групповых запросов, отправка идёт
+    пачками с ограничением скорости. Получатели пачки сначала отмечаются в
+    digest_deliveries, поэтому рестарт посреди рассылки продолжает её без повторов.
+    """
+
+    def __init__(self, bot: Bot, db: Database, rate_per_sec: Optional[float] = None):
+        self._bot = bot
+        self._db = db
+        self._rate = rate_per_sec or settings.digest_rate_per_sec
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _due_at(self, until: datetime) -> datetime:
+        return until + timedelta(hours=settings.digest_hour_utc)
+
+    async def _loop(self) -> None:
+        while True:
+            now = datetime.utcnow()
+            for kind in (WEEK, MONTH):
+                since, until = last_period(kind, now)
+                if now >= self._due_at(until):
+                    try:
+                        await self.run(kind, since, until)
+                    except Exception:
+                        logger.exception("Ошибка рассылки сводки %s", kind)
+            await asyncio.sleep(self._seconds_to_next_run(now))
+
+    def _seconds_to_next_run(self, now: datetime) -> float:
+        candidates = []
+        for kind in (WEEK, MONTH):
+            _, until = last_period(kind, now)
+            due = self._due_at(until)
+            if due <= now:
+                # следующий период: конец текущего
+                probe = until + (timedelta(days=7) if kind == WEEK else timedelta(days=32))
+                _, next_until = last_period(kind, probe)
+                due = self._due_at(next_until)
+            candidates.append(due)
+        return max(60.0, (min(candidates) - now).total_seconds())
+
+    async def run(self, kind: str, since: datetime, until: datetime) -> int:
+        """Разослать сводки за период; возвращает число отправленных сообщений"""
+        digests = await self._db.get_digest_data(kind, since, until)
+        if not digests:
+            return 0
+        logger.info("Сводка %s за %s: получателей %d", kind, since.date(), len(digests))
+        period_start: date = since.date()
+        batch_size = max(1, int(self._rate))
+        sent = 0
+        for i in range(0, len(digests), batch_size):
+            batch: List[Dict] = digests[i : i + batch_size]
+            started = asyncio.get_running_loop().time()
+            claimed = set(await self._db.claim_digest_deliveries(kind, period_start, [d["user_id"] for d in batch]))
+            for digest in batch:
+                if digest["user_id"] in claimed and await send_text(
+                    self._bot, digest["telegram_id"], render_digest(kind, since, until, digest), "Сводка"
+                ):
+                    sent += 1
+            # не больше batch_size сообщений в секунду
+            elapsed = asyncio.get_running_loop().time() - started
+            if elapsed < 1.0:
+                await asyncio.sleep(1.0 - elapsed)
+        logger.info("Сводка %s за %s: отправлено %d", kind, since.date(), sent)
+        return sent
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+
+from app.application.telegram_send import send_text
+from app.config import settings
+from app.domain.money import fmt_money
+from app.infrastructure.database import Database
+from app.logger import logger
+
+TYPE_NAMES = {"expense": ("расход", "расхода", "расходов"), "income": ("доход", "дохода", "доходов")}
+
+
+def plural(n: int, forms: Tuple[str, str, str]) -> str:
+    if n % 10 == 1 and n % 100 != 11:
+        return forms[0]
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return forms[1]
+    return forms[2]
+
+
+def render_notification(rows: List[Dict]) -> str:
+    """Одно сообщение получателю: операции сгруппированы по счёту, автору и типу"""
+    groups: Dict[Tuple[str, str, str, str], List[float]] = {}
+    for row in rows:
+        key = (row["account"], row["currency"], row["actor"], row["type"])
+        groups.setdefault(key, []).append(row["amount"])
+    lines = ["👥 Новое в общих счетах:\n"]
+    for (account, currency, actor, kind), amounts in groups.items():
+        count = len(amounts)
+        total = fmt_money(sum(amounts), 2, currency)
+        lines.append(f"• {account} — @{actor}: {count} {plural(count, TYPE_NAMES[kind])} на {total}")
+    return "\n".join(lines)
+
+
+class NotificationDispatcher:
+    """
+    Рассылка уведомлений участникам общих счетов из notification_outbox.
+
+    Строки outbox пишутся в одной транзакции с операцией, поэтому уведомление не теряется
+    и не уходит за откатившуюся запись. Диспетчер раз в notify_poll_seconds забирает
+    получателей, чья самая старая строка ждёт дольше notify_window_seconds, и отправляет
+    каждому одно сообщение на все накопившиеся операции. Строки удаляются после отправки:
+    при сбое между отправкой и удалением сообщение может прийти повторно, но не пропадёт.
+    """
+
+    def __init__(self, bot: Bot, db: Database):
+        self._bot = bot
+        self._db = db
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Ошибка рассылки уведомлений")
+            await asyncio.sleep(settings.notify_poll_seconds)
+
+    async def run(self, now: Optional[datetime] = None) -> int:
+        """Один проход по outbox; возвращает число отправленных сообщений"""
+        ready_before = (now or datetime.utcnow()) - timedelta(seconds=settings.notify_window_seconds)
+        rows = await self._db.get_pending_notifications(ready_before, settings.notify_batch_size)
+        by_recipient: Dict[int, List[Dict]] = {}
+        for row in rows:
+            by_recipient.setdefault(row["telegram_id"], []).append(row)
+        sent = 0
+        for chat_id, recipient_rows in by_recipient.items():
+            delivered = await send_text(self._bot, chat_id, render_notification(recipient_rows), "Уведомление")
+            if delivered is None:
+                # временная ошибка — строки остаются до следующего прохода
+                continue
+            await self._db.delete_notifications([row["id"] for row in recipient_rows])
+            sent += int(delivered)
+        return sent
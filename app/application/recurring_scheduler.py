@@ -0,0 +1,85 @@
+import asyncio
+import heapq
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+from app.infrastructure.database import Database
+from app.logger import logger
+
+
+class RecurringScheduler:
+    """
+    Планировщик повторяющихся операций внутри процесса.
+
+    Держит min-heap (next_run, rule_id) и спит до ближайшего срока, а не опрашивает
+    все правила. На каждом тике все созревшие правила проводятся одним вызовом
+    Database.materialize_recurring; идемпотентность обеспечивает таблица recurring_runs.
+    """
+
+    def __init__(self, db: Database, max_sleep: float = 3600.0):
+        self._db = db
+        self._heap: List[Tuple[date, int]] = []
+        self._wakeup = asyncio.Event()
+        self._max_sleep = max_sleep
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        for rule_id, next_run in await self._db.get_recurring_schedule():
+            heapq.heappush(self._heap, (next_run, rule_id))
+        logger.info("Планировщик повторов: загружено правил %d", len(self._heap))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, rule_id: int, next_run: date) -> None:
+        """Добавить новое правило в расписание без перечитывания БД"""
+        heapq.heappush(self._heap, (next_run, rule_id))
+        self._wakeup.set()
+
+    def _seconds_until(self, due: date) -> float:
+        now = datetime.utcnow()
+        due_at = datetime(due.year, due.month, due.day)
+        return max(0.0, (due_at - now).total_seconds())
+
+    async def _run(self) -> None:
+        while True:
+            timeout = self._max_sleep
+            if self._heap:
+                timeout = min(timeout, self._seconds_until(self._heap[0][0]))
+            if timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._tick()
+            except Exception:
+                logger.exception("Ошибка проведения повторяющихся операций")
+                await asyncio.sleep(60)
+
+    async def _tick(self) -> None:
+        today = datetime.utcnow().date()
+        due_ids = set()
+        while self._heap and self._heap[0][0] <= today:
+            due_ids.add(heapq.heappop(self._heap)[1])
+        if not due_ids:
+            return
+        try:
+            schedule = await self._db.materialize_recurring(sorted(due_ids), today)
+        except Exception:
+            # вернуть правила в кучу, чтобы повторить попытку позже
+            for rule_id in due_ids:
+                heapq.heappush(self._heap, (today, rule_id))
+            raise
+        for rule_id, next_run in schedule.items():
+            heapq.heappush(self._heap, (next_run, rule_id))
+        logger.info("Проведены повторы правил: %d", len(schedule))
@@ -0,0 +1,35 @@
+import asyncio
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from app.logger import logger
+
+# Сколько раз повторять отправку после TelegramRetryAfter, прежде чем отложить сообщение
+SEND_RETRIES = 3
+
+
+async def send_text(bot: Bot, chat_id: int, text: str, what: str = "Сообщение") -> Optional[bool]:
+    """
+    Отправка сообщения фоновыми рассылками (уведомления, сводки).
+    True — отправлено, False — получатель недоступен (повторять бессмысленно),
+    None — временная ошибка или Telegram просит ждать дольше SEND_RETRIES раз: повторить позже
+    """
+    for attempt in range(SEND_RETRIES + 1):
+        try:
+            await bot.send_message(chat_id, text)
+            return True
+        except TelegramRetryAfter as e:
+            if attempt == SEND_RETRIES:
+                logger.warning("%s %s отложено: Telegram просит подождать %s с", what, chat_id, e.retry_after)
+                return None
+            await asyncio.sleep(e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # пользователь заблокировал бота или чат недоступен — пропускаем
+            logger.warning("%s не доставлено %s: %s", what, chat_id, e)
+            return False
+        except Exception as e:
+            logger.warning("%s %s отложено: %s", what, chat_id, e)
+            return None
+    return None
@@ -0,0 +1,164 @@
+import calendar
+from datetime import date, timedelta
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+EPOCH = date(1970, 1, 1)
+NO_CATEGORY = 0
+MA_WINDOW = 7
+TREND_WEEKS = 8
+
+
+def day_index(day: date) -> int:
+    return (day - EPOCH).days
+
+
+def day_from_index(index: int) -> date:
+    return EPOCH + timedelta(days=int(index))
+
+
+def weekday_of(index: int) -> int:
+    """День недели по индексу дня (0 — понедельник); 01.01.1970 — четверг"""
+    return (int(index) + 3) % 7
+
+
+class TransactionColumns:
+    """
+    Операции пользователя в столбцах: день (дни от эпохи), код категории (0 — без категории)
+    и сумма со знаком (доход +, расход −).
+
+    Массивы выделяются с запасом и удваиваются при заполнении, поэтому дозагрузка новых
+    операций дописывает хвост, не копируя всё на каждый вызов. last_id — id последней
+    загруженной операции, с него начинается следующая дозагрузка.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self._day = np.empty(capacity, dtype=np.int32)
+        self._category = np.empty(capacity, dtype=np.int32)
+        self._amount = np.empty(capacity, dtype=np.float64)
+        self._size = 0
+        self.last_id = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def day(self) -> np.ndarray:
+        return self._day[: self._size]
+
+    @property
+    def category(self) -> np.ndarray:
+        return self._category[: self._size]
+
+    @property
+    def amount(self) -> np.ndarray:
+        return self._amount[: self._size]
+
+    def extend(self, rows: Sequence[Tuple[int, Any, int, float]]) -> None:
+        """Дописать строки (id, created_at, category_id, сумма со знаком) в порядке id"""
+        if not rows:
+            return
+        ids, created, categories, amounts = zip(*rows)
+        size = self._size + len(rows)
+        if size > len(self._day):
+            capacity = max(size, 2 * len(self._day))
+            self._day = np.resize(self._day, capacity)
+            self._category = np.resize(self._category, capacity)
+            self._amount = np.resize(self._amount, capacity)
+        days = np.array(created, dtype="datetime64[us]").astype("datetime64[D]").astype(np.int32)
+        self._day[self._size : size] = days
+        self._category[self._size : size] = np.array(categories, dtype=np.int32)
+        self._amount[self._size : size] = np.array(amounts, dtype=np.float64)
+        self._size = size
+        self.last_id = max(self.last_id, max(ids))
+
+
+def daily_expense(cols: TransactionColumns, start: int, end: int) -> np.ndarray:
+    """Расход по дням на отрезке индексов [start, end)"""
+    day, amount = cols.day, cols.amount
+    mask = (day >= start) & (day < end) & (amount < 0)
+    return np.bincount(day[mask] - start, weights=-amount[mask], minlength=end - start)
+
+
+def weekly_totals(daily: np.ndarray, start: int) -> np.ndarray:
+    """Суммы по календарным неделям (с понедельника) для дневного ряда, начинающегося с индекса start"""
+    head = weekday_of(start)
+    tail = -(head + len(daily)) % 7
+    padded = np.concatenate((np.zeros(head), daily, np.zeros(tail)))
+    return padded.reshape(-1, 7).sum(axis=1)
+
+
+def moving_average(series: np.ndarray, window: int = MA_WINDOW) -> np.ndarray:
+    """Скользящее среднее; в начале ряда — среднее по имеющимся точкам"""
+    csum = np.cumsum(series, dtype=np.float64)
+    shifted = np.zeros(len(csum))
+    shifted[window:] = csum[:-window]
+    counts = np.minimum(np.arange(1, len(series) + 1), window)
+    return (csum - shifted) / counts
+
+
+def category_expense(cols: TransactionColumns, start: int, end: int, size: int) -> np.ndarray:
+    """Расход по кодам категорий на отрезке [start, end); индекс массива — код категории"""
+    day, amount = cols.day, cols.amount
+    mask = (day >= start) & (day < end) & (amount < 0)
+    return np.bincount(cols.category[mask], weights=-amount[mask], minlength=size)
+
+
+def project_month_end(month_daily: np.ndarray, days_in_month: int, window: int = MA_WINDOW) -> float:
+    """Прогноз расхода на конец месяца: потрачено + средний расход последних window дней × оставшиеся дни"""
+    elapsed = len(month_daily)
+    if elapsed == 0:
+        return 0.0
+    rate = month_daily[-min(window, elapsed) :].mean()
+    return float(month_daily.sum() + rate * (days_in_month - elapsed))
+
+
+def compute_trend(cols: TransactionColumns, today: date, weeks: int = TREND_WEEKS) -> Dict[str, Any]:
+    """
+    Тренд расходов на дату today (включительно):
+    недельные суммы, скользящее среднее, прогноз на конец месяца и изменения
+    по категориям относительно того же числа дней прошлого месяца.
+    """
+    end = day_index(today) + 1
+    month_start = day_index(today.replace(day=1))
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    prev_first = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+    prev_start = day_index(prev_first)
+    # сравниваем одинаковое число дней: 1–N текущего и 1–N прошлого месяца
+    prev_end = min(prev_start + (end - month_start), month_start)
+
+    # неделя, с которой начинается ряд: понедельник weeks-1 недель назад
+    series_start = end - 1 - weekday_of(end - 1) - 7 * (weeks - 1)
+    start = min(series_start, prev_start)
+    daily = daily_expense(cols, start, end)
+    month_daily = daily[month_start - start :]
+    weekly = weekly_totals(daily[series_start - start :], series_start)
+    ma = moving_average(daily)
+
+    size = int(cols.category.max()) + 1 if len(cols) else 1
+    current = category_expense(cols, month_start, end, size)
+    previous = category_expense(cols, prev_start, prev_end, size)
+    delta = current - previous
+    codes = np.flatnonzero((current > 0) | (previous > 0))
+    codes = codes[np.argsort(-np.abs(delta[codes]), kind="stable")]
+
+    categories: List[Dict[str, Any]] = [
+        {
+            "code": int(code),
+            "current": float(current[code]),
+            "previous": float(previous[code]),
+            "delta": float(delta[code]),
+        }
+        for code in codes
+    ]
+    return {
+        "today": today,
+        "month_spent": float(month_daily.sum()),
+        "prev_month_spent": float(previous.sum()),
+        "projection": project_month_end(month_daily, days_in_month),
+        "days_in_month": days_in_month,
+        "daily_average": float(ma[-1]),
+        "weekly": [(day_from_index(series_start + 7 * i), float(total)) for i, total in enumerate(weekly)],
+        "categories": categories,
+    }
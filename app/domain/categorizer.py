@@ -0,0 +1,67 @@
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Слова комментария: только буквы, не короче трёх ("на", "в" ничего не говорят о категории)
+_WORD = re.compile(r"[^\W\d_]{3,}")
+# Сколько слов комментария учитывается: подсказка стоит O(слов) и на длинном тексте
+TOKENS_PER_COMMENT = 8
+# Счётчик слова делится пополам, когда сумма по нему доходит до этого значения:
+# индекс помнит привычку, но новая быстро её перевешивает
+TOKEN_COUNT_CAP = 32
+
+
+def comment_tokens(comment: str) -> List[str]:
+    """Слова комментария для индекса: нижний регистр, ё -> е, без повторов"""
+    words = _WORD.findall(comment.lower().replace("ё", "е"))
+    return list(dict.fromkeys(words))[:TOKENS_PER_COMMENT]
+
+
+class CategoryIndex:
+    """
+    Частоты категорий по словам комментариев одного пользователя: {слово: {category_id: сколько раз}}.
+
+    Память ограничена max_tokens словами: при переполнении вытесняется слово, которое
+    дольше всех не встречалось. Подсказка — голосование слов комментария, O(слов).
+    """
+
+    __slots__ = ("_max_tokens", "_tokens")
+
+    def __init__(self, max_tokens: int):
+        self._max_tokens = max_tokens
+        self._tokens: "OrderedDict[str, Dict[int, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def learn(self, comment: str, category_id: int) -> None:
+        for token in comment_tokens(comment):
+            counts = self._tokens.get(token)
+            if counts is None:
+                counts = self._tokens[token] = {}
+                if len(self._tokens) > self._max_tokens:
+                    self._tokens.popitem(last=False)
+            else:
+                self._tokens.move_to_end(token)
+            counts[category_id] = counts.get(category_id, 0) + 1
+            if sum(counts.values()) >= TOKEN_COUNT_CAP:
+                for cid in list(counts):
+                    counts[cid] //= 2
+                    if not counts[cid]:
+                        del counts[cid]
+
+    def learn_many(self, history: Iterable[Tuple[str, int]]) -> None:
+        """Заполнить по истории (комментарий, категория) от старых операций к новым"""
+        for comment, category_id in history:
+            self.learn(comment, category_id)
+
+    def suggest(self, comment: str) -> Optional[Tuple[int, int, float]]:
+        """(category_id, голосов за неё, доля голосов) или None, если ни одно слово не знакомо"""
+        votes: Dict[int, int] = {}
+        for token in comment_tokens(comment):
+            for cid, count in self._tokens.get(token, {}).items():
+                votes[cid] = votes.get(cid, 0) + count
+        if not votes:
+            return None
+        category_id = max(votes, key=votes.__getitem__)
+        return category_id, votes[category_id], votes[category_id] / sum(votes.values())
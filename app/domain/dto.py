@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+
+class DictCompat:
+    """
+    Совместимость с прежними словарями строк: account["name"], stats.get("currency").
+    Новый код обращается к атрибутам; чтение по ключу оставлено для старых потребителей
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key: str) -> bool:
+        return hasattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+
+@dataclass(frozen=True, slots=True)
+class Account(DictCompat):
+    """Доступный пользователю счёт. Порядок полей — порядок столбцов запросов, строка
+    результата разворачивается в конструктор как есть: Account(*row)"""
+
+    id: int
+    name: str
+    owner_id: Optional[int]
+    currency: str
+    owner_username: Optional[str]
+    role: str  # owner | shared
+
+    def with_balance(self, balance: float) -> "AccountWithBalance":
+        return AccountWithBalance(
+            self.id, self.name, self.owner_id, self.currency, self.owner_username, self.role, balance
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class AccountWithBalance(Account):
+    balance: float
+
+    def without_balance(self) -> Account:
+        """Счёт для справочника доступа: баланс там устарел бы"""
+        return Account(self.id, self.name, self.owner_id, self.currency, self.owner_username, self.role)
+
+
+@dataclass(frozen=True, slots=True)
+class CategoryTotal(DictCompat):
+    name: str
+    amount: float
+    percentage: float  # доля от суммы расходов
+
+
+@dataclass(frozen=True, slots=True)
+class StatsSummary(DictCompat):
+    """Статистика за период в базовой валюте пользователя; categories — расходы по убыванию суммы.
+    missing_rates — валюты без курса: их операции в итоги не вошли"""
+
+    total_income: float
+    total_expense: float
+    categories: Tuple[CategoryTotal, ...]
+    currency: str
+    missing_rates: Tuple[str, ...] = ()
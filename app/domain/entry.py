@@ -0,0 +1,120 @@
+import re
+from datetime import date
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+# Сколько строк принимается в одном сообщении с несколькими расходами
+MAX_BATCH_LINES = 50
+
+# "<сумма> [категория] [комментарий]": сумма — положительное число, до двух знаков после точки/запятой
+_LINE = re.compile(r"(?P<amount>\d+(?:[.,]\d{1,2})?)(?:\s+(?P<rest>.*))?")
+
+
+def parse_amount(token: str) -> Optional[float]:
+    try:
+        amount = float(token.replace(",", "."))
+    except ValueError:
+        return None
+    return amount if amount > 0 else None
+
+
+def parse_expense_lines(
+    text: str, categories: Mapping[str, int], default_category: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Разбор нескольких расходов, по одному в строке: "500 еда обед".
+
+    Первое слово после суммы считается категорией, если это известная категория
+    (categories: название -> id), иначе берётся default_category, а слово уходит в
+    комментарий. Строки проверяются все сразу: возвращаются разобранные позиции и
+    ошибки с номерами строк; при любой ошибке записывать нельзя ничего.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    entries: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    if not lines:
+        return entries, ["нет ни одной строки с расходом"]
+    if len(lines) > MAX_BATCH_LINES:
+        return entries, [f"слишком много строк: {len(lines)}, максимум {MAX_BATCH_LINES}"]
+
+    for number, line in enumerate(lines, 1):
+        match = _LINE.fullmatch(line)
+        amount = parse_amount(match["amount"]) if match else None
+        if amount is None:
+            errors.append(f"строка {number}: «{line}» — нужна сумма в начале, например «500 еда обед»")
+            continue
+        words = (match["rest"] or "").split()
+        category = default_category
+        if words and words[0].lower() in categories:
+            category = words.pop(0).lower()
+        if category not in categories:
+            errors.append(f"строка {number}: «{line}» — не указана категория ({', '.join(categories)})")
+            continue
+        entries.append(
+            {"amount": amount, "category": category, "category_id": categories[category], "comment": " ".join(words)}
+        )
+    return entries, errors
+
+
+# Быстрый ввод одной строкой: "[+|-]<сумма> [счёт] [категория] [комментарий]".
+# "+" — доход, без знака или "-" — расход; счёт и категория — в любом порядке в начале
+QUICK_ENTRY = re.compile(r"\s*(?P<sign>[+-])?\s*(?P<amount>\d+(?:[.,]\d{1,2})?)(?:\s+(?P<rest>.*?))?\s*$")
+
+
+def parse_quick_entry(
+    text: str, accounts: Mapping[str, Any], categories: Mapping[str, int]
+) -> Optional[Dict[str, Any]]:
+    """
+    Разбор быстрого ввода: "350 еда кофе", "-350 Карта кофе", "+5000 Карта зарплата".
+
+    accounts — счета пользователя по названию в нижнем регистре, categories — id категорий
+    по названию. Не распознанные счёт/категория остаются None — их уточняет обычный сценарий.
+    None — текст не похож на операцию.
+    """
+    match = QUICK_ENTRY.match(text)
+    if not match:
+        return None
+    amount = parse_amount(match["amount"])
+    if amount is None:
+        return None
+    transaction_type = "income" if match["sign"] == "+" else "expense"
+    words = (match["rest"] or "").split()
+    account = category = None
+    while words:
+        word = words[0].lower()
+        if account is None and word in accounts:
+            account = accounts[word]
+        elif transaction_type == "expense" and category is None and word in categories:
+            category = word
+        else:
+            break
+        words.pop(0)
+    return {
+        "type": transaction_type,
+        "amount": amount,
+        "account": account,
+        "category": category,
+        "category_id": categories[category] if category else None,
+        "comment": " ".join(words),
+    }
+
+
+def parse_date(token: str, today: date) -> Optional[date]:
+    """Дата из "01.03.2025", "1.3.25", "01.03" (текущий год) или "2025-03-01"; None — не дата"""
+    token = token.strip()
+    try:
+        if "-" in token:
+            return date.fromisoformat(token)
+        parts = [int(part) for part in token.split(".")]
+    except ValueError:
+        return None
+    if len(parts) == 2:
+        parts.append(today.year)
+    if len(parts) != 3:
+        return None
+    day, month, year = parts
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
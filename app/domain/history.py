@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+from typing import Tuple
+
+_EPOCH = datetime(1970, 1, 1)
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _b36(value: int) -> str:
+    if value == 0:
+        return "0"
+    out = []
+    while value:
+        value, rem = divmod(value, 36)
+        out.append(_DIGITS[rem])
+    return "".join(reversed(out))
+
+
+def encode_cursor(created_at: datetime, transaction_id: int) -> str:
+    """Курсор (created_at, id) в компактную строку для callback_data (лимит Telegram — 64 байта).
+    Время хранится в микросекундах, чтобы ключ сравнивался точно."""
+    micros = (created_at - _EPOCH) // timedelta(microseconds=1)
+    return f"{_b36(micros)}.{_b36(transaction_id)}"
+
+
+def decode_cursor(value: str) -> Tuple[datetime, int]:
+    micros, transaction_id = value.split(".", 1)
+    return _EPOCH + timedelta(microseconds=int(micros, 36)), int(transaction_id, 36)
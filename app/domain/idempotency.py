@@ -0,0 +1,32 @@
+from collections import OrderedDict
+
+
+def message_key(chat_id: int, message_id: int) -> str:
+    """Ключ идемпотентности операции из сообщения: повторная доставка приходит с теми же chat_id и message_id"""
+    return f"{chat_id}:{message_id}"
+
+
+class RecentKeys:
+    """Ограниченное множество недавних ключей: при переполнении вытесняются самые старые"""
+
+    def __init__(self, maxlen: int):
+        self._maxlen = maxlen
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: str) -> bool:
+        """Запомнить ключ. False — ключ уже был"""
+        if key in self._keys:
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self._maxlen:
+            self._keys.popitem(last=False)
+        return True
+
+    def discard(self, key: str) -> None:
+        self._keys.pop(key, None)
@@ -0,0 +1,62 @@
+# Helpers for money formatting
+from datetime import date
+from typing import Iterable, List, Optional, Tuple
+
+# Курсы в exchange_rates хранятся в рублях за единицу валюты; у рубля курс всегда 1
+REFERENCE_CURRENCY = "RUB"
+DEFAULT_CURRENCY = "RUB"
+CURRENCY_SYMBOLS = {"RUB": "₽", "USD": "$", "EUR": "€", "GBP": "£", "CNY": "¥", "KZT": "₸", "GEL": "₾", "TRY": "₺"}
+# Как валюту можно написать в команде, кроме трёхбуквенного кода
+CURRENCY_ALIASES = {"руб": "RUB", "р": "RUB", "₽": "RUB", "$": "USD", "€": "EUR", "£": "GBP", "¥": "CNY"}
+
+
+def fmt_amount(amount: float, decimals: int = 2) -> str:
+    try:
+        return format(amount, f",.{decimals}f").replace(",", " ")
+    except Exception:
+        # Fallback to simple format
+        return f"{amount:.{decimals}f}"
+
+
+def fmt_money(amount: float, decimals: int = 2, currency: str = DEFAULT_CURRENCY) -> str:
+    return f"{fmt_amount(amount, decimals)} {CURRENCY_SYMBOLS.get(currency, currency)}"
+
+
+def parse_currency(token: str) -> Optional[str]:
+    """Код валюты из "usd", "USD", "$", "руб"; None — не валюта"""
+    token = token.strip()
+    alias = CURRENCY_ALIASES.get(token.lower())
+    if alias:
+        return alias
+    code = token.upper()
+    return code if code in CURRENCY_SYMBOLS else None
+
+
+def parse_rate_lines(lines: Iterable[str], today: date) -> Tuple[List[Tuple[date, str, float]], List[str]]:
+    """
+    Курсы из строк "2025-03-01,USD,91.5" или "USD 91.5" (на сегодня): рублей за единицу.
+    Пустые строки и строки с # пропускаются. Возвращает (курсы, ошибки с номерами строк).
+    """
+    rates: List[Tuple[date, str, float]] = []
+    errors: List[str] = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = [part.strip() for part in line.replace(";", ",").replace(",", " ").split()]
+        try:
+            if len(parts) == 3:
+                day, code, value = date.fromisoformat(parts[0]), parts[1], float(parts[2])
+            elif len(parts) == 2:
+                day, code, value = today, parts[0], float(parts[1])
+            else:
+                raise ValueError(line)
+        except ValueError:
+            errors.append(f"строка {number}: ожидается 'дата,валюта,курс' — {line}")
+            continue
+        currency = parse_currency(code)
+        if currency is None or value <= 0:
+            errors.append(f"строка {number}: неизвестная валюта или неверный курс — {line}")
+            continue
+        rates.append((day, currency, value))
+    return rates, errors
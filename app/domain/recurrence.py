@@ -0,0 +1,59 @@
+import calendar
+from datetime import date, timedelta
+from typing import List, Tuple
+
+MONTHLY = "monthly"
+WEEKLY = "weekly"
+PERIODS = (MONTHLY, WEEKLY)
+
+# Сколько пропущенных повторов догоняем за один проход (защита от многолетнего простоя)
+MAX_CATCH_UP = 366
+
+WEEKDAYS = {"пн": 1, "вт": 2, "ср": 3, "чт": 4, "пт": 5, "сб": 6, "вс": 7}
+
+
+def _monthly_on(year: int, month: int, day: int) -> date:
+    # 31-е число в коротком месяце — последний день месяца
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+def first_occurrence(period: str, day: int, start: date) -> date:
+    """Первая дата повтора, не раньше start"""
+    if period == WEEKLY:
+        return start + timedelta(days=(day - start.isoweekday()) % 7)
+    candidate = _monthly_on(start.year, start.month, day)
+    if candidate >= start:
+        return candidate
+    return next_occurrence(period, day, start)
+
+
+def next_occurrence(period: str, day: int, after: date) -> date:
+    """Следующая дата повтора строго после after"""
+    if period == WEEKLY:
+        return first_occurrence(period, day, after + timedelta(days=1))
+    year, month = (after.year + 1, 1) if after.month == 12 else (after.year, after.month + 1)
+    candidate = _monthly_on(after.year, after.month, day)
+    if candidate > after:
+        return candidate
+    return _monthly_on(year, month, day)
+
+
+def due_dates(period: str, day: int, next_run: date, today: date) -> Tuple[List[date], date]:
+    """Все даты повтора с next_run по today включительно и новая next_run"""
+    dates: List[date] = []
+    current = next_run
+    while current <= today and len(dates) < MAX_CATCH_UP:
+        dates.append(current)
+        current = next_occurrence(period, day, current)
+    return dates, current
+
+
+def parse_day(token: str) -> Tuple[str, int]:
+    """'15' -> (monthly, 15), 'пн' -> (weekly, 1). ValueError при неверном формате"""
+    token = token.strip().lower()
+    if token in WEEKDAYS:
+        return WEEKLY, WEEKDAYS[token]
+    day = int(token)
+    if not 1 <= day <= 31:
+        raise ValueError(token)
+    return MONTHLY, day
@@ -1,25 +1,62 @@
+import asyncio
+import time
 from abc import ABC
-from app.infrastructure.config import get_session
-from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Callable, Optional
+from app.config import settings
+from app.infrastructure.config import get_read_session, get_session
+from app.infrastructure.routing import read_your_writes
+from app.logger import logger
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from contextlib import asynccontextmanager
 
 
 class BaseStorage(ABC):
-    def __init__(self):
-        self.__Session = get_session()
+    def __init__(
+        self,
+        database_url: Optional[str] = None,
+        read_session: Optional[async_sessionmaker] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.__Session = get_session(database_url)
+        # read_session — фабрика сессий реплики вместо database_read_url
+        self.__ReadSession = read_session or get_read_session()
+        self.__clock = clock
+        self.__replica_down_until = 0.0
+
+    @staticmethod
+    def _autocommit_session(maker: async_sessionmaker) -> AsyncSession:
+        return maker(bind=maker.kw["bind"].execution_options(isolation_level="AUTOCOMMIT"))
+
+    async def _open_read_session(self, primary: bool = False) -> AsyncSession:
+        """Сессия на реплике, если она настроена, доступна и пользователь не писал только что.
+        primary — читать с primary всегда: данные, которые нельзя брать с отстающей реплики"""
+        if (
+            not primary
+            and self.__ReadSession is not None
+            and self.__clock() >= self.__replica_down_until
+            and not read_your_writes.needs_primary()
+        ):
+            session = self._autocommit_session(self.__ReadSession)
+            try:
+                # соединение берём сразу, чтобы при недоступной реплике уйти на primary
+                await session.connection()
+                return session
+            except (DBAPIError, OSError, asyncio.TimeoutError) as e:
+                await session.close()
+                self.__replica_down_until = self.__clock() + settings.replica_retry_seconds
+                logger.warning("Реплика недоступна, читаем с primary: %s", e)
+        return self._autocommit_session(self.__Session)
 
     @asynccontextmanager
-    async def session_scope(self, read_only=False):
-        session: AsyncSession = self.__Session()
+    async def session_scope(self, read_only=False, primary=False):
+        session: AsyncSession = await self._open_read_session(primary) if read_only else self.__Session()
         try:
-            if read_only:
-                session = self.__Session(
-                    bind=session.bind.execution_options(isolation_level="AUTOCOMMIT")  # type: ignore
-                )
             yield session
             if not read_only:
                 await session.commit()
+                read_your_writes.mark_write()
         except Exception:
             await session.rollback()
             raise
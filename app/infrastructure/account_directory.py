@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from app.domain.dto import Account, AccountWithBalance
+
+
+class AccountDirectory:
+    """
+    Кэш в памяти процесса: telegram_id -> user_id и пользователь -> доступные счета
+    (id, название, владелец, роль) с индексами по id и по названию.
+
+    Счета пользователя загружаются одним запросом и живут ttl секунд (LRU на max_users
+    пользователей); create_account и share_account сбрасывают записи затронутых
+    пользователей. Сброшенная запись перечитывается с primary (stale): отстающая реплика
+    вернула бы прежний список, и он закэшировался бы на весь ttl. Проверка доступа к
+    счёту из колбэка — поиск в словаре, без запроса к БД.
+    """
+
+    def __init__(self, max_users: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self._max_users = max_users
+        self._ttl = ttl
+        self._clock = clock
+        self._accounts: "OrderedDict[int, Tuple[float, Dict[int, Account], Dict[str, Account]]]" = OrderedDict()
+        # telegram_id -> users.id: строка пользователя не меняется после создания
+        self._user_ids: "OrderedDict[int, int]" = OrderedDict()
+        # пользователи, чьи записи сброшены после изменения доступа и ещё не перечитаны
+        self._stale: "OrderedDict[int, None]" = OrderedDict()
+
+    def user_id(self, telegram_id: int) -> Optional[int]:
+        user_id = self._user_ids.get(telegram_id)
+        if user_id is not None:
+            self._user_ids.move_to_end(telegram_id)
+        return user_id
+
+    def remember_user(self, telegram_id: int, user_id: int) -> None:
+        self._user_ids[telegram_id] = user_id
+        self._user_ids.move_to_end(telegram_id)
+        if len(self._user_ids) > self._max_users:
+            self._user_ids.popitem(last=False)
+
+    def _entry(self, user_id: int) -> Optional[Tuple[float, Dict[int, Account], Dict[str, Account]]]:
+        entry = self._accounts.get(user_id)
+        if entry is None:
+            return None
+        if self._clock() >= entry[0]:
+            del self._accounts[user_id]
+            return None
+        self._accounts.move_to_end(user_id)
+        return entry
+
+    def accounts(self, user_id: int) -> Optional[Dict[int, Account]]:
+        """Доступные счета по id или None, если записи нет (или она устарела)"""
+        entry = self._entry(user_id)
+        return entry[1] if entry else None
+
+    def by_name(self, user_id: int) -> Optional[Dict[str, Account]]:
+        entry = self._entry(user_id)
+        return entry[2] if entry else None
+
+    def put(self, user_id: int, accounts: Sequence[Account]) -> Dict[int, Account]:
+        by_id: Dict[int, Account] = {}
+        by_name: Dict[str, Account] = {}
+        # при совпадении названий свой счёт важнее расшаренного
+        for account in sorted(accounts, key=lambda a: a.role != "owner"):
+            entry = account.without_balance() if isinstance(account, AccountWithBalance) else account
+            by_id[entry.id] = entry
+            by_name.setdefault(entry.name, entry)
+        self._accounts[user_id] = (self._clock() + self._ttl, by_id, by_name)
+        self._stale.pop(user_id, None)
+        self._accounts.move_to_end(user_id)
+        if len(self._accounts) > self._max_users:
+            self._accounts.popitem(last=False)
+        return by_id
+
+    def invalidate(self, *user_ids: int) -> None:
+        for user_id in user_ids:
+            self._accounts.pop(user_id, None)
+            self._stale[user_id] = None
+            self._stale.move_to_end(user_id)
+        while len(self._stale) > self._max_users:
+            self._stale.popitem(last=False)
+
+    def stale(self, user_id: int) -> bool:
+        """Доступ пользователя менялся после последней загрузки: читать счета с primary"""
+        return user_id in self._stale
@@ -0,0 +1,199 @@
+from typing import Dict, List, Optional
+
+import asyncpg
+
+from app.config import settings
+from app.domain.dto import Account, AccountWithBalance
+from app.infrastructure.budget_storage import BudgetStorage
+from app.infrastructure.config import get_database_url
+
+# Горячие запросы. asyncpg готовит каждый из них один раз на соединение пула
+# (именованное серверное выражение из кэша statement_cache) и дальше шлёт только Bind/Execute.
+# Собственные имена (conn.prepare(..., name=...)) не используются: объект PreparedStatement
+# привязан к одной выдаче соединения из пула и после release() становится недействительным,
+# а повторный prepare под тем же именем сервер отвергает. Кэш asyncpg живёт вместе с
+# соединением и даёт тот же единственный Parse на соединение.
+_STATEMENTS: Dict[str, str] = {
+    "user_by_tg": "SELECT id FROM users WHERE telegram_id = $1",
+    "user_insert": """
+        INSERT INTO users (telegram_id, username) VALUES ($1, $2)
+        ON CONFLICT (telegram_id) DO UPDATE SET telegram_id = EXCLUDED.telegram_id
+        RETURNING id
+    """,
+    "outbox_insert": """
+        INSERT INTO notification_outbox (recipient_id, account_id, actor_id, type, amount)
+        SELECT m.user_id, $1, $2, $3, $4
+        FROM (
+            SELECT owner_id AS user_id FROM accounts WHERE id = $1
+            UNION
+            SELECT hm.user_id FROM household_members hm
+            JOIN accounts a ON a.household_id = hm.household_id
+            WHERE a.id = $1
+        ) m
+        WHERE m.user_id <> $2
+    """,
+    "account_balance": """
+        SELECT COALESCE((SELECT balance FROM account_balance_carry WHERE account_id = $1), 0)
+             + COALESCE((SELECT SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END)
+                         FROM transactions WHERE account_id = $1), 0)
+    """,
+    "user_accounts": """
+        SELECT acc.id, acc.name, acc.owner_id, acc.currency, acc.owner_username, acc.role,
+               COALESCE((SELECT c.balance FROM account_balance_carry c WHERE c.account_id = acc.id), 0)
+               + (SELECT COALESCE(SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE -t.amount END), 0)
+                  FROM transactions t WHERE t.account_id = acc.id) AS balance
+        FROM (
+            SELECT a.id, a.name, a.owner_id, a.currency, u.username AS owner_username,
+                   CASE WHEN a.owner_id = $1 THEN 'owner' ELSE 'shared' END AS role
+            FROM accounts a
+            LEFT JOIN users u ON a.owner_id = u.id
+            WHERE (a.owner_id = $1
+                   OR a.household_id IN (SELECT m.household_id FROM household_members m WHERE m.user_id = $1))
+        ) acc
+        ORDER BY acc.name
+    """,
+    "account_by_name": """
+        SELECT a.id, a.name, a.owner_id, a.currency, u.username AS owner_username,
+               CASE WHEN a.owner_id = $1 THEN 'owner' ELSE 'shared' END AS role
+        FROM accounts a
+        LEFT JOIN users u ON a.owner_id = u.id
+        WHERE (a.owner_id = $1
+               OR a.household_id IN (SELECT m.household_id FROM household_members m WHERE m.user_id = $1))
+          AND a.name = $2
+        ORDER BY a.owner_id = $1 DESC
+        LIMIT 1
+    """,
+    "category_by_name": "SELECT id FROM categories WHERE name = $1",
+    "transaction_insert": """
+        INSERT INTO transactions (account_id, user_id, type, amount, category_id, comment, idempotency_key)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id
+    """,
+    "limit_usage_bump": """
+        WITH lim AS (
+            SELECT id, account_id, amount FROM budget_limits
+            WHERE category_id = $1 AND account_id IS NULL AND user_id = $2
+            UNION ALL
+            SELECT id, account_id, amount FROM budget_limits
+            WHERE category_id = $1 AND account_id = $3
+        ), usage AS (
+            INSERT INTO budget_limit_usage (limit_id, month, spent)
+            SELECT id, $4, $5 FROM lim
+            ON CONFLICT (limit_id, month)
+            DO UPDATE SET spent = budget_limit_usage.spent + EXCLUDED.spent
+            RETURNING limit_id, spent
+        )
+        SELECT lim.id, lim.account_id, lim.amount, usage.spent
+        FROM lim JOIN usage ON usage.limit_id = lim.id
+    """,
+}
+
+
+def _to_dsn(url: str) -> str:
+    # asyncpg понимает только postgresql://, без указания драйвера SQLAlchemy
+    return url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+class AsyncpgBudgetStorage(BudgetStorage):
+    """
+    Быстрый путь для горячих запросов обработчиков: напрямую через asyncpg.Pool
+    с подготовленными выражениями (кэш asyncpg), без компиляции SQLAlchemy и
+    обработки результатов. Записи разбираются по позиции. Остальные методы
+    (DDL, отчёты, фоновые задачи) наследуются из BudgetStorage.
+
+    Все запросы быстрого пути идут на primary: реплика (database_read_url)
+    используется только унаследованными методами.
+    """
+
+    def __init__(self, database_url: Optional[str] = None):
+        super().__init__(database_url)
+        self._dsn = _to_dsn(get_database_url(database_url))
+        self._pool: Optional[asyncpg.Pool] = None
+
+    async def connect(self) -> None:
+        self._pool = await asyncpg.create_pool(
+            self._dsn,
+            min_size=settings.asyncpg_pool_min_size,
+            max_size=settings.asyncpg_pool_max_size,
+            statement_cache_size=max(100, len(_STATEMENTS) * 2),
+        )
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    def _acquire(self):
+        if self._pool is None:
+            raise RuntimeError("AsyncpgBudgetStorage.connect() не был вызван")
+        return self._pool.acquire()
+
+    async def _fetchval(self, name: str, *args):
+        async with self._acquire() as conn:
+            return await conn.fetchval(_STATEMENTS[name], *args)
+
+    async def _fetchrow(self, name: str, *args) -> Optional[asyncpg.Record]:
+        async with self._acquire() as conn:
+            return await conn.fetchrow(_STATEMENTS[name], *args)
+
+    async def _fetch(self, name: str, *args) -> List[asyncpg.Record]:
+        async with self._acquire() as conn:
+            return await conn.fetch(_STATEMENTS[name], *args)
+
+    async def create_or_get_user(self, telegram_id: int, username: Optional[str] = None) -> int:
+        user_id = await self._fetchval("user_by_tg", telegram_id)
+        if user_id is None:
+            user_id = await self._fetchval("user_insert", telegram_id, username)
+        return int(user_id)
+
+    async def get_account_balance(self, account_id: int) -> float:
+        return float(await self._fetchval("account_balance", account_id) or 0)
+
+    async def get_user_accounts(self, user_id: int, primary: bool = False) -> List[AccountWithBalance]:
+        # баланс считается в том же запросе, а не отдельным запросом на каждый счёт
+        rows = await self._fetch("user_accounts", user_id)
+        return [AccountWithBalance(*row[:6], float(row[6])) for row in rows]
+
+    async def get_account_by_name(self, user_id: int, name: str) -> Optional[Account]:
+        row = await self._fetchrow("account_by_name", user_id, name)
+        if row is None:
+            return None
+        return Account(*row)
+
+    async def get_category_by_name(self, name: str) -> Optional[int]:
+        return await self._fetchval("category_by_name", name)
+
+    async def add_transaction(
+        self,
+        account_id: int,
+        user_id: int,
+        transaction_type: str,
+        amount: float,
+        category_id: Optional[int],
+        comment: str,
+        idempotency_key: Optional[str] = None,
+    ) -> Optional[List[Dict]]:
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                inserted = await conn.fetchval(
+                    _STATEMENTS["transaction_insert"],
+                    account_id,
+                    user_id,
+                    transaction_type,
+                    amount,
+                    category_id,
+                    comment,
+                    idempotency_key,
+                )
+                if inserted is None:
+                    return None
+                await conn.execute(_STATEMENTS["outbox_insert"], account_id, user_id, transaction_type, amount)
+                if transaction_type != "expense" or category_id is None:
+                    return []
+                rows = await conn.fetch(
+                    _STATEMENTS["limit_usage_bump"], category_id, user_id, account_id, self._month_start(), amount
+                )
+        return [
+            {"limit_id": row[0], "account_id": row[1], "limit": float(row[2]), "spent": float(row[3])} for row in rows
+        ]
@@ -1,93 +1,555 @@
-from typing import List, Dict, Optional, Any
-from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Any, Tuple
+from datetime import date, datetime, timedelta
 
-from sqlalchemy import text
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import Date, DateTime, text
+from sqlalchemy.exc import DBAPIError, IntegrityError
 
+from app.domain.dto import Account, AccountWithBalance
+from app.domain.money import DEFAULT_CURRENCY, REFERENCE_CURRENCY
+from app.domain.recurrence import due_dates, first_occurrence
 from app.infrastructure.abstract.base_storage import BaseStorage
+from app.logger import logger
+
+# Доступ к счёту (a — accounts): владелец или участник семьи, которой принадлежит счёт.
+# Членство — один поиск по первичному ключу household_members (user_id, household_id), без
+# соединения со строками доступа; один предикат для всех проверок, чтобы все шли по одним индексам
+ACCOUNT_ACCESS = (
+    "(a.owner_id = :uid OR a.household_id IN (SELECT m.household_id FROM household_members m WHERE m.user_id = :uid))"
+)
+
+# Столбцы счёта в порядке полей Account: строка результата сразу разворачивается в DTO
+ACCOUNT_SELECT = """
+    SELECT a.id, a.name, a.owner_id, a.currency, u.username AS owner_username,
+           CASE WHEN a.owner_id = :uid THEN 'owner' ELSE 'shared' END AS role
+    FROM accounts a
+    LEFT JOIN users u ON a.owner_id = u.id
+"""
+
+# Уведомления остальным участникам счёта (владелец + семья счёта, кроме автора операции).
+# Переносимый SQL: выполняется в транзакции операции во всех диалектах
+OUTBOX_INSERT = """
+    INSERT INTO notification_outbox (recipient_id, account_id, actor_id, type, amount)
+    SELECT m.user_id, :aid, :uid, :type, :amount
+    FROM (
+        SELECT owner_id AS user_id FROM accounts WHERE id = :aid
+        UNION
+        SELECT hm.user_id FROM household_members hm
+        JOIN accounts a ON a.household_id = hm.household_id
+        WHERE a.id = :aid
+    ) m
+    WHERE m.user_id <> :uid
+"""
+
+# Операции из рабочей таблицы и архива одним источником — для истории и поиска.
+# Условия внешнего запроса PostgreSQL переносит в обе ветки UNION ALL, поэтому индексы работают
+ALL_TRANSACTIONS = """(
+    SELECT id, account_id, user_id, type, amount, category_id, comment, created_at FROM transactions
+    UNION ALL
+    SELECT id, account_id, user_id, type, amount, category_id, comment, created_at FROM transactions_archive
+)"""
+
+# Баланс счёта: остаток, перенесённый при архивации, плюс операции рабочей таблицы
+ACCOUNT_BALANCE = """
+    SELECT COALESCE((SELECT balance FROM account_balance_carry WHERE account_id = :account_id), 0)
+         + COALESCE((SELECT SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END)
+                     FROM transactions WHERE account_id = :account_id), 0)
+"""
+
+
+def rate_join(alias: str, currency: str, day: str) -> str:
+    """
+    LEFT JOIN курса валюты currency на день day (SQL-выражения) под именем alias:
+    последний известный курс не позже дня, а для дней раньше первого курса — самый ранний.
+    У рубля строк нет — курс NULL; курс валюты в запросах даёт rate_of()
+    """
+    return f"""
+    LEFT JOIN exchange_rates {alias} ON {alias}.currency = {currency} AND {alias}.date = COALESCE(
+        (SELECT MAX(r.date) FROM exchange_rates r WHERE r.currency = {currency} AND r.date <= {day}),
+        (SELECT MIN(r.date) FROM exchange_rates r WHERE r.currency = {currency})
+    )"""
+
+
+def rate_of(alias: str, currency: str) -> str:
+    """Курс из rate_join: у рубля 1, у валюты без загруженного курса NULL — её суммы не пересчитать"""
+    return f"(CASE WHEN {currency} = '{REFERENCE_CURRENCY}' THEN 1 ELSE {alias}.rate END)"
+
+
+def household_name(owner_username: Optional[str]) -> str:
+    return f"Семья @{owner_username}" if owner_username else "Семья"
+
+
+# Версия схемы init_tables: увеличивать при каждом изменении DDL, иначе старт её пропустит
+SCHEMA_VERSION = 10
+SCHEMA_VERSION_KEY = "schema_version"
 
 
 class BudgetStorage(BaseStorage):
-    async def init_tables(self) -> None:
+    # установлено ли pg_trgm: проверяется один раз за процесс
+    _pg_trgm: Optional[bool] = None
+
+    async def connect(self) -> None:
+        # Движок SQLAlchemy подключается лениво
+        return None
+
+    async def close(self) -> None:
+        return None
+
+    async def init_tables(self) -> bool:
+        """Создаёт схему, только если версия в app_meta отличается от SCHEMA_VERSION.
+        Возвращает True, если DDL выполнялся."""
+        if await self.get_meta(SCHEMA_VERSION_KEY) == str(SCHEMA_VERSION):
+            return False
         async with self.session_scope() as session:
-            # users
-            await session.execute(
-                text(
-                    """
-                    CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        telegram_id BIGINT UNIQUE NOT NULL,
-                        username VARCHAR(255),
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-                    """
-                )
+            await self._create_schema(session)
+            await self._put_meta(session, SCHEMA_VERSION_KEY, str(SCHEMA_VERSION))
+        return True
+
+    async def _create_schema(self, session) -> None:
+        # users
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    id SERIAL PRIMARY KEY,
+                    telegram_id BIGINT UNIQUE NOT NULL,
+                    username VARCHAR(255),
+                    created_at TIMESTAMP DEFAULT NOW()
+                );
+                """
             )
-            # categories
-            await session.execute(
-                text(
-                    """
-                    CREATE TABLE IF NOT EXISTS categories (
-                        id SERIAL PRIMARY KEY,
-                        name VARCHAR(255) UNIQUE NOT NULL
-                    );
-                    """
-                )
+        )
+        # categories
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS categories (
+                    id SERIAL PRIMARY KEY,
+                    name VARCHAR(255) UNIQUE NOT NULL
+                );
+                """
             )
-            await session.execute(
-                text(
-                    """
-                    INSERT INTO categories (name) VALUES
-                    ('еда'), ('транспорт'), ('жильё'), ('развлечения'), ('другое')
-                    ON CONFLICT (name) DO NOTHING;
-                    """
-                )
+        )
+        await session.execute(
+            text(
+                """
+                INSERT INTO categories (name) VALUES
+                ('еда'), ('транспорт'), ('жильё'), ('развлечения'), ('другое')
+                ON CONFLICT (name) DO NOTHING;
+                """
             )
-            # accounts
-            await session.execute(
-                text(
-                    """
-                    CREATE TABLE IF NOT EXISTS accounts (
-                        id SERIAL PRIMARY KEY,
-                        name VARCHAR(255) NOT NULL,
-                        owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                        created_at TIMESTAMP DEFAULT NOW(),
-                        UNIQUE(name, owner_id)
-                    );
-                    """
-                )
+        )
+        # accounts
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS accounts (
+                    id SERIAL PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    UNIQUE(name, owner_id)
+                );
+                """
             )
-            # shares
-            await session.execute(
-                text(
-                    """
-                    CREATE TABLE IF NOT EXISTS account_shares (
-                        id SERIAL PRIMARY KEY,
-                        account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
-                        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                        created_at TIMESTAMP DEFAULT NOW(),
-                        UNIQUE(account_id, user_id)
-                    );
-                    """
+        )
+        # валюты: у счёта — валюта операций, у пользователя — валюта итогов статистики
+        await session.execute(
+            text("ALTER TABLE accounts ADD COLUMN IF NOT EXISTS currency VARCHAR(3) NOT NULL DEFAULT 'RUB'")
+        )
+        await session.execute(
+            text("ALTER TABLE users ADD COLUMN IF NOT EXISTS base_currency VARCHAR(3) NOT NULL DEFAULT 'RUB'")
+        )
+        # курсы валют: рублей за единицу валюты на дату, загружаются из файла (python -m app.rates)
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS exchange_rates (
+                    date DATE NOT NULL,
+                    currency VARCHAR(3) NOT NULL,
+                    rate DECIMAL(18, 6) NOT NULL,
+                    PRIMARY KEY (currency, date)
+                );
+                """
+            )
+        )
+        # семьи: общие счета принадлежат семье, доступ к ним — у всех её участников.
+        # Первичный ключ участников начинается с user_id — это и есть индекс проверки доступа
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS households (
+                    id SERIAL PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    created_at TIMESTAMP DEFAULT NOW()
+                );
+                """
+            )
+        )
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS household_members (
+                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    household_id INTEGER REFERENCES households(id) ON DELETE CASCADE,
+                    joined_at TIMESTAMP DEFAULT NOW(),
+                    PRIMARY KEY (user_id, household_id)
+                );
+                """
+            )
+        )
+        await session.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_household_members_household ON household_members (household_id);"
+            )
+        )
+        await session.execute(
+            text(
+                "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS household_id INTEGER"
+                " REFERENCES households(id) ON DELETE SET NULL"
+            )
+        )
+        await session.execute(text("CREATE INDEX IF NOT EXISTS ix_accounts_owner ON accounts (owner_id);"))
+        await session.execute(text("CREATE INDEX IF NOT EXISTS ix_accounts_household ON accounts (household_id);"))
+        # transactions
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS transactions (
+                    id SERIAL PRIMARY KEY,
+                    account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    type VARCHAR(10) CHECK (type IN ('income', 'expense')),
+                    amount DECIMAL(12, 2) NOT NULL,
+                    category_id INTEGER REFERENCES categories(id),
+                    comment TEXT,
+                    created_at TIMESTAMP DEFAULT NOW()
+                );
+                """
+            )
+        )
+        await session.execute(
+            text("CREATE INDEX IF NOT EXISTS ix_transactions_created_at ON transactions (created_at);")
+        )
+        # ключ идемпотентности: повторная доставка того же сообщения не создаёт вторую операцию
+        await session.execute(text("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64);"))
+        await session.execute(
+            text(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_transactions_idempotency_key
+                ON transactions (idempotency_key);
+                """
+            )
+        )
+        # выборка операций пользователя по id (дозагрузка аналитики)
+        await session.execute(
+            text("CREATE INDEX IF NOT EXISTS ix_transactions_user_id ON transactions (user_id, id);")
+        )
+        # keyset-пагинация истории по счёту
+        await session.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS ix_transactions_account_created
+                ON transactions (account_id, created_at DESC, id DESC);
+                """
+            )
+        )
+        # архив старых операций: переносится пачками фоновой задачей, остаток счёта — в account_balance_carry
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS transactions_archive (
+                    id INTEGER PRIMARY KEY,
+                    account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    type VARCHAR(10) CHECK (type IN ('income', 'expense')),
+                    amount DECIMAL(12, 2) NOT NULL,
+                    category_id INTEGER REFERENCES categories(id),
+                    comment TEXT,
+                    created_at TIMESTAMP NOT NULL
+                );
+                """
+            )
+        )
+        await session.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS ix_transactions_archive_account_created
+                ON transactions_archive (account_id, created_at DESC, id DESC);
+                """
+            )
+        )
+        # поиск по комментариям: триграммные GIN-индексы (ILIKE '%...%' и нечёткое совпадение).
+        # Расширение ставит администратор разовой миграцией (migrations/versions/0001_pg_trgm_search.py):
+        # CREATE EXTENSION требует прав, которых у роли бота нет; бот только проверяет его наличие
+        if await self._has_pg_trgm(session):
+            for table in ("transactions", "transactions_archive"):
+                await session.execute(
+                    text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table}_comment_trgm"
+                        f" ON {table} USING gin (comment gin_trgm_ops);"
+                    )
                 )
+        else:
+            logger.warning("Расширение pg_trgm не установлено: /search работает без индекса (alembic upgrade head)")
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS account_balance_carry (
+                    account_id INTEGER PRIMARY KEY REFERENCES accounts(id) ON DELETE CASCADE,
+                    balance DECIMAL(14, 2) NOT NULL DEFAULT 0,
+                    archived_before TIMESTAMP
+                );
+                """
+            )
+        )
+        # остаток счёта на конец каждого месяца: баланс на дату = ближайшая отметка + операции после неё
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS balance_checkpoints (
+                    account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+                    month DATE NOT NULL,
+                    closing_balance DECIMAL(14, 2) NOT NULL,
+                    PRIMARY KEY (account_id, month)
+                );
+                """
+            )
+        )
+        # budget limits: account_id IS NULL — лимит пользователя по всем его расходам
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS budget_limits (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+                    category_id INTEGER NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+                    amount DECIMAL(12, 2) NOT NULL,
+                    created_at TIMESTAMP DEFAULT NOW()
+                );
+                """
+            )
+        )
+        await session.execute(
+            text(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_budget_limits_user
+                ON budget_limits (category_id, user_id) WHERE account_id IS NULL;
+                """
+            )
+        )
+        await session.execute(
+            text(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_budget_limits_account
+                ON budget_limits (category_id, account_id) WHERE account_id IS NOT NULL;
+                """
+            )
+        )
+        # month-to-date counters, maintained on insert only for categories under a limit
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS budget_limit_usage (
+                    limit_id INTEGER REFERENCES budget_limits(id) ON DELETE CASCADE,
+                    month DATE NOT NULL,
+                    spent DECIMAL(12, 2) NOT NULL DEFAULT 0,
+                    PRIMARY KEY (limit_id, month)
+                );
+                """
+            )
+        )
+        # recurring rules: period monthly (day = число месяца) или weekly (day = ISO день недели)
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS recurring_rules (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+                    type VARCHAR(10) CHECK (type IN ('income', 'expense')),
+                    amount DECIMAL(12, 2) NOT NULL,
+                    category_id INTEGER REFERENCES categories(id),
+                    comment TEXT,
+                    period VARCHAR(10) NOT NULL CHECK (period IN ('monthly', 'weekly')),
+                    day SMALLINT NOT NULL,
+                    next_run DATE NOT NULL,
+                    active BOOLEAN NOT NULL DEFAULT TRUE,
+                    created_at TIMESTAMP DEFAULT NOW()
+                );
+                """
             )
-            # transactions
+        )
+        # один ряд на каждое проведённое повторение — защита от двойного проведения
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS recurring_runs (
+                    rule_id INTEGER REFERENCES recurring_rules(id) ON DELETE CASCADE,
+                    due_on DATE NOT NULL,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    PRIMARY KEY (rule_id, due_on)
+                );
+                """
+            )
+        )
+        # доставленные сводки: строка ставится до отправки, чтобы рестарт не слал повторно
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS digest_deliveries (
+                    kind VARCHAR(10) NOT NULL,
+                    period_start DATE NOT NULL,
+                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    sent_at TIMESTAMP DEFAULT NOW(),
+                    PRIMARY KEY (kind, period_start, user_id)
+                );
+                """
+            )
+        )
+        # outbox уведомлений участникам общих счетов: пишется в транзакции операции,
+        # рассылается фоновым диспетчером
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS notification_outbox (
+                    id SERIAL PRIMARY KEY,
+                    recipient_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+                    actor_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                    type VARCHAR(10) NOT NULL,
+                    amount DECIMAL(12, 2) NOT NULL,
+                    created_at TIMESTAMP DEFAULT NOW()
+                );
+                """
+            )
+        )
+        # диспетчер на каждом проходе ищет готовые строки по created_at и дочитывает строки
+        # найденных получателей по recipient_id — оба шага без полного просмотра outbox
+        await session.execute(
+            text("CREATE INDEX IF NOT EXISTS ix_notification_outbox_created ON notification_outbox (created_at);")
+        )
+        await session.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS ix_notification_outbox_recipient_created
+                ON notification_outbox (recipient_id, created_at);
+                """
+            )
+        )
+        await self._migrate_account_shares(session)
+        # служебные ключи: версия схемы, хеш команд бота
+        await session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS app_meta (
+                    key VARCHAR(64) PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                """
+            )
+        )
+
+    async def _migrate_account_shares(self, session) -> None:
+        """
+        Перенос доступа из account_shares (строка на пару счёт-пользователь) в семьи.
+        Счета одного владельца с одинаковым набором участников становятся счетами одной семьи,
+        поэтому никто не получает доступа к счёту, которого у него не было. Таблица удаляется
+        в той же транзакции; на новой базе её нет, и перенос ничего не делает.
+        """
+        if not await self._table_exists(session, "account_shares"):
+            return
+        res = await session.execute(
+            text(
+                """
+                SELECT a.id, a.owner_id, s.user_id, u.username
+                FROM account_shares s
+                JOIN accounts a ON a.id = s.account_id
+                LEFT JOIN users u ON u.id = a.owner_id
+                WHERE s.user_id <> a.owner_id
+                ORDER BY a.id, s.user_id
+                """
+            )
+        )
+        members: Dict[int, List[int]] = {}
+        owners: Dict[int, Tuple[int, Optional[str]]] = {}
+        for account_id, owner_id, user_id, username in res.all():
+            members.setdefault(account_id, []).append(int(user_id))
+            owners[account_id] = (int(owner_id), username)
+        groups: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+        for account_id, user_ids in members.items():
+            groups.setdefault((owners[account_id][0], tuple(user_ids)), []).append(account_id)
+        for (owner_id, user_ids), account_ids in groups.items():
+            household_id = await self._insert_household(session, owner_id, household_name(owners[account_ids[0]][1]))
+            for user_id in user_ids:
+                await self._add_member(session, household_id, user_id)
             await session.execute(
-                text(
-                    """
-                    CREATE TABLE IF NOT EXISTS transactions (
-                        id SERIAL PRIMARY KEY,
-                        account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
-                        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                        type VARCHAR(10) CHECK (type IN ('income', 'expense')),
-                        amount DECIMAL(12, 2) NOT NULL,
-                        category_id INTEGER REFERENCES categories(id),
-                        comment TEXT,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-                    """
-                )
+                text("UPDATE accounts SET household_id = :hid WHERE id = :aid"),
+                [{"hid": household_id, "aid": account_id} for account_id in account_ids],
             )
+        await session.execute(text("DROP TABLE account_shares"))
+
+    async def _has_pg_trgm(self, session) -> bool:
+        if self._pg_trgm is None:
+            res = await session.execute(text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"))
+            self._pg_trgm = bool(res.scalar())
+        return self._pg_trgm
+
+    @staticmethod
+    async def _table_exists(session, name: str) -> bool:
+        res = await session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+        return bool(res.scalar())
+
+    @staticmethod
+    async def _insert_household(session, owner_id: int, name: str) -> int:
+        res = await session.execute(
+            text("INSERT INTO households (name, owner_id) VALUES (:name, :owner_id) RETURNING id"),
+            {"name": name, "owner_id": owner_id},
+        )
+        household_id = int(res.scalar_one())
+        await BudgetStorage._add_member(session, household_id, owner_id)
+        return household_id
+
+    @staticmethod
+    async def _add_member(session, household_id: int, user_id: int) -> bool:
+        """True — пользователь добавлен, False — уже был участником"""
+        res = await session.execute(
+            text(
+                """
+                INSERT INTO household_members (user_id, household_id) VALUES (:uid, :hid)
+                ON CONFLICT DO NOTHING
+                RETURNING user_id
+                """
+            ),
+            {"uid": user_id, "hid": household_id},
+        )
+        return res.first() is not None
+
+    async def get_meta(self, key: str) -> Optional[str]:
+        try:
+            async with self.session_scope(read_only=True) as session:
+                res = await session.execute(text("SELECT value FROM app_meta WHERE key = :key"), {"key": key})
+                return res.scalar()
+        except DBAPIError:
+            # app_meta ещё не создана — первый запуск
+            return None
+
+    async def set_meta(self, key: str, value: str) -> None:
+        async with self.session_scope() as session:
+            await self._put_meta(session, key, value)
+
+    @staticmethod
+    async def _put_meta(session, key: str, value: str) -> None:
+        await session.execute(
+            text(
+                """
+                INSERT INTO app_meta (key, value) VALUES (:key, :value)
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+                """
+            ),
+            {"key": key, "value": value},
+        )
 
     async def create_or_get_user(self, telegram_id: int, username: Optional[str] = None) -> int:
         async with self.session_scope() as session:
@@ -103,82 +565,99 @@ class BudgetStorage(BaseStorage):
             )
             return int(res.scalar_one())
 
-    async def create_account(self, user_id: int, name: str) -> bool:
+    async def create_account(self, user_id: int, name: str, currency: str = DEFAULT_CURRENCY) -> bool:
         async with self.session_scope() as session:
             try:
                 await session.execute(
-                    text("INSERT INTO accounts (name, owner_id) VALUES (:name, :owner_id)"),
-                    {"name": name, "owner_id": user_id},
+                    text("INSERT INTO accounts (name, owner_id, currency) VALUES (:name, :owner_id, :currency)"),
+                    {"name": name, "owner_id": user_id, "currency": currency},
                 )
                 return True
             except IntegrityError:
                 # unique constraint (name, owner_id)
                 return False
 
-    async def get_account_balance(self, account_id: int) -> float:
+    async def get_base_currency(self, user_id: int) -> str:
         async with self.session_scope(read_only=True) as session:
-            res = await session.execute(
+            res = await session.execute(text("SELECT base_currency FROM users WHERE id = :uid"), {"uid": user_id})
+            return res.scalar() or DEFAULT_CURRENCY
+
+    async def set_base_currency(self, user_id: int, currency: str) -> None:
+        async with self.session_scope() as session:
+            await session.execute(
+                text("UPDATE users SET base_currency = :currency WHERE id = :uid"),
+                {"uid": user_id, "currency": currency},
+            )
+
+    async def upsert_exchange_rates(self, rates: List[Tuple[date, str, float]]) -> int:
+        """Загрузить курсы (дата, валюта, рублей за единицу); курс на ту же дату перезаписывается"""
+        params = [
+            {"date": day, "currency": currency, "rate": rate}
+            for day, currency, rate in rates
+            if currency != REFERENCE_CURRENCY
+        ]
+        if not params:
+            return 0
+        async with self.session_scope() as session:
+            await session.execute(
                 text(
                     """
-                    SELECT COALESCE(SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END), 0)
-                    FROM transactions WHERE account_id = :account_id
+                    INSERT INTO exchange_rates (date, currency, rate) VALUES (:date, :currency, :rate)
+                    ON CONFLICT (currency, date) DO UPDATE SET rate = EXCLUDED.rate
                     """
                 ),
-                {"account_id": account_id},
+                params,
             )
-            val = res.scalar()
-            return float(val or 0)
+        return len(params)
 
-    async def get_user_accounts(self, user_id: int) -> List[Dict]:
+    async def get_latest_rates(self) -> Dict[str, float]:
+        """Последний загруженный курс каждой валюты: {валюта: рублей за единицу}"""
         async with self.session_scope(read_only=True) as session:
             res = await session.execute(
                 text(
                     """
-                    SELECT DISTINCT a.id, a.name, a.owner_id, u.username as owner_username,
-                           CASE WHEN a.owner_id = :uid THEN 'owner' ELSE 'shared' END as role
-                    FROM accounts a
-                    LEFT JOIN users u ON a.owner_id = u.id
-                    LEFT JOIN account_shares s ON a.id = s.account_id
-                    WHERE a.owner_id = :uid OR s.user_id = :uid
-                    ORDER BY a.name
+                    SELECT r.currency, r.rate FROM exchange_rates r
+                    WHERE r.date = (SELECT MAX(l.date) FROM exchange_rates l WHERE l.currency = r.currency)
                     """
-                ),
-                {"uid": user_id},
-            )
-            rows = res.mappings().all()
-            result: List[Dict] = []
-            for row in rows:
-                balance = await self.get_account_balance(int(row["id"]))
-                result.append(
-                    {
-                        "id": int(row["id"]),
-                        "name": row["name"],
-                        "owner_id": int(row["owner_id"]) if row["owner_id"] is not None else None,
-                        "owner_username": row["owner_username"],
-                        "role": row["role"],
-                        "balance": balance,
-                    }
                 )
-            return result
+            )
+            return {row[0]: float(row[1]) for row in res.all()}
+
+    async def get_account_balance(self, account_id: int) -> float:
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(text(ACCOUNT_BALANCE), {"account_id": account_id})
+            val = res.scalar()
+            return float(val or 0)
+
+    async def get_user_accounts(self, user_id: int, primary: bool = False) -> List[AccountWithBalance]:
+        return [
+            account.with_balance(await self.get_account_balance(account.id))
+            for account in await self.get_account_access(user_id, primary)
+        ]
+
+    async def get_account_access(self, user_id: int, primary: bool = False) -> List[Account]:
+        """Доступные пользователю счета без балансов. primary — сразу после изменения доступа"""
+        async with self.session_scope(read_only=True, primary=primary) as session:
+            res = await session.execute(
+                text(f"{ACCOUNT_SELECT} WHERE {ACCOUNT_ACCESS} ORDER BY a.name"), {"uid": user_id}
+            )
+            return [Account(*row) for row in res.all()]
 
-    async def get_account_by_name(self, user_id: int, name: str) -> Optional[Dict]:
+    async def get_account_by_name(self, user_id: int, name: str) -> Optional[Account]:
         async with self.session_scope(read_only=True) as session:
             res = await session.execute(
                 text(
-                    """
-                    SELECT a.id, a.name, a.owner_id
-                    FROM accounts a
-                    LEFT JOIN account_shares s ON a.id = s.account_id
-                    WHERE (a.owner_id = :uid OR s.user_id = :uid) AND a.name = :name
+                    f"""
+                    {ACCOUNT_SELECT}
+                    WHERE {ACCOUNT_ACCESS} AND a.name = :name
+                    ORDER BY a.owner_id = :uid DESC
                     LIMIT 1
                     """
                 ),
                 {"uid": user_id, "name": name},
             )
-            row = res.mappings().first()
-            if not row:
-                return None
-            return {"id": int(row["id"]), "name": row["name"], "owner_id": int(row["owner_id"]) if row["owner_id"] is not None else None}
+            row = res.first()
+            return Account(*row) if row else None
 
     async def add_transaction(
         self,
@@ -188,13 +667,18 @@ class BudgetStorage(BaseStorage):
         amount: float,
         category_id: Optional[int],
         comment: str,
-    ) -> None:
+        idempotency_key: Optional[str] = None,
+    ) -> Optional[List[Dict]]:
+        """Возвращает состояние лимитов, затронутых расходом (пустой список для доходов).
+        None — операция с таким idempotency_key уже записана."""
         async with self.session_scope() as session:
-            await session.execute(
+            res = await session.execute(
                 text(
                     """
-                    INSERT INTO transactions (account_id, user_id, type, amount, category_id, comment)
-                    VALUES (:account_id, :user_id, :type, :amount, :category_id, :comment)
+                    INSERT INTO transactions (account_id, user_id, type, amount, category_id, comment, idempotency_key)
+                    VALUES (:account_id, :user_id, :type, :amount, :category_id, :comment, :key)
+                    ON CONFLICT (idempotency_key) DO NOTHING
+                    RETURNING id
                     """
                 ),
                 {
@@ -204,8 +688,192 @@ class BudgetStorage(BaseStorage):
                     "amount": amount,
                     "category_id": category_id,
                     "comment": comment,
+                    "key": idempotency_key,
                 },
             )
+            if res.scalar() is None:
+                return None
+            await session.execute(
+                text(OUTBOX_INSERT),
+                {"aid": account_id, "uid": user_id, "type": transaction_type, "amount": amount},
+            )
+            if transaction_type != "expense" or category_id is None:
+                return []
+            return await self._bump_limit_usage(session, account_id, user_id, amount, category_id)
+
+    async def add_expenses(
+        self, account_id: int, user_id: int, items: List[Tuple[float, int, str, Optional[str]]]
+    ) -> Optional[Dict[int, List[Dict]]]:
+        """Несколько расходов (сумма, категория, комментарий, ключ) одним INSERT в одной транзакции.
+        Возвращает состояние затронутых лимитов по категориям; None — все позиции уже записаны."""
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text(
+                    """
+                    INSERT INTO transactions (account_id, user_id, type, amount, category_id, comment, idempotency_key)
+                    SELECT :aid, :uid, 'expense', v.amount, v.category_id, v.comment, v.key
+                    FROM unnest(
+                        CAST(:amounts AS NUMERIC[]), CAST(:cids AS INTEGER[]),
+                        CAST(:comments AS TEXT[]), CAST(:keys AS TEXT[])
+                    ) AS v(amount, category_id, comment, key)
+                    ON CONFLICT (idempotency_key) DO NOTHING
+                    RETURNING category_id, amount
+                    """
+                ),
+                {
+                    "aid": account_id,
+                    "uid": user_id,
+                    "amounts": [item[0] for item in items],
+                    "cids": [item[1] for item in items],
+                    "comments": [item[2] for item in items],
+                    "keys": [item[3] for item in items],
+                },
+            )
+            return await self._bump_batch_usage(session, account_id, user_id, res.all())
+
+    async def _bump_batch_usage(
+        self, session, account_id: int, user_id: int, inserted: List[Tuple[int, float]]
+    ) -> Optional[Dict[int, List[Dict]]]:
+        if not inserted:
+            return None
+        await session.execute(
+            text(OUTBOX_INSERT),
+            [{"aid": account_id, "uid": user_id, "type": "expense", "amount": amount} for _, amount in inserted],
+        )
+        by_category: Dict[int, float] = {}
+        for category_id, amount in inserted:
+            by_category[int(category_id)] = by_category.get(int(category_id), 0.0) + float(amount)
+        return {
+            category_id: await self._bump_limit_usage(session, account_id, user_id, amount, category_id)
+            for category_id, amount in by_category.items()
+        }
+
+    @staticmethod
+    def _month_start(ts: Optional[datetime] = None) -> date:
+        return (ts or datetime.utcnow()).date().replace(day=1)
+
+    @staticmethod
+    def _next_month(month: date) -> date:
+        return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+    async def _bump_limit_usage(
+        self, session, account_id: int, user_id: int, amount: float, category_id: int
+    ) -> List[Dict]:
+        # Один оператор: поиск лимитов по частичным уникальным индексам + инкремент счётчиков месяца
+        res = await session.execute(
+            text(
+                """
+                WITH lim AS (
+                    SELECT id, account_id, amount FROM budget_limits
+                    WHERE category_id = :cid AND account_id IS NULL AND user_id = :uid
+                    UNION ALL
+                    SELECT id, account_id, amount FROM budget_limits
+                    WHERE category_id = :cid AND account_id = :aid
+                ), usage AS (
+                    INSERT INTO budget_limit_usage (limit_id, month, spent)
+                    SELECT id, :month, :amount FROM lim
+                    ON CONFLICT (limit_id, month)
+                    DO UPDATE SET spent = budget_limit_usage.spent + EXCLUDED.spent
+                    RETURNING limit_id, spent
+                )
+                SELECT lim.id, lim.account_id, lim.amount AS limit_amount, usage.spent
+                FROM lim JOIN usage ON usage.limit_id = lim.id
+                """
+            ),
+            {"cid": category_id, "uid": user_id, "aid": account_id, "month": self._month_start(), "amount": amount},
+        )
+        return [
+            {
+                "limit_id": int(row["id"]),
+                "account_id": int(row["account_id"]) if row["account_id"] is not None else None,
+                "limit": float(row["limit_amount"]),
+                "spent": float(row["spent"]),
+            }
+            for row in res.mappings().all()
+        ]
+
+    async def set_limit(self, user_id: int, category_id: int, amount: float, account_id: Optional[int] = None) -> None:
+        month = self._month_start()
+        async with self.session_scope() as session:
+            if account_id is None:
+                res = await session.execute(
+                    text(
+                        """
+                        INSERT INTO budget_limits (user_id, account_id, category_id, amount)
+                        VALUES (:uid, NULL, :cid, :amount)
+                        ON CONFLICT (category_id, user_id) WHERE account_id IS NULL
+                        DO UPDATE SET amount = EXCLUDED.amount
+                        RETURNING id
+                        """
+                    ),
+                    {"uid": user_id, "cid": category_id, "amount": amount},
+                )
+                spent_filter = "user_id = :uid"
+            else:
+                res = await session.execute(
+                    text(
+                        """
+                        INSERT INTO budget_limits (user_id, account_id, category_id, amount)
+                        VALUES (:uid, :aid, :cid, :amount)
+                        ON CONFLICT (category_id, account_id) WHERE account_id IS NOT NULL
+                        DO UPDATE SET amount = EXCLUDED.amount
+                        RETURNING id
+                        """
+                    ),
+                    {"uid": user_id, "aid": account_id, "cid": category_id, "amount": amount},
+                )
+                spent_filter = "account_id = :aid"
+            limit_id = int(res.scalar_one())
+            # Счётчик месяца засеваем один раз при установке лимита — дальше он только инкрементируется.
+            # month (DATE) и since (TIMESTAMP) — разные параметры: PostgreSQL выводит тип параметра
+            # по первому использованию, и одна дата в обоих местах ломает сравнение с created_at
+            await session.execute(
+                text(
+                    f"""
+                    INSERT INTO budget_limit_usage (limit_id, month, spent)
+                    SELECT :lid, :month, COALESCE(SUM(amount), 0)
+                    FROM transactions
+                    WHERE {spent_filter} AND category_id = :cid AND type = 'expense' AND created_at >= :since
+                    ON CONFLICT (limit_id, month) DO UPDATE SET spent = EXCLUDED.spent
+                    """
+                ),
+                {
+                    "lid": limit_id,
+                    "month": month,
+                    "since": datetime(month.year, month.month, 1),
+                    "uid": user_id,
+                    "aid": account_id,
+                    "cid": category_id,
+                },
+            )
+
+    async def get_limits(self, user_id: int) -> List[Dict]:
+        """Свои лимиты пользователя и лимиты доступных ему счетов: они срабатывают и на его расходы"""
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    SELECT l.id, c.name AS category, a.name AS account, l.amount, COALESCE(u.spent, 0) AS spent
+                    FROM budget_limits l
+                    JOIN categories c ON c.id = l.category_id
+                    LEFT JOIN accounts a ON a.id = l.account_id
+                    LEFT JOIN budget_limit_usage u ON u.limit_id = l.id AND u.month = :month
+                    WHERE (l.account_id IS NULL AND l.user_id = :uid) OR (l.account_id IS NOT NULL AND {ACCOUNT_ACCESS})
+                    ORDER BY c.name, a.name NULLS FIRST
+                    """
+                ),
+                {"uid": user_id, "month": self._month_start()},
+            )
+            return [
+                {
+                    "id": int(row["id"]),
+                    "category": row["category"],
+                    "account": row["account"],
+                    "limit": float(row["amount"]),
+                    "spent": float(row["spent"] or 0),
+                }
+                for row in res.mappings().all()
+            ]
 
     async def get_category_by_name(self, name: str) -> Optional[int]:
         async with self.session_scope(read_only=True) as session:
@@ -213,64 +881,825 @@ class BudgetStorage(BaseStorage):
             val = res.scalar()
             return int(val) if val is not None else None
 
-    async def share_account(self, account_id: int, owner_id: int, target_user_id: int) -> bool:
+    async def get_categories(self) -> Dict[int, str]:
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(text("SELECT id, name FROM categories"))
+            return {int(row[0]): row[1] for row in res.all()}
+
+    async def share_account(self, account_id: int, owner_id: int, target_user_id: int) -> List[int]:
+        """
+        Открыть пользователю доступ к счёту. Счёт переходит в семью владельца, участники которой —
+        прежние участники счёта и получатель (при необходимости она создаётся), остальные счета
+        остаются где были: получатель не видит ничего, кроме этого счёта и счетов, к которым уже
+        имел доступ. Опустевшая семья удаляется. Возвращает пользователей, у которых изменился
+        доступ: пусто — запрашивающий не владелец или доступ уже был
+        """
         async with self.session_scope() as session:
-            # Проверяем, является ли запрашивающий владельцем счета
             res = await session.execute(
-                text("SELECT owner_id FROM accounts WHERE id = :aid"), {"aid": account_id}
+                text(
+                    """
+                    SELECT a.owner_id, a.household_id, u.username
+                    FROM accounts a LEFT JOIN users u ON u.id = a.owner_id
+                    WHERE a.id = :aid
+                    """
+                ),
+                {"aid": account_id},
             )
             row = res.first()
-            if not row or int(row[0]) != owner_id:
-                return False
-            try:
-                await session.execute(
-                    text(
-                        "INSERT INTO account_shares (account_id, user_id) VALUES (:aid, :uid)"
-                    ),
-                    {"aid": account_id, "uid": target_user_id},
+            if not row or int(row[0]) != owner_id or target_user_id == owner_id:
+                return []
+            current = row[1]
+            wanted = {owner_id, target_user_id}
+            if current is not None:
+                res = await session.execute(
+                    text("SELECT user_id FROM household_members WHERE household_id = :hid"), {"hid": current}
                 )
-                return True
-            except IntegrityError:
-                return False
+                members = {int(r[0]) for r in res.all()}
+                if target_user_id in members:
+                    return []
+                wanted |= members
+
+            # семья владельца ровно с этими участниками, как при переносе account_shares
+            res = await session.execute(
+                text(
+                    """
+                    SELECT h.id, m.user_id FROM households h
+                    JOIN household_members m ON m.household_id = h.id
+                    WHERE h.owner_id = :uid
+                    ORDER BY h.id
+                    """
+                ),
+                {"uid": owner_id},
+            )
+            households: Dict[int, set] = {}
+            for hid, user_id in res.all():
+                households.setdefault(int(hid), set()).add(int(user_id))
+            household_id = next((hid for hid, users in households.items() if users == wanted), None)
+            if household_id is None:
+                household_id = await self._insert_household(session, owner_id, household_name(row[2]))
+                for user_id in sorted(wanted - {owner_id}):
+                    await self._add_member(session, household_id, user_id)
+            await session.execute(
+                text("UPDATE accounts SET household_id = :hid WHERE id = :aid"),
+                {"hid": household_id, "aid": account_id},
+            )
+            if current is not None:
+                await self._drop_empty_household(session, int(current))
+            return [target_user_id]
+
+    @staticmethod
+    async def _drop_empty_household(session, household_id: int) -> None:
+        """Удалить семью, у которой не осталось счетов"""
+        empty = "NOT EXISTS (SELECT 1 FROM accounts WHERE household_id = :hid)"
+        await session.execute(
+            text(f"DELETE FROM household_members WHERE household_id = :hid AND {empty}"), {"hid": household_id}
+        )
+        await session.execute(text(f"DELETE FROM households WHERE id = :hid AND {empty}"), {"hid": household_id})
+
+    async def get_households(self, user_id: int) -> List[Dict]:
+        """Семьи пользователя: id, name, members [{username, telegram_id, owner}], accounts [название]"""
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    """
+                    SELECT h.id, h.name, u.username, u.telegram_id, h.owner_id = u.id AS is_owner
+                    FROM household_members m
+                    JOIN households h ON h.id = m.household_id
+                    JOIN household_members hm ON hm.household_id = h.id
+                    JOIN users u ON u.id = hm.user_id
+                    WHERE m.user_id = :uid
+                    ORDER BY h.id, h.owner_id = u.id DESC, u.id
+                    """
+                ),
+                {"uid": user_id},
+            )
+            households: Dict[int, Dict] = {}
+            for row in res.mappings().all():
+                household = households.setdefault(
+                    int(row["id"]), {"id": int(row["id"]), "name": row["name"], "members": [], "accounts": []}
+                )
+                household["members"].append(
+                    {
+                        "username": row["username"],
+                        "telegram_id": int(row["telegram_id"]),
+                        "owner": bool(row["is_owner"]),
+                    }
+                )
+            if not households:
+                return []
+            res = await session.execute(
+                text(
+                    """
+                    SELECT a.household_id, a.name FROM accounts a
+                    JOIN household_members m ON m.household_id = a.household_id AND m.user_id = :uid
+                    ORDER BY a.name
+                    """
+                ),
+                {"uid": user_id},
+            )
+            for household_id, name in res.all():
+                households[int(household_id)]["accounts"].append(name)
+            return list(households.values())
 
     async def get_stats(self, user_id: int, period_days: int) -> Dict[str, Any]:
+        """
+        Суммы по категориям доступных счетов (свои и общие, кто бы ни записал операцию) в базовой
+        валюте пользователя. Операции сначала сворачиваются по (категория, тип, валюта счёта, день),
+        и только эти строки соединяются с курсами на свой день — пересчёт идёт в том же запросе,
+        а не построчно в Python
+        """
         since = datetime.utcnow() - timedelta(days=period_days)
         async with self.session_scope(read_only=True) as session:
+            res = await session.execute(text("SELECT base_currency FROM users WHERE id = :uid"), {"uid": user_id})
+            base = res.scalar() or DEFAULT_CURRENCY
             res = await session.execute(
                 text(
+                    f"""
+                    WITH per_day AS (
+                        SELECT c.name AS category, t.type, a.currency,
+                               date(t.created_at) AS day, SUM(t.amount) AS total
+                        FROM transactions t
+                        JOIN accounts a ON a.id = t.account_id
+                        LEFT JOIN categories c ON t.category_id = c.id
+                        WHERE {ACCOUNT_ACCESS} AND t.created_at >= :since
+                        GROUP BY c.name, t.type, a.currency, date(t.created_at)
+                    )
+                    , converted AS (
+                        SELECT p.category, p.type,
+                               CASE WHEN p.currency = :base THEN p.total
+                                    ELSE 1.0 * p.total * {rate_of("fx", "p.currency")} / {rate_of("fxb", ":base")}
+                               END AS total,
+                               CASE WHEN {rate_of("fx", "p.currency")} IS NULL THEN p.currency
+                                    ELSE :base END AS rate_currency
+                        FROM per_day p
+                        {rate_join("fx", "p.currency", "p.day")}
+                        {rate_join("fxb", ":base", "p.day")}
+                    )
+                    SELECT category, type, SUM(total) AS total,
+                           CASE WHEN total IS NULL THEN rate_currency END AS missing
+                    FROM converted
+                    GROUP BY category, type, CASE WHEN total IS NULL THEN rate_currency END
                     """
-                    SELECT c.name AS category, t.type, SUM(t.amount) AS total
-                    FROM transactions t
-                    LEFT JOIN categories c ON t.category_id = c.id
-                    WHERE t.user_id = :uid AND t.created_at >= :since
-                    GROUP BY c.name, t.type
-                    ORDER BY c.name
+                ),
+                {"uid": user_id, "since": since, "base": base},
+            )
+            rows = res.mappings().all()
+
+        stats: Dict[str, Any] = {"income": {}, "expense": {}}
+        totals = {"income": 0.0, "expense": 0.0}
+        missing = set()
+        for row in rows:
+            if row["missing"] is not None:
+                # суммы в валюте без курса не складываются с остальными, а перечисляются отдельно
+                missing.add(row["missing"])
+                continue
+            category = row["category"] or "без категории"
+            amount = float(row["total"] or 0)
+            stats[row["type"]][category] = amount
+            totals[row["type"]] += amount
+        stats["totals"] = totals
+        stats["currency"] = base
+        stats["missing_rates"] = sorted(missing)
+        return stats
+
+    async def add_recurring(
+        self,
+        user_id: int,
+        account_id: int,
+        transaction_type: str,
+        amount: float,
+        category_id: Optional[int],
+        comment: str,
+        period: str,
+        day: int,
+    ) -> Dict:
+        next_run = first_occurrence(period, day, datetime.utcnow().date())
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text(
+                    """
+                    INSERT INTO recurring_rules
+                        (user_id, account_id, type, amount, category_id, comment, period, day, next_run)
+                    VALUES (:uid, :aid, :type, :amount, :cid, :comment, :period, :day, :next_run)
+                    RETURNING id
                     """
                 ),
-                {"uid": user_id, "since": since},
+                {
+                    "uid": user_id,
+                    "aid": account_id,
+                    "type": transaction_type,
+                    "amount": amount,
+                    "cid": category_id,
+                    "comment": comment,
+                    "period": period,
+                    "day": day,
+                    "next_run": next_run,
+                },
+            )
+            return {"id": int(res.scalar_one()), "next_run": next_run}
+
+    async def get_recurring(self, user_id: int) -> List[Dict]:
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    """
+                    SELECT r.id, a.name AS account, r.type, r.amount, c.name AS category, r.comment,
+                           r.period, r.day, r.next_run
+                    FROM recurring_rules r
+                    JOIN accounts a ON a.id = r.account_id
+                    LEFT JOIN categories c ON c.id = r.category_id
+                    WHERE r.user_id = :uid AND r.active
+                    ORDER BY r.next_run, r.id
+                    """
+                ).columns(next_run=Date),
+                {"uid": user_id},
+            )
+            return [
+                {
+                    "id": int(row["id"]),
+                    "account": row["account"],
+                    "type": row["type"],
+                    "amount": float(row["amount"]),
+                    "category": row["category"],
+                    "comment": row["comment"],
+                    "period": row["period"],
+                    "day": int(row["day"]),
+                    "next_run": row["next_run"],
+                }
+                for row in res.mappings().all()
+            ]
+
+    async def disable_recurring(self, user_id: int, rule_id: int) -> bool:
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text("UPDATE recurring_rules SET active = FALSE WHERE id = :rid AND user_id = :uid AND active"),
+                {"rid": rule_id, "uid": user_id},
+            )
+            return bool(res.rowcount)
+
+    async def get_recurring_schedule(self) -> List[Tuple[int, date]]:
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text("SELECT id, next_run FROM recurring_rules WHERE active").columns(next_run=Date)
+            )
+            return [(int(row[0]), row[1]) for row in res.all()]
+
+    async def materialize_recurring(self, rule_ids: List[int], today: date) -> Dict[int, date]:
+        """Проводит все повторы правил с next_run <= today (включая пропущенные) одним
+        многострочным INSERT. Возвращает новые next_run активных правил."""
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text(
+                    """
+                    SELECT id, period, day, next_run FROM recurring_rules
+                    WHERE id = ANY(CAST(:ids AS INTEGER[])) AND active
+                    FOR UPDATE
+                    """
+                ),
+                {"ids": rule_ids},
+            )
+            schedule: Dict[int, date] = {}
+            due_ids: List[int] = []
+            due_on: List[date] = []
+            for row in res.mappings().all():
+                dates, next_run = due_dates(row["period"], int(row["day"]), row["next_run"], today)
+                schedule[int(row["id"])] = next_run
+                due_ids.extend([int(row["id"])] * len(dates))
+                due_on.extend(dates)
+            if not due_ids:
+                return schedule
+
+            await session.execute(
+                text(
+                    """
+                    WITH due AS (
+                        SELECT * FROM unnest(CAST(:ids AS INTEGER[]), CAST(:dates AS DATE[])) AS d(rule_id, due_on)
+                    ), runs AS (
+                        INSERT INTO recurring_runs (rule_id, due_on)
+                        SELECT rule_id, due_on FROM due
+                        ON CONFLICT DO NOTHING
+                        RETURNING rule_id, due_on
+                    ), posted AS (
+                        INSERT INTO transactions (account_id, user_id, type, amount, category_id, comment, created_at)
+                        SELECT r.account_id, r.user_id, r.type, r.amount, r.category_id, r.comment, runs.due_on
+                        FROM runs JOIN recurring_rules r ON r.id = runs.rule_id
+                        RETURNING account_id, user_id, type, amount, category_id, created_at
+                    )
+                    INSERT INTO budget_limit_usage (limit_id, month, spent)
+                    SELECT l.id, CAST(date_trunc('month', p.created_at) AS DATE), SUM(p.amount)
+                    FROM posted p
+                    JOIN budget_limits l ON l.category_id = p.category_id
+                        AND ((l.account_id IS NULL AND l.user_id = p.user_id) OR l.account_id = p.account_id)
+                    WHERE p.type = 'expense'
+                    GROUP BY l.id, CAST(date_trunc('month', p.created_at) AS DATE)
+                    ON CONFLICT (limit_id, month) DO UPDATE SET spent = budget_limit_usage.spent + EXCLUDED.spent
+                    """
+                ),
+                {"ids": due_ids, "dates": due_on},
+            )
+            await session.execute(
+                text(
+                    """
+                    UPDATE recurring_rules r SET next_run = v.next_run
+                    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:next AS DATE[])) AS v(id, next_run)
+                    WHERE r.id = v.id
+                    """
+                ),
+                {"ids": list(schedule.keys()), "next": list(schedule.values())},
+            )
+            # повторы задним числом меняют остатки уже закрытых месяцев — их отметки пересчитает CheckpointJob
+            await session.execute(
+                text(
+                    """
+                    DELETE FROM balance_checkpoints
+                    WHERE month >= :since
+                      AND account_id IN (SELECT account_id FROM recurring_rules WHERE id = ANY(CAST(:ids AS INTEGER[])))
+                    """
+                ),
+                {"since": min(due_on).replace(day=1), "ids": due_ids},
+            )
+            return schedule
+
+    async def get_digest_data(self, kind: str, since: datetime, until: datetime, top_n: int) -> List[Dict]:
+        """Итоги и топ категорий расходов по доступным счетам (свои и общие) всех пользователей,
+        у которых были операции за период и которым сводка ещё не отправлялась. Один групповой
+        запрос на всех; суммы пересчитываются в базовую валюту получателя, как в get_stats."""
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    WITH access AS (
+                        SELECT a.id AS account_id, a.currency, a.owner_id AS user_id FROM accounts a
+                        UNION
+                        SELECT a.id, a.currency, m.user_id
+                        FROM accounts a
+                        JOIN household_members m ON m.household_id = a.household_id
+                    ), per_day AS (
+                        SELECT x.user_id, u.base_currency AS base, x.currency, t.type, t.category_id,
+                               date(t.created_at) AS day, SUM(t.amount) AS total
+                        FROM transactions t
+                        JOIN access x ON x.account_id = t.account_id
+                        JOIN users u ON u.id = x.user_id
+                        WHERE t.created_at >= :since AND t.created_at < :until
+                          AND NOT EXISTS (
+                              SELECT 1 FROM digest_deliveries d
+                              WHERE d.kind = :kind AND d.period_start = :period_start AND d.user_id = x.user_id
+                          )
+                        GROUP BY x.user_id, u.base_currency, x.currency, t.type, t.category_id, date(t.created_at)
+                    ), converted AS (
+                        SELECT p.user_id, p.base, p.type, p.category_id,
+                               CASE WHEN p.currency = p.base THEN p.total
+                                    ELSE 1.0 * p.total * {rate_of("fx", "p.currency")} / {rate_of("fxb", "p.base")}
+                               END AS total,
+                               CASE WHEN {rate_of("fx", "p.currency")} IS NULL THEN p.currency
+                                    ELSE p.base END AS rate_currency
+                        FROM per_day p
+                        {rate_join("fx", "p.currency", "p.day")}
+                        {rate_join("fxb", "p.base", "p.day")}
+                    )
+                    SELECT v.user_id, u.telegram_id, v.base, v.type, COALESCE(c.name, 'без категории') AS category,
+                           SUM(v.total) AS total, CASE WHEN v.total IS NULL THEN v.rate_currency END AS missing
+                    FROM converted v
+                    JOIN users u ON u.id = v.user_id
+                    LEFT JOIN categories c ON c.id = v.category_id
+                    GROUP BY v.user_id, u.telegram_id, v.base, v.type, COALESCE(c.name, 'без категории'),
+                             CASE WHEN v.total IS NULL THEN v.rate_currency END
+                    ORDER BY v.user_id
+                    """
+                ),
+                {"kind": kind, "since": since, "until": until, "period_start": since.date()},
             )
             rows = res.mappings().all()
 
-            stats = {"income": {}, "expense": {}}
-            for row in rows:
-                category = row["category"] or "без категории"
-                stats[row["type"]][category] = float(row["total"] or 0)
+        digests: Dict[int, Dict] = {}
+        for row in rows:
+            user_id = int(row["user_id"])
+            digest = digests.setdefault(
+                user_id,
+                {
+                    "user_id": user_id,
+                    "telegram_id": int(row["telegram_id"]),
+                    "currency": row["base"],
+                    "income": 0.0,
+                    "expense": 0.0,
+                    "categories": [],
+                    "missing_rates": [],
+                },
+            )
+            if row["missing"] is not None:
+                if row["missing"] not in digest["missing_rates"]:
+                    digest["missing_rates"].append(row["missing"])
+                continue
+            amount = float(row["total"])
+            digest[row["type"]] += amount
+            if row["type"] == "expense":
+                digest["categories"].append({"name": row["category"], "amount": amount})
+        for digest in digests.values():
+            digest["categories"] = sorted(digest["categories"], key=lambda cat: cat["amount"], reverse=True)[:top_n]
+            digest["missing_rates"].sort()
+        return list(digests.values())
 
-            # Общие суммы
-            res_total = await session.execute(
+    async def claim_digest_deliveries(self, kind: str, period_start: date, user_ids: List[int]) -> List[int]:
+        """Отмечает пачку получателей как обслуженных; возвращает тех, кто ещё не был отмечен"""
+        async with self.session_scope() as session:
+            res = await session.execute(
                 text(
                     """
-                    SELECT type, COALESCE(SUM(amount), 0) AS total
-                    FROM transactions
-                    WHERE user_id = :uid AND created_at >= :since
-                    GROUP BY type
+                    INSERT INTO digest_deliveries (kind, period_start, user_id)
+                    SELECT :kind, :period_start, uid FROM unnest(CAST(:uids AS INTEGER[])) AS uid
+                    ON CONFLICT DO NOTHING
+                    RETURNING user_id
+                    """
+                ),
+                {"kind": kind, "period_start": period_start, "uids": user_ids},
+            )
+            return [int(row[0]) for row in res.all()]
+
+    async def get_history(
+        self,
+        account_id: int,
+        cursor: Optional[Tuple[datetime, int]] = None,
+        newer: bool = False,
+        limit: int = 10,
+    ) -> Tuple[List[Dict], bool]:
+        """Страница истории счёта (новые сверху) по ключу (created_at, id) без OFFSET.
+        newer=True — страница перед cursor. Возвращает (строки, есть_ли_ещё_в_этом_направлении).
+        Доступ к счёту проверяет вызывающий (Database — по справочнику счетов)."""
+        params: Dict[str, Any] = {"aid": account_id, "limit": limit + 1}
+        keyset = ""
+        if cursor is not None:
+            keyset = "AND (t.created_at, t.id) > (:ts, :tid)" if newer else "AND (t.created_at, t.id) < (:ts, :tid)"
+            params.update(ts=cursor[0], tid=cursor[1])
+        order = "ASC" if newer else "DESC"
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    SELECT t.id, t.created_at, t.type, t.amount, c.name AS category, t.comment, u.username
+                    FROM {ALL_TRANSACTIONS} t
+                    LEFT JOIN categories c ON c.id = t.category_id
+                    LEFT JOIN users u ON u.id = t.user_id
+                    WHERE t.account_id = :aid
+                      {keyset}
+                    ORDER BY t.created_at {order}, t.id {order}
+                    LIMIT :limit
+                    """
+                ).columns(created_at=DateTime),
+                params,
+            )
+            rows = [
+                {
+                    "id": int(row["id"]),
+                    "created_at": row["created_at"],
+                    "type": row["type"],
+                    "amount": float(row["amount"]),
+                    "category": row["category"],
+                    "comment": row["comment"],
+                    "username": row["username"],
+                }
+                for row in res.mappings().all()
+            ]
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if newer:
+                rows.reverse()
+            return rows, has_more
+
+    async def search_transactions(self, user_id: int, query: str, limit: int = 20) -> List[Dict]:
+        """Поиск по комментариям операций доступных пользователю счетов, лучшие совпадения сверху.
+        Без pg_trgm — только подстрока (ILIKE), новые сверху"""
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        async with self.session_scope(read_only=True) as session:
+            if await self._has_pg_trgm(session):
+                match = "t.comment ILIKE :pattern OR CAST(:q AS TEXT) <% t.comment"
+                order = "word_similarity(CAST(:q AS TEXT), t.comment) DESC, t.created_at DESC, t.id DESC"
+            else:
+                match, order = "t.comment ILIKE :pattern", "t.created_at DESC, t.id DESC"
+            res = await session.execute(
+                text(
+                    f"""
+                    SELECT t.id, t.created_at, t.type, t.amount, t.comment,
+                           acc.name AS account, acc.currency, c.name AS category
+                    FROM {ALL_TRANSACTIONS} t
+                    JOIN accounts acc ON acc.id = t.account_id
+                    LEFT JOIN categories c ON c.id = t.category_id
+                    WHERE t.account_id IN (
+                          SELECT a.id FROM accounts a
+                          WHERE {ACCOUNT_ACCESS}
+                      )
+                      AND ({match})
+                    ORDER BY {order}
+                    LIMIT :limit
+                    """
+                ).columns(created_at=DateTime),
+                {"uid": user_id, "q": query, "pattern": pattern, "limit": limit},
+            )
+            return [
+                {
+                    "id": int(row["id"]),
+                    "created_at": row["created_at"],
+                    "type": row["type"],
+                    "amount": float(row["amount"]),
+                    "comment": row["comment"],
+                    "account": row["account"],
+                    "currency": row["currency"],
+                    "category": row["category"],
+                }
+                for row in res.mappings().all()
+            ]
+
+    async def get_transaction_columns(
+        self, user_id: int, base: str, after_id: int = 0
+    ) -> List[Tuple[int, datetime, int, Optional[float], str]]:
+        """Операции пользователя с id > after_id по возрастанию id: (id, created_at, category_id или 0,
+        сумма со знаком в валюте base по курсу дня операции или None без курса, валюта счёта)"""
+        factor = f"""CASE WHEN a.currency = :base THEN 1.0
+                          ELSE 1.0 * {rate_of("fx", "a.currency")} / {rate_of("fxb", ":base")} END"""
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    SELECT t.id, t.created_at, COALESCE(t.category_id, 0) AS category_id,
+                           CASE WHEN t.type = 'income' THEN t.amount ELSE -t.amount END * {factor} AS amount,
+                           a.currency
+                    FROM transactions t
+                    JOIN accounts a ON a.id = t.account_id
+                    {rate_join("fx", "a.currency", "date(t.created_at)")}
+                    {rate_join("fxb", ":base", "date(t.created_at)")}
+                    WHERE t.user_id = :uid AND t.id > :after
+                    ORDER BY t.id
+                    """
+                ).columns(created_at=DateTime),
+                {"uid": user_id, "after": after_id, "base": base},
+            )
+            return [
+                (int(r[0]), r[1], int(r[2]), float(r[3]) if r[3] is not None else None, r[4]) for r in res.all()
+            ]
+
+    async def get_category_history(self, user_id: int, limit: int) -> List[Tuple[str, int]]:
+        """Последние limit расходов пользователя с категорией и комментарием, от старых к новым:
+        (комментарий, category_id) — для индекса автокатегорий"""
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    """
+                    SELECT comment, category_id FROM transactions
+                    WHERE user_id = :uid AND type = 'expense' AND category_id IS NOT NULL AND comment <> ''
+                    ORDER BY id DESC
+                    LIMIT :limit
+                    """
+                ),
+                {"uid": user_id, "limit": limit},
+            )
+            return [(row[0], int(row[1])) for row in reversed(res.all())]
+
+    async def get_balance_series(self, user_id: int, since: datetime) -> Dict[str, Any]:
+        """Суммарный баланс доступных счетов в базовой валюте пользователя: остаток на since и
+        изменения по дням после него. Изменения пересчитываются по курсу своего дня, как в get_stats;
+        счета в валюте без курса в баланс не входят (missing_rates)."""
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(text("SELECT base_currency FROM users WHERE id = :uid"), {"uid": user_id})
+            base = res.scalar() or DEFAULT_CURRENCY
+            factor = f"""CASE WHEN f.currency = :base THEN 1.0
+                              ELSE 1.0 * {rate_of("fx", "f.currency")} / {rate_of("fxb", ":base")} END"""
+            res = await session.execute(
+                text(
+                    f"""
+                    WITH acc AS (
+                        SELECT a.id, a.currency
+                        FROM accounts a
+                        WHERE {ACCOUNT_ACCESS}
+                    ), flows AS (
+                        SELECT CASE WHEN t.created_at < :since THEN NULL ELSE date(t.created_at) END AS day,
+                               acc.currency,
+                               SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE -t.amount END) AS net
+                        FROM transactions t
+                        JOIN acc ON acc.id = t.account_id
+                        GROUP BY 1, 2
+                    )
+                    SELECT f.day, f.currency, f.net * {factor} AS net
+                    FROM flows f
+                    {rate_join("fx", "f.currency", "COALESCE(f.day, date(:since))")}
+                    {rate_join("fxb", ":base", "COALESCE(f.day, date(:since))")}
+                    ORDER BY f.day
+                    """
+                ).columns(day=Date),
+                {"uid": user_id, "since": since, "base": base},
+            )
+            rows = res.mappings().all()
+            # остаток операций, перенесённых в архив, — по курсу на since
+            res = await session.execute(
+                text(
+                    f"""
+                    SELECT f.currency, SUM(c.balance) * {factor} AS balance
+                    FROM account_balance_carry c
+                    JOIN accounts f ON f.id = c.account_id
+                    {rate_join("fx", "f.currency", "date(:since)")}
+                    {rate_join("fxb", ":base", "date(:since)")}
+                    WHERE c.account_id IN (
+                        SELECT a.id FROM accounts a
+                        WHERE {ACCOUNT_ACCESS}
+                    )
+                    GROUP BY f.currency, fx.rate, fxb.rate
+                    """
+                ),
+                {"uid": user_id, "since": since, "base": base},
+            )
+            carry = res.all()
+        opening, days = 0.0, {}
+        missing = set()
+        for currency, balance in carry:
+            if balance is None:
+                missing.add(currency)
+            else:
+                opening += float(balance)
+        for row in rows:
+            if row["net"] is None:
+                missing.add(row["currency"])
+            elif row["day"] is None:
+                opening += float(row["net"])
+            else:
+                days[row["day"]] = days.get(row["day"], 0.0) + float(row["net"])
+        return {
+            "opening": opening,
+            "days": sorted(days.items()),
+            "currency": base,
+            "missing_rates": sorted(missing),
+        }
+
+    async def get_balance_version(self, user_id: int, since: datetime) -> Tuple[int, int]:
+        """Версия данных графика: (число операций с since, последний id) по доступным счетам.
+        Новые операции записываются текущим временем, а архив переносит только старые строки
+        с сохранением остатка, поэтому хватает диапазона индекса (account_id, created_at)."""
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    SELECT COUNT(*), COALESCE(MAX(t.id), 0)
+                    FROM transactions t
+                    WHERE t.created_at >= :since
+                      AND t.account_id IN (SELECT a.id FROM accounts a WHERE {ACCOUNT_ACCESS})
                     """
                 ),
                 {"uid": user_id, "since": since},
             )
-            totals = {"income": 0.0, "expense": 0.0}
-            for trow in res_total.mappings().all():
-                totals[trow["type"]] = float(trow["total"] or 0)
+            count, last_id = res.one()
+            return int(count), int(last_id)
+
+    async def archive_transactions(self, before: datetime, limit: int) -> int:
+        """Перенести в архив до limit самых старых операций с created_at < before и добавить их
+        сумму к перенесённому остатку счетов. Каждая пачка — одна транзакция, поэтому прерванная
+        архивация просто продолжается следующим вызовом. Возвращает число перенесённых операций."""
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text(
+                    """
+                    WITH moved AS (
+                        DELETE FROM transactions
+                        WHERE id IN (
+                            SELECT id FROM transactions
+                            WHERE created_at < :before
+                            ORDER BY id
+                            LIMIT :limit
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING id, account_id, user_id, type, amount, category_id, comment, created_at
+                    ), archived AS (
+                        INSERT INTO transactions_archive
+                            (id, account_id, user_id, type, amount, category_id, comment, created_at)
+                        SELECT id, account_id, user_id, type, amount, category_id, comment, created_at FROM moved
+                    ), carried AS (
+                        INSERT INTO account_balance_carry (account_id, balance, archived_before)
+                        SELECT account_id, SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END), :before
+                        FROM moved
+                        WHERE account_id IS NOT NULL
+                        GROUP BY account_id
+                        ON CONFLICT (account_id) DO UPDATE
+                        SET balance = account_balance_carry.balance + EXCLUDED.balance,
+                            archived_before = GREATEST(account_balance_carry.archived_before, EXCLUDED.archived_before)
+                    )
+                    SELECT COUNT(*) FROM moved
+                    """
+                ),
+                {"before": before, "limit": limit},
+            )
+            return int(res.scalar() or 0)
+
+    async def update_balance_checkpoints(self, until: date) -> int:
+        """Дописать отметки остатка для месяцев, закончившихся до until (начало месяца).
+        Каждый счёт продолжает счёт от своей последней отметки: просматриваются только
+        операции после неё. Месяцы без операций отметок не получают. Возвращает число новых отметок."""
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    WITH base AS (
+                        SELECT c.account_id, c.month, c.closing_balance
+                        FROM balance_checkpoints c
+                        JOIN (
+                            SELECT account_id, MAX(month) AS month FROM balance_checkpoints GROUP BY account_id
+                        ) last ON last.account_id = c.account_id AND last.month = c.month
+                    ), monthly AS (
+                        SELECT t.account_id, CAST(date_trunc('month', t.created_at) AS DATE) AS month,
+                               SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE -t.amount END) AS net
+                        FROM {ALL_TRANSACTIONS} t
+                        LEFT JOIN base b ON b.account_id = t.account_id
+                        WHERE t.account_id IS NOT NULL AND t.created_at < :until
+                          AND (b.month IS NULL OR t.created_at >= b.month + INTERVAL '1 month')
+                        GROUP BY 1, 2
+                    )
+                    INSERT INTO balance_checkpoints (account_id, month, closing_balance)
+                    SELECT m.account_id, m.month,
+                           COALESCE(b.closing_balance, 0) + SUM(m.net) OVER (PARTITION BY m.account_id ORDER BY m.month)
+                    FROM monthly m
+                    LEFT JOIN base b ON b.account_id = m.account_id
+                    ON CONFLICT (account_id, month) DO NOTHING
+                    RETURNING account_id
+                    """
+                ),
+                {"until": until},
+            )
+            return len(res.all())
+
+    async def get_balance_at(self, account_id: int, ts: datetime) -> float:
+        """Баланс счёта с учётом операций до ts (не включая): последняя отметка месяца,
+        закончившегося не позже ts, плюс операции от её конца до ts"""
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    """
+                    SELECT month, closing_balance FROM balance_checkpoints
+                    WHERE account_id = :aid AND month < :month
+                    ORDER BY month DESC
+                    LIMIT 1
+                    """
+                ).columns(month=Date),
+                {"aid": account_id, "month": self._month_start(ts)},
+            )
+            checkpoint = res.first()
+            opening, since_filter, params = 0.0, "", {"aid": account_id, "ts": ts}
+            if checkpoint is not None:
+                opening = float(checkpoint[1])
+                since_filter = "AND created_at >= :since"
+                params["since"] = datetime.combine(self._next_month(checkpoint[0]), datetime.min.time())
+            res = await session.execute(
+                text(
+                    f"""
+                    SELECT COALESCE(SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END), 0)
+                    FROM {ALL_TRANSACTIONS} t
+                    WHERE account_id = :aid AND created_at < :ts {since_filter}
+                    """
+                ),
+                params,
+            )
+            return opening + float(res.scalar() or 0)
 
-            stats["totals"] = totals
-            return stats
+    async def get_pending_notifications(self, ready_before: datetime, limit: int) -> List[Dict]:
+        """Все уведомления не более чем limit получателей, у которых самое старое ожидает с ready_before
+        или раньше (за окно успевают накопиться соседние операции): получатели — по самой старой
+        строке, строки получателя идут подряд и целиком, поэтому его пачка не делится между проходами.
+        Читается с primary: на отстающей реплике могли остаться уже отправленные и удалённые строки.
+        Готовые строки ищутся по индексу created_at, строки получателей — по (recipient_id, created_at)"""
+        async with self.session_scope(read_only=True, primary=True) as session:
+            res = await session.execute(
+                text(
+                    """
+                    WITH ready AS (
+                        SELECT recipient_id, MIN(id) AS first_id
+                        FROM notification_outbox
+                        WHERE created_at <= :ready
+                        GROUP BY recipient_id
+                        ORDER BY first_id
+                        LIMIT :limit
+                    )
+                    SELECT o.id, o.recipient_id, u.telegram_id, a.name AS account, a.currency,
+                           actor.username AS actor, actor.telegram_id AS actor_telegram_id, o.type, o.amount
+                    FROM ready r
+                    JOIN notification_outbox o ON o.recipient_id = r.recipient_id
+                    JOIN users u ON u.id = o.recipient_id
+                    JOIN accounts a ON a.id = o.account_id
+                    LEFT JOIN users actor ON actor.id = o.actor_id
+                    ORDER BY r.first_id, o.id
+                    """
+                ),
+                {"ready": ready_before, "limit": limit},
+            )
+            return [
+                {
+                    "id": int(row["id"]),
+                    "recipient_id": int(row["recipient_id"]),
+                    "telegram_id": int(row["telegram_id"]),
+                    "account": row["account"],
+                    "currency": row["currency"],
+                    "actor": row["actor"] or str(row["actor_telegram_id"]),
+                    "type": row["type"],
+                    "amount": float(row["amount"]),
+                }
+                for row in res.mappings().all()
+            ]
+
+    async def delete_notifications(self, ids: List[int]) -> None:
+        async with self.session_scope() as session:
+            await session.execute(
+                text("DELETE FROM notification_outbox WHERE id = ANY(CAST(:ids AS INTEGER[]))"), {"ids": ids}
+            )
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+from typing import Optional
+
+from app.domain.categorizer import CategoryIndex
+
+
+class CategoryIndexes:
+    """
+    Индексы автокатегорий в памяти процесса: пользователь -> CategoryIndex (LRU на max_users).
+
+    Индекс строится по истории при первой подсказке, дальше каждая записанная операция
+    дописывается в него сразу. Вытесненный пользователь при следующем обращении
+    перечитывается из БД — индекс только ускоряет подсказку и ничего не хранит сам.
+    """
+
+    def __init__(self, max_users: int, max_tokens: int):
+        self._max_users = max_users
+        self._max_tokens = max_tokens
+        self._indexes: "OrderedDict[int, CategoryIndex]" = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[CategoryIndex]:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+        return index
+
+    def new(self, user_id: int) -> CategoryIndex:
+        index = self._indexes[user_id] = CategoryIndex(self._max_tokens)
+        self._indexes.move_to_end(user_id)
+        if len(self._indexes) > self._max_users:
+            self._indexes.popitem(last=False)
+        return index
+
+    def learn(self, user_id: int, comment: str, category_id: Optional[int]) -> None:
+        """Дописать операцию в индекс, если он уже загружен; незагруженный прочитает её из БД"""
+        index = self._indexes.get(user_id)
+        if index is not None and category_id is not None and comment:
+            index.learn(comment, category_id)
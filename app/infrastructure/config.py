@@ -1,22 +1,63 @@
+from typing import Optional
+
 from app.config import settings
 
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+
+def is_sqlite_url(url: str) -> bool:
+    return url.startswith("sqlite")
 
 
 def _to_async_url(url: str) -> str:
     # Convert sync Postgres URL to asyncpg dialect if needed
     if url.startswith("postgresql://") and "+" not in url:
         return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    # Same for SQLite: aiosqlite driver
+    if url.startswith("sqlite://") and "+" not in url:
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
     return url
 
 
-def get_engine():
-    database_url = getattr(settings, "database_url", None) or getattr(settings, "DATABASE_URI", None)
+def _configure_sqlite(engine: AsyncEngine) -> None:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, _):
+        # WAL: читатели не блокируются писателем; внешние ключи в SQLite по умолчанию выключены
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
+def get_database_url(database_url: Optional[str] = None) -> str:
+    database_url = (
+        database_url or getattr(settings, "database_url", None) or getattr(settings, "DATABASE_URI", None)
+    )
     if not database_url:
         raise RuntimeError("Database URL is not configured in settings")
-    return create_async_engine(_to_async_url(database_url), echo=False)
+    return database_url
+
+
+def get_engine(database_url: Optional[str] = None):
+    database_url = get_database_url(database_url)
+    engine = create_async_engine(_to_async_url(database_url), echo=False)
+    if is_sqlite_url(database_url):
+        _configure_sqlite(engine)
+    return engine
+
+
+def get_session(database_url: Optional[str] = None):
+    engine = get_engine(database_url)
+    return async_sessionmaker(bind=engine, expire_on_commit=False)
 
 
-def get_session():
-    engine = get_engine()
+def get_read_session():
+    """Фабрика сессий для реплики или None, если database_read_url не задан"""
+    read_url = getattr(settings, "database_read_url", None)
+    if not read_url:
+        return None
+    engine = create_async_engine(_to_async_url(read_url), echo=False, pool_pre_ping=True)
     return async_sessionmaker(bind=engine, expire_on_commit=False)
@@ -1,46 +1,147 @@
-from typing import List, Dict, Optional, Any
-from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Any, Tuple
+from datetime import date, datetime, timedelta
 
+from app.config import settings
+from app.domain.dto import Account, AccountWithBalance, CategoryTotal, StatsSummary
+from app.domain.idempotency import RecentKeys
+from app.domain.money import DEFAULT_CURRENCY, REFERENCE_CURRENCY
+from app.infrastructure.account_directory import AccountDirectory
 from app.infrastructure.budget_storage import BudgetStorage
+from app.infrastructure.category_indexes import CategoryIndexes
+from app.infrastructure.config import get_database_url, is_sqlite_url
+from app.infrastructure.rate_cache import RateCache
+
+# Доля лимита, при пересечении которой отправляется предупреждение
+LIMIT_WARN_RATIO = 0.8
+
+
+def make_storage(backend: str, database_url: Optional[str] = None) -> BudgetStorage:
+    """Выбор реализации хранилища: SQLite по схеме database_url, иначе по settings.storage_backend"""
+    if is_sqlite_url(get_database_url(database_url)):
+        from app.infrastructure.sqlite_storage import SqliteBudgetStorage
+
+        return SqliteBudgetStorage(database_url)
+    if backend == "asyncpg":
+        from app.infrastructure.asyncpg_storage import AsyncpgBudgetStorage
+
+        return AsyncpgBudgetStorage(database_url)
+    if backend == "sqlalchemy":
+        return BudgetStorage(database_url)
+    raise RuntimeError(f"Unknown storage backend: {backend}")
 
 
 class Database:
     """
     Совместимость с прежним интерфейсом Database, но реализация перенесена
-    на инфраструктурный слой (SQLAlchemy AsyncSession через BaseStorage).
+    на инфраструктурный слой (SQLAlchemy AsyncSession через BaseStorage;
+    PostgreSQL, опционально с быстрым путём asyncpg, или встроенный SQLite).
     """
 
-    def __init__(self, database_url: str):
-        # database_url больше не нужен напрямую: BudgetStorage использует app.config
-        self._storage = BudgetStorage()
+    def __init__(self, database_url: str, backend: Optional[str] = None):
+        # пустой database_url — берём из app.config
+        self._storage = make_storage(backend or settings.storage_backend, database_url or None)
+        # недавние ключи операций: повторная доставка отсекается без запроса к БД
+        self._recent_keys = RecentKeys(settings.idempotency_recent_keys)
+        # кто к каким счетам имеет доступ: проверки в обработчиках без запросов к БД
+        self._directory = AccountDirectory(settings.account_directory_users, settings.account_directory_ttl)
+        # последние курсы валют для показа балансов
+        self._rates = RateCache(settings.rate_cache_ttl)
+        # слова комментариев -> категории: подсказка категории без запроса к БД
+        self._category_indexes = CategoryIndexes(settings.autocat_users, settings.autocat_tokens_per_user)
+        # справочник категорий заполняется при создании таблиц и не меняется: читаем один раз
+        self._categories: Optional[Dict[int, str]] = None
 
     async def connect(self):
-        # Совместимость: в новой реализации отдельного пула не требуется
-        return None
+        """Открыть пул соединений (нужен только бэкенду asyncpg)"""
+        await self._storage.connect()
 
     async def close(self):
-        # Совместимость: явного закрытия не требуется
-        return None
+        """Закрыть пул соединений"""
+        await self._storage.close()
+
+    async def init_tables(self) -> bool:
+        """Создание таблиц БД, если версия схемы устарела. True — если DDL выполнялся"""
+        return await self._storage.init_tables()
+
+    async def get_meta(self, key: str) -> Optional[str]:
+        """Служебное значение из app_meta"""
+        return await self._storage.get_meta(key)
 
-    async def init_tables(self):
-        """Создание таблиц БД"""
-        await self._storage.init_tables()
+    async def set_meta(self, key: str, value: str) -> None:
+        """Сохранить служебное значение в app_meta"""
+        await self._storage.set_meta(key, value)
 
     async def create_or_get_user(self, telegram_id: int, username: str | None = None) -> int:
         """Создать пользователя или получить его ID"""
-        return await self._storage.create_or_get_user(telegram_id, username)
+        user_id = self._directory.user_id(telegram_id)
+        if user_id is None:
+            user_id = await self._storage.create_or_get_user(telegram_id, username)
+            self._directory.remember_user(telegram_id, user_id)
+        return user_id
 
-    async def create_account(self, user_id: int, name: str) -> bool:
-        """Создать новый счет"""
-        return await self._storage.create_account(user_id, name)
+    async def create_account(self, user_id: int, name: str, currency: str = DEFAULT_CURRENCY) -> bool:
+        """Создать новый счет в валюте currency"""
+        created = await self._storage.create_account(user_id, name, currency)
+        if created:
+            self._directory.invalidate(user_id)
+        return created
 
-    async def get_user_accounts(self, user_id: int) -> List[Dict]:
-        """Получить все счета пользователя (свои + расшаренные)"""
-        return await self._storage.get_user_accounts(user_id)
+    async def get_base_currency(self, user_id: int) -> str:
+        """Валюта, в которой пользователь видит итоги статистики"""
+        return await self._storage.get_base_currency(user_id)
 
-    async def get_account_by_name(self, user_id: int, name: str) -> Optional[Dict]:
+    async def set_base_currency(self, user_id: int, currency: str) -> None:
+        """Сменить базовую валюту пользователя"""
+        await self._storage.set_base_currency(user_id, currency)
+
+    async def load_exchange_rates(self, rates: List[Tuple[date, str, float]]) -> int:
+        """Загрузить курсы (дата, валюта, рублей за единицу); возвращает число записанных"""
+        count = await self._storage.upsert_exchange_rates(rates)
+        self._rates.invalidate()
+        return count
+
+    async def get_rates(self) -> Dict[str, float]:
+        """Последние курсы валют {валюта: рублей за единицу} из кэша в памяти"""
+        rates = self._rates.get()
+        if rates is None:
+            rates = self._rates.put(await self._storage.get_latest_rates())
+        return rates
+
+    async def convert(self, amount: float, currency: str, to_currency: str) -> Optional[float]:
+        """Пересчёт по последним курсам; None — курса одной из валют нет"""
+        if currency == to_currency:
+            return amount
+        rates = {**await self.get_rates(), REFERENCE_CURRENCY: 1.0}
+        if currency not in rates or to_currency not in rates:
+            return None
+        return amount * rates[currency] / rates[to_currency]
+
+    async def get_user_accounts(self, user_id: int) -> List[AccountWithBalance]:
+        """Получить все счета пользователя (свои + расшаренные) с балансами"""
+        accounts = await self._storage.get_user_accounts(user_id, self._directory.stale(user_id))
+        # заодно обновляем справочник доступа
+        self._directory.put(user_id, accounts)
+        return accounts
+
+    async def get_accessible_accounts(self, user_id: int) -> Dict[int, Account]:
+        """Доступные пользователю счета по id (из справочника, без балансов)"""
+        accounts = self._directory.accounts(user_id)
+        if accounts is None:
+            accounts = await self._storage.get_account_access(user_id, self._directory.stale(user_id))
+            accounts = self._directory.put(user_id, accounts)
+        return accounts
+
+    async def get_account(self, user_id: int, account_id: int) -> Optional[Account]:
+        """Счет по id, если он доступен пользователю; None — нет доступа"""
+        return (await self.get_accessible_accounts(user_id)).get(account_id)
+
+    async def get_account_by_name(self, user_id: int, name: str) -> Optional[Account]:
         """Найти счет по названию среди доступных пользователю"""
-        return await self._storage.get_account_by_name(user_id, name)
+        by_name = self._directory.by_name(user_id)
+        if by_name is None:
+            await self.get_accessible_accounts(user_id)
+            by_name = self._directory.by_name(user_id)
+        return by_name.get(name)
 
     async def get_account_balance(self, account_id: int) -> float:
         """Получить баланс счета"""
@@ -54,55 +155,277 @@ class Database:
         amount: float,
         category_id: Optional[int],
         comment: str,
+        idempotency_key: Optional[str] = None,
     ) -> bool:
-        """Добавить транзакцию"""
-        await self._storage.add_transaction(account_id, user_id, transaction_type, amount, category_id, comment)
-        return True
+        """Добавить транзакцию. False — операция с этим ключом уже записана (повторная доставка)"""
+        usage = await self._insert_transaction(
+            account_id, user_id, transaction_type, amount, category_id, comment, idempotency_key
+        )
+        return usage is not None
+
+    async def _insert_transaction(
+        self,
+        account_id: int,
+        user_id: int,
+        transaction_type: str,
+        amount: float,
+        category_id: Optional[int],
+        comment: str,
+        idempotency_key: Optional[str],
+    ) -> Optional[List[Dict]]:
+        if idempotency_key is not None and not self._recent_keys.add(idempotency_key):
+            return None
+        try:
+            usage = await self._storage.add_transaction(
+                account_id, user_id, transaction_type, amount, category_id, comment, idempotency_key
+            )
+        except Exception:
+            # запись не удалась — повторная доставка должна её выполнить
+            if idempotency_key is not None:
+                self._recent_keys.discard(idempotency_key)
+            raise
+        if usage is not None and transaction_type == "expense":
+            self._category_indexes.learn(user_id, comment, category_id)
+        return usage
+
+    async def add_expense(
+        self,
+        account_id: int,
+        user_id: int,
+        amount: float,
+        category_id: int,
+        comment: str,
+        idempotency_key: Optional[str] = None,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Добавить расход и вернуть предупреждения о лимитах, пересечённых этой операцией:
+        [{'scope': 'user' | 'account', 'limit': float, 'spent': float, 'level': 80 | 100}]
+        None — операция с этим ключом уже записана (повторная доставка)
+        """
+        usage = await self._insert_transaction(
+            account_id, user_id, "expense", amount, category_id, comment, idempotency_key
+        )
+        if usage is None:
+            return None
+        return self._limit_alerts(usage, amount)
+
+    async def add_expenses(
+        self,
+        account_id: int,
+        user_id: int,
+        items: List[Tuple[float, int, str]],
+        idempotency_key: Optional[str] = None,
+    ) -> Optional[Dict[int, List[Dict[str, Any]]]]:
+        """Добавить несколько расходов (сумма, категория, комментарий) одной записью.
+        Возвращает предупреждения о лимитах по категориям (как add_expense);
+        None — сообщение уже обработано (повторная доставка)"""
+        if idempotency_key is not None and not self._recent_keys.add(idempotency_key):
+            return None
+        # у каждой позиции свой ключ: ключ сообщения + номер строки
+        keyed = [
+            (amount, category_id, comment, f"{idempotency_key}:{i}" if idempotency_key is not None else None)
+            for i, (amount, category_id, comment) in enumerate(items)
+        ]
+        try:
+            usage = await self._storage.add_expenses(account_id, user_id, keyed)
+        except Exception:
+            if idempotency_key is not None:
+                self._recent_keys.discard(idempotency_key)
+            raise
+        if usage is None:
+            return None
+        totals: Dict[int, float] = {}
+        for amount, category_id, comment in items:
+            totals[category_id] = totals.get(category_id, 0.0) + amount
+            self._category_indexes.learn(user_id, comment, category_id)
+        return {category_id: self._limit_alerts(usage[category_id], totals[category_id]) for category_id in usage}
+
+    @staticmethod
+    def _limit_alerts(usage: List[Dict], amount: float) -> List[Dict[str, Any]]:
+        alerts: List[Dict[str, Any]] = []
+        for item in usage:
+            spent, limit = item["spent"], item["limit"]
+            if limit <= 0:
+                continue
+            before = spent - amount
+            # предупреждение только на операции, которая пересекла порог
+            if spent >= limit > before:
+                level = 100
+            elif spent >= limit * LIMIT_WARN_RATIO > before:
+                level = 80
+            else:
+                continue
+            alerts.append(
+                {
+                    "scope": "user" if item["account_id"] is None else "account",
+                    "limit": limit,
+                    "spent": spent,
+                    "level": level,
+                }
+            )
+        return alerts
+
+    async def set_limit(self, user_id: int, category_id: int, amount: float, account_id: Optional[int] = None) -> None:
+        """Установить месячный лимит по категории: на пользователя или на конкретный счёт"""
+        await self._storage.set_limit(user_id, category_id, amount, account_id)
+
+    async def get_limits(self, user_id: int) -> List[Dict]:
+        """Лимиты пользователя с расходом за текущий месяц"""
+        return await self._storage.get_limits(user_id)
 
     async def get_category_by_name(self, name: str) -> Optional[int]:
         """Получить ID категории по названию"""
-        return await self._storage.get_category_by_name(name)
+        for category_id, category_name in (await self.get_categories()).items():
+            if category_name == name:
+                return category_id
+        return None
+
+    async def get_categories(self) -> Dict[int, str]:
+        """Все категории: id -> название (из памяти после первого чтения)"""
+        if self._categories is None:
+            self._categories = await self._storage.get_categories()
+        return self._categories
 
     async def share_account(self, account_id: int, owner_id: int, target_user_id: int) -> bool:
-        """Расшарить счет другому пользователю"""
-        return await self._storage.share_account(account_id, owner_id, target_user_id)
-
-    async def get_stats(self, user_id: int, period_days: int) -> Dict[str, Any]:
-        """Получить статистику по всем доступным счетам за период
-        Возвращает данные в старом формате для совместимости с handlers:
-        {
-            'total_income': float,
-            'total_expense': float,
-            'categories': [
-                {'name': str, 'amount': float, 'percentage': float}
-            ]  # только по расходам
-        }
+        """Открыть пользователю доступ к счету: счет переходит в семью владельца с прежними участниками
+        счета и получателем, доступ к другим счетам не меняется"""
+        affected = await self._storage.share_account(account_id, owner_id, target_user_id)
+        # у того, кому счет стал виден, справочник доступа перечитывается
+        self._directory.invalidate(*affected)
+        return bool(affected)
+
+    async def get_households(self, user_id: int) -> List[Dict]:
+        """Семьи пользователя с участниками и общими счетами"""
+        return await self._storage.get_households(user_id)
+
+    async def add_recurring(
+        self,
+        user_id: int,
+        account_id: int,
+        transaction_type: str,
+        amount: float,
+        category_id: Optional[int],
+        comment: str,
+        period: str,
+        day: int,
+    ) -> Dict:
+        """Создать повторяющуюся операцию. Возвращает {'id': int, 'next_run': date}"""
+        return await self._storage.add_recurring(
+            user_id, account_id, transaction_type, amount, category_id, comment, period, day
+        )
+
+    async def get_recurring(self, user_id: int) -> List[Dict]:
+        """Активные повторяющиеся операции пользователя"""
+        return await self._storage.get_recurring(user_id)
+
+    async def disable_recurring(self, user_id: int, rule_id: int) -> bool:
+        """Отключить повторяющуюся операцию пользователя"""
+        return await self._storage.disable_recurring(user_id, rule_id)
+
+    async def get_recurring_schedule(self) -> List[Tuple[int, date]]:
+        """Пары (rule_id, next_run) всех активных правил — для планировщика"""
+        return await self._storage.get_recurring_schedule()
+
+    async def materialize_recurring(self, rule_ids: List[int], today: date) -> Dict[int, date]:
+        """Провести созревшие повторы (с догонянием пропущенных), вернуть новые next_run"""
+        return await self._storage.materialize_recurring(rule_ids, today)
+
+    async def get_digest_data(self, kind: str, since: datetime, until: datetime, top_n: int = 3) -> List[Dict]:
+        """Сводки за период [since, until) по доступным счетам всех пользователей, которым они ещё
+        не отправлены, в базовой валюте получателя: [{'user_id', 'telegram_id', 'currency', 'income',
+        'expense', 'categories': [{'name', 'amount'}], 'missing_rates'}]
         """
-        raw = await self._storage.get_stats(user_id, period_days)
-        totals = raw.get("totals", {})
-        total_income = float(totals.get("income", 0.0))
-        total_expense = float(totals.get("expense", 0.0))
+        return await self._storage.get_digest_data(kind, since, until, top_n)
+
+    async def claim_digest_deliveries(self, kind: str, period_start: date, user_ids: List[int]) -> List[int]:
+        """Зарезервировать отправку сводки; возвращает user_id, которым ещё можно отправлять"""
+        return await self._storage.claim_digest_deliveries(kind, period_start, user_ids)
+
+    async def archive_transactions(self, before: datetime, limit: int) -> int:
+        """Перенести пачку операций старше before в архив; возвращает размер пачки (0 — больше нечего)"""
+        return await self._storage.archive_transactions(before, limit)
+
+    async def update_balance_checkpoints(self, until: date) -> int:
+        """Дописать месячные отметки остатка для месяцев до until; возвращает число новых"""
+        return await self._storage.update_balance_checkpoints(until)
+
+    async def get_balance_at(self, account_id: int, ts: datetime) -> float:
+        """Баланс счёта по операциям до ts (не включая)"""
+        return await self._storage.get_balance_at(account_id, ts)
 
-        expense_by_cat: Dict[str, float] = {k: float(v) for k, v in raw.get("expense", {}).items()}
-        # Формируем категории с процентами (от суммы расходов)
-        categories: List[Dict[str, Any]] = []
+    async def get_pending_notifications(self, ready_before: datetime, limit: int) -> List[Dict]:
+        """Уведомления для общих счетов, готовые к отправке (для диспетчера outbox)"""
+        return await self._storage.get_pending_notifications(ready_before, limit)
+
+    async def delete_notifications(self, ids: List[int]) -> None:
+        if ids:
+            await self._storage.delete_notifications(ids)
+
+    async def get_history(
+        self,
+        user_id: int,
+        account_id: int,
+        cursor: Optional[Tuple[datetime, int]] = None,
+        newer: bool = False,
+        limit: int = 10,
+    ) -> Tuple[List[Dict], bool]:
+        """Страница операций счёта (новые сверху) после/до курсора (created_at, id).
+        Возвращает (операции, есть ли ещё страницы в направлении листания); счёт без доступа — пусто"""
+        if await self.get_account(user_id, account_id) is None:
+            return [], False
+        return await self._storage.get_history(account_id, cursor, newer, limit)
+
+    async def search_transactions(self, user_id: int, query: str, limit: int = 20) -> List[Dict]:
+        """Поиск операций по комментарию среди доступных пользователю счетов"""
+        return await self._storage.search_transactions(user_id, query, limit)
+
+    async def get_stats(self, user_id: int, period_days: int) -> StatsSummary:
+        """Статистика по всем доступным счетам за период: итоги и расходы по категориям
+        с долей от суммы расходов, по убыванию суммы"""
+        raw = await self._storage.get_stats(user_id, period_days)
+        total_income = raw["totals"]["income"]
+        total_expense = raw["totals"]["expense"]
+        categories: Tuple[CategoryTotal, ...] = ()
         if total_expense > 0:
-            for name, amount in expense_by_cat.items():
-                categories.append(
-                    {
-                        "name": name,
-                        "amount": amount,
-                        "percentage": (amount / total_expense) * 100.0,
-                    }
+            categories = tuple(
+                sorted(
+                    (
+                        CategoryTotal(name, amount, amount / total_expense * 100.0)
+                        for name, amount in raw["expense"].items()
+                    ),
+                    key=lambda cat: cat.amount,
+                    reverse=True,
                 )
-            # Сортировка по сумме по убыванию для красивого вывода
-            categories.sort(key=lambda x: x["amount"], reverse=True)
-        else:
-            # Нет расходов — возвращаем пустой список
-            categories = []
-
-        return {
-            "total_income": total_income,
-            "total_expense": total_expense,
-            "categories": categories,
-        }
+            )
+        return StatsSummary(total_income, total_expense, categories, raw["currency"], tuple(raw["missing_rates"]))
+
+    async def get_transaction_columns(
+        self, user_id: int, base: str, after_id: int = 0
+    ) -> List[Tuple[int, datetime, int, Optional[float], str]]:
+        """Операции пользователя после after_id для аналитики: (id, created_at, category_id,
+        сумма со знаком в валюте base или None — нет курса, валюта счёта)"""
+        return await self._storage.get_transaction_columns(user_id, base, after_id)
+
+    async def suggest_category(self, user_id: int, comment: str) -> Optional[Tuple[int, bool]]:
+        """Категория расхода по словам комментария из прошлых расходов пользователя:
+        (category_id, уверенно ли — можно подставить без вопроса) или None, если подсказать нечего"""
+        if not settings.autocat_enabled or not comment:
+            return None
+        index = self._category_indexes.get(user_id)
+        if index is None:
+            history = await self._storage.get_category_history(user_id, settings.autocat_history)
+            index = self._category_indexes.new(user_id)
+            index.learn_many(history)
+        guess = index.suggest(comment)
+        if guess is None:
+            return None
+        category_id, votes, share = guess
+        return category_id, votes >= settings.autocat_min_votes and share >= settings.autocat_min_share
+
+    async def get_balance_series(self, user_id: int, since: datetime) -> Dict[str, Any]:
+        """Баланс доступных счетов по дням с since:
+        {'opening', 'days': [(date, изменение)], 'currency', 'missing_rates'}"""
+        return await self._storage.get_balance_series(user_id, since)
+
+    async def get_balance_version(self, user_id: int, since: datetime) -> Tuple[int, int]:
+        """Версия данных для графика с since: меняется с каждой новой операцией на доступных счетах"""
+        return await self._storage.get_balance_version(user_id, since)
@@ -13,6 +13,17 @@ from .example_model import (  # noqa
     UserModel,
     CategoryModel,
     AccountModel,
-    AccountShareModel,
+    HouseholdModel,
+    HouseholdMemberModel,
     TransactionModel,
+    BudgetLimitModel,
+    BudgetLimitUsageModel,
+    RecurringRuleModel,
+    RecurringRunModel,
+    DigestDeliveryModel,
+    NotificationOutboxModel,
+    TransactionArchiveModel,
+    AccountBalanceCarryModel,
+    BalanceCheckpointModel,
+    ExchangeRateModel,
 )
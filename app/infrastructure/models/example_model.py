@@ -1,8 +1,8 @@
 # import uuid
-from datetime import datetime
+from datetime import date, datetime
 from . import BaseModel
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, Integer, BigInteger, Text, Numeric, ForeignKey, DateTime
+from sqlalchemy import String, Integer, SmallInteger, BigInteger, Boolean, Text, Numeric, ForeignKey, DateTime, Date
 from sqlalchemy.sql import func
 
 # from sqlalchemy.dialects.postgresql import UUID
@@ -32,6 +32,7 @@ class UserModel(BaseModel):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
     username: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    base_currency: Mapped[str] = mapped_column(String(3), nullable=False, server_default="RUB")
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
 
 
@@ -45,29 +46,150 @@ class CategoryModel(BaseModel):
 class AccountModel(BaseModel):
     __tablename__ = "accounts"
 
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(255), nullable=False)
+    owner_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    household_id: Mapped[int | None] = mapped_column(
+        Integer, ForeignKey("households.id", ondelete="SET NULL"), nullable=True, index=True
+    )
+    currency: Mapped[str] = mapped_column(String(3), nullable=False, server_default="RUB")
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
+
+
+class HouseholdModel(BaseModel):
+    __tablename__ = "households"
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     owner_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
 
 
-class AccountShareModel(BaseModel):
-    __tablename__ = "account_shares"
+class HouseholdMemberModel(BaseModel):
+    __tablename__ = "household_members"
+
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    household_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("households.id", ondelete="CASCADE"), primary_key=True, index=True
+    )
+    joined_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
+
+
+class TransactionModel(BaseModel):
+    __tablename__ = "transactions"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     account_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"))
     user_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    type: Mapped[str] = mapped_column(String(10), nullable=False)
+    amount: Mapped[float] = mapped_column(Numeric(12, 2), nullable=False)
+    category_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("categories.id"))
+    comment: Mapped[str | None] = mapped_column(Text, nullable=True)
+    idempotency_key: Mapped[str | None] = mapped_column(String(64), unique=True, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
 
 
-class TransactionModel(BaseModel):
-    __tablename__ = "transactions"
+class BudgetLimitModel(BaseModel):
+    __tablename__ = "budget_limits"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     account_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"))
+    category_id: Mapped[int] = mapped_column(Integer, ForeignKey("categories.id", ondelete="CASCADE"), nullable=False)
+    amount: Mapped[float] = mapped_column(Numeric(12, 2), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
+
+
+class BudgetLimitUsageModel(BaseModel):
+    __tablename__ = "budget_limit_usage"
+
+    limit_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("budget_limits.id", ondelete="CASCADE"), primary_key=True
+    )
+    month: Mapped[date] = mapped_column(Date, primary_key=True)
+    spent: Mapped[float] = mapped_column(Numeric(12, 2), nullable=False, default=0)
+
+
+class RecurringRuleModel(BaseModel):
+    __tablename__ = "recurring_rules"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    account_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"))
     type: Mapped[str] = mapped_column(String(10), nullable=False)
     amount: Mapped[float] = mapped_column(Numeric(12, 2), nullable=False)
     category_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("categories.id"))
     comment: Mapped[str | None] = mapped_column(Text, nullable=True)
+    period: Mapped[str] = mapped_column(String(10), nullable=False)
+    day: Mapped[int] = mapped_column(SmallInteger, nullable=False)
+    next_run: Mapped[date] = mapped_column(Date, nullable=False)
+    active: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
+
+
+class RecurringRunModel(BaseModel):
+    __tablename__ = "recurring_runs"
+
+    rule_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("recurring_rules.id", ondelete="CASCADE"), primary_key=True
+    )
+    due_on: Mapped[date] = mapped_column(Date, primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
+
+
+class DigestDeliveryModel(BaseModel):
+    __tablename__ = "digest_deliveries"
+
+    kind: Mapped[str] = mapped_column(String(10), primary_key=True)
+    period_start: Mapped[date] = mapped_column(Date, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    sent_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
+
+
+class NotificationOutboxModel(BaseModel):
+    __tablename__ = "notification_outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    recipient_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    account_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"))
+    actor_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    type: Mapped[str] = mapped_column(String(10), nullable=False)
+    amount: Mapped[float] = mapped_column(Numeric(12, 2), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)  # type: ignore[name-defined]
+
+
+class TransactionArchiveModel(BaseModel):
+    __tablename__ = "transactions_archive"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    account_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"))
+    user_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    type: Mapped[str] = mapped_column(String(10), nullable=False)
+    amount: Mapped[float] = mapped_column(Numeric(12, 2), nullable=False)
+    category_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("categories.id"))
+    comment: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class AccountBalanceCarryModel(BaseModel):
+    __tablename__ = "account_balance_carry"
+
+    account_id: Mapped[int] = mapped_column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    balance: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False, default=0)
+    archived_before: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class BalanceCheckpointModel(BaseModel):
+    __tablename__ = "balance_checkpoints"
+
+    account_id: Mapped[int] = mapped_column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    month: Mapped[date] = mapped_column(Date, primary_key=True)
+    closing_balance: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False)
+
+
+class ExchangeRateModel(BaseModel):
+    __tablename__ = "exchange_rates"
+
+    currency: Mapped[str] = mapped_column(String(3), primary_key=True)
+    date: Mapped[date] = mapped_column(Date, primary_key=True)
+    rate: Mapped[float] = mapped_column(Numeric(18, 6), nullable=False)
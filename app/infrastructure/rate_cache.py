@@ -0,0 +1,31 @@
+import time
+from typing import Callable, Dict, Optional
+
+
+class RateCache:
+    """
+    Последние курсы валют в памяти процесса: {валюта: рублей за единицу}.
+
+    Курсы меняются раз в день загрузкой из файла, а нужны на каждый показ баланса,
+    поэтому таблица читается одним запросом и живёт ttl секунд. Загрузка курсов
+    через Database сбрасывает кэш сразу.
+    """
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._rates: Optional[Dict[str, float]] = None
+        self._expires = 0.0
+
+    def get(self) -> Optional[Dict[str, float]]:
+        if self._rates is None or self._clock() >= self._expires:
+            return None
+        return self._rates
+
+    def put(self, rates: Dict[str, float]) -> Dict[str, float]:
+        self._rates = rates
+        self._expires = self._clock() + self._ttl
+        return rates
+
+    def invalidate(self) -> None:
+        self._rates = None
@@ -0,0 +1,45 @@
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+from app.config import settings
+
+# Telegram ID пользователя, чьё обновление сейчас обрабатывается (ставит ActorMiddleware)
+current_actor: ContextVar[Optional[int]] = ContextVar("current_actor", default=None)
+
+
+class ReadYourWrites:
+    """
+    Помнит, кто недавно писал в primary: их чтения в течение окна не уходят
+    на реплику, чтобы пользователь сразу видел свою операцию.
+    """
+
+    def __init__(
+        self, window: Optional[float] = None, max_size: int = 10000, clock: Callable[[], float] = time.monotonic
+    ):
+        self._window = window if window is not None else settings.read_your_writes_seconds
+        self._max_size = max_size
+        self._clock = clock
+        self._last_write: Dict[int, float] = {}
+
+    def mark_write(self) -> None:
+        actor = current_actor.get()
+        if actor is None:
+            return
+        now = self._clock()
+        self._last_write[actor] = now
+        if len(self._last_write) > self._max_size:
+            self._evict(now)
+
+    def needs_primary(self) -> bool:
+        actor = current_actor.get()
+        if actor is None:
+            return False
+        written_at = self._last_write.get(actor)
+        return written_at is not None and self._clock() - written_at < self._window
+
+    def _evict(self, now: float) -> None:
+        self._last_write = {k: v for k, v in self._last_write.items() if now - v < self._window}
+
+
+read_your_writes = ReadYourWrites()
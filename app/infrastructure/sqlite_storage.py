@@ -0,0 +1,543 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Date, DateTime, bindparam, text
+
+from app.domain.recurrence import due_dates
+from app.infrastructure.budget_storage import ACCOUNT_ACCESS, ALL_TRANSACTIONS, BudgetStorage
+
+# Та же схема, что в BudgetStorage.init_tables, в диалекте SQLite
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id BIGINT UNIQUE NOT NULL,
+        username VARCHAR(255),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255) UNIQUE NOT NULL
+    )
+    """,
+    """
+    INSERT INTO categories (name) VALUES
+    ('еда'), ('транспорт'), ('жильё'), ('развлечения'), ('другое')
+    ON CONFLICT (name) DO NOTHING
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255) NOT NULL,
+        owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(name, owner_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS households (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255) NOT NULL,
+        owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS household_members (
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        household_id INTEGER REFERENCES households(id) ON DELETE CASCADE,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, household_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_household_members_household ON household_members (household_id)",
+    """
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        type VARCHAR(10) CHECK (type IN ('income', 'expense')),
+        amount DECIMAL(12, 2) NOT NULL,
+        category_id INTEGER REFERENCES categories(id),
+        comment TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_transactions_created_at ON transactions (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_transactions_user_id ON transactions (user_id, id)",
+    "CREATE INDEX IF NOT EXISTS ix_transactions_account_created ON transactions (account_id, created_at DESC, id DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS transactions_archive (
+        id INTEGER PRIMARY KEY,
+        account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        type VARCHAR(10) CHECK (type IN ('income', 'expense')),
+        amount DECIMAL(12, 2) NOT NULL,
+        category_id INTEGER REFERENCES categories(id),
+        comment TEXT,
+        created_at TIMESTAMP NOT NULL
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_transactions_archive_account_created
+    ON transactions_archive (account_id, created_at DESC, id DESC)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS account_balance_carry (
+        account_id INTEGER PRIMARY KEY REFERENCES accounts(id) ON DELETE CASCADE,
+        balance DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        archived_before TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS balance_checkpoints (
+        account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+        month DATE NOT NULL,
+        closing_balance DECIMAL(14, 2) NOT NULL,
+        PRIMARY KEY (account_id, month)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS budget_limits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+        category_id INTEGER NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+        amount DECIMAL(12, 2) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_budget_limits_user
+    ON budget_limits (category_id, user_id) WHERE account_id IS NULL
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_budget_limits_account
+    ON budget_limits (category_id, account_id) WHERE account_id IS NOT NULL
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS budget_limit_usage (
+        limit_id INTEGER REFERENCES budget_limits(id) ON DELETE CASCADE,
+        month DATE NOT NULL,
+        spent DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (limit_id, month)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS recurring_rules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+        type VARCHAR(10) CHECK (type IN ('income', 'expense')),
+        amount DECIMAL(12, 2) NOT NULL,
+        category_id INTEGER REFERENCES categories(id),
+        comment TEXT,
+        period VARCHAR(10) NOT NULL CHECK (period IN ('monthly', 'weekly')),
+        day SMALLINT NOT NULL,
+        next_run DATE NOT NULL,
+        active BOOLEAN NOT NULL DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS recurring_runs (
+        rule_id INTEGER REFERENCES recurring_rules(id) ON DELETE CASCADE,
+        due_on DATE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (rule_id, due_on)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS digest_deliveries (
+        kind VARCHAR(10) NOT NULL,
+        period_start DATE NOT NULL,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (kind, period_start, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipient_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+        actor_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        type VARCHAR(10) NOT NULL,
+        amount DECIMAL(12, 2) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_notification_outbox_created ON notification_outbox (created_at)",
+    """
+    CREATE INDEX IF NOT EXISTS ix_notification_outbox_recipient_created
+    ON notification_outbox (recipient_id, created_at)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS exchange_rates (
+        date DATE NOT NULL,
+        currency VARCHAR(3) NOT NULL,
+        rate DECIMAL(18, 6) NOT NULL,
+        PRIMARY KEY (currency, date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS app_meta (
+        key VARCHAR(64) PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """,
+]
+
+# Столбцы, добавленные после первой версии схемы: (таблица, столбец, определение)
+SQLITE_COLUMNS = [
+    ("transactions", "idempotency_key", "VARCHAR(64)"),
+    ("accounts", "currency", "VARCHAR(3) NOT NULL DEFAULT 'RUB'"),
+    ("users", "base_currency", "VARCHAR(3) NOT NULL DEFAULT 'RUB'"),
+    ("accounts", "household_id", "INTEGER REFERENCES households(id) ON DELETE SET NULL"),
+]
+# Индексы по этим столбцам — создаются после ALTER TABLE
+SQLITE_COLUMN_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_transactions_idempotency_key ON transactions (idempotency_key)",
+    "CREATE INDEX IF NOT EXISTS ix_accounts_owner ON accounts (owner_id)",
+    "CREATE INDEX IF NOT EXISTS ix_accounts_household ON accounts (household_id)",
+]
+
+
+def _values(rows: Sequence[Sequence[Any]], prefix: str = "v") -> Tuple[str, Dict[str, Any]]:
+    """Многострочный VALUES с именованными параметрами: ('(:v0_0, :v0_1), ...', {...})"""
+    params: Dict[str, Any] = {}
+    groups = []
+    for i, row in enumerate(rows):
+        names = []
+        for j, value in enumerate(row):
+            name = f"{prefix}{i}_{j}"
+            params[name] = value
+            names.append(f":{name}")
+        groups.append(f"({', '.join(names)})")
+    return ", ".join(groups), params
+
+
+class SqliteBudgetStorage(BudgetStorage):
+    """
+    Встроенное хранилище на SQLite (aiosqlite, WAL) для установок на одну семью.
+
+    Выбирается по схеме database_url (sqlite:///path/to/budget.db). Запросы, которые
+    в SQLite пишутся иначе (DDL, CTE с INSERT, unnest, pg_trgm), переопределены,
+    остальные наследуются из BudgetStorage. В WAL читатели работают параллельно,
+    а все пишущие сессии проходят через одну очередь (asyncio.Lock), поэтому
+    писатель в каждый момент один и SQLITE_BUSY не возникает.
+    """
+
+    def __init__(self, database_url: Optional[str] = None):
+        super().__init__(database_url)
+        self._writer = asyncio.Lock()
+
+    @asynccontextmanager
+    async def session_scope(self, read_only=False, primary=False):
+        if read_only:
+            async with super().session_scope(read_only=True, primary=primary) as session:
+                yield session
+            return
+        async with self._writer:
+            async with super().session_scope() as session:
+                yield session
+
+    async def _create_schema(self, session) -> None:
+        for statement in SQLITE_SCHEMA:
+            await session.execute(text(statement))
+        # в SQLite нет ADD COLUMN IF NOT EXISTS: добавляем недостающие столбцы по PRAGMA table_info
+        for table, column, definition in SQLITE_COLUMNS:
+            res = await session.execute(text(f"PRAGMA table_info({table})"))
+            if column not in {row[1] for row in res.all()}:
+                await session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+        for statement in SQLITE_COLUMN_INDEXES:
+            await session.execute(text(statement))
+        await self._migrate_account_shares(session)
+
+    @staticmethod
+    async def _table_exists(session, name: str) -> bool:
+        res = await session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": name}
+        )
+        return res.first() is not None
+
+    async def add_expenses(
+        self, account_id: int, user_id: int, items: List[Tuple[float, int, str, Optional[str]]]
+    ) -> Optional[Dict[int, List[Dict]]]:
+        rows, params = _values([(account_id, user_id, "expense", *item) for item in items])
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    INSERT INTO transactions (account_id, user_id, type, amount, category_id, comment, idempotency_key)
+                    VALUES {rows}
+                    ON CONFLICT (idempotency_key) DO NOTHING
+                    RETURNING category_id, amount
+                    """
+                ),
+                params,
+            )
+            return await self._bump_batch_usage(session, account_id, user_id, res.all())
+
+    async def _bump_limit_usage(
+        self, session, account_id: int, user_id: int, amount: float, category_id: int
+    ) -> List[Dict]:
+        # В SQLite нет INSERT внутри CTE: инкремент и чтение — два запроса в той же транзакции
+        params = {"cid": category_id, "uid": user_id, "aid": account_id, "month": self._month_start(), "amount": amount}
+        limits = """
+            SELECT id, account_id, amount FROM budget_limits
+            WHERE category_id = :cid AND account_id IS NULL AND user_id = :uid
+            UNION ALL
+            SELECT id, account_id, amount FROM budget_limits
+            WHERE category_id = :cid AND account_id = :aid
+        """
+        await session.execute(
+            text(
+                f"""
+                INSERT INTO budget_limit_usage (limit_id, month, spent)
+                SELECT id, :month, :amount FROM ({limits}) WHERE true
+                ON CONFLICT (limit_id, month) DO UPDATE SET spent = spent + excluded.spent
+                """
+            ),
+            params,
+        )
+        res = await session.execute(
+            text(
+                f"""
+                SELECT lim.id, lim.account_id, lim.amount AS limit_amount, u.spent
+                FROM ({limits}) lim
+                JOIN budget_limit_usage u ON u.limit_id = lim.id AND u.month = :month
+                """
+            ),
+            params,
+        )
+        return [
+            {
+                "limit_id": int(row["id"]),
+                "account_id": int(row["account_id"]) if row["account_id"] is not None else None,
+                "limit": float(row["limit_amount"]),
+                "spent": float(row["spent"]),
+            }
+            for row in res.mappings().all()
+        ]
+
+    async def materialize_recurring(self, rule_ids: List[int], today: date) -> Dict[int, date]:
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text("SELECT id, period, day, next_run FROM recurring_rules WHERE id IN :ids AND active")
+                .bindparams(bindparam("ids", expanding=True))
+                .columns(next_run=Date),
+                {"ids": rule_ids},
+            )
+            schedule: Dict[int, date] = {}
+            due: List[Tuple[int, date]] = []
+            for row in res.mappings().all():
+                dates, next_run = due_dates(row["period"], int(row["day"]), row["next_run"], today)
+                schedule[int(row["id"])] = next_run
+                due.extend((int(row["id"]), d) for d in dates)
+            if not schedule:
+                return schedule
+
+            if due:
+                values, params = _values(due)
+                res = await session.execute(
+                    text(
+                        f"""
+                        INSERT INTO recurring_runs (rule_id, due_on) VALUES {values}
+                        ON CONFLICT DO NOTHING
+                        RETURNING rule_id, due_on
+                        """
+                    ),
+                    params,
+                )
+                # created_at храним полной меткой времени, как DEFAULT CURRENT_TIMESTAMP
+                posted = [(int(row[0]), datetime.combine(date.fromisoformat(str(row[1])), time())) for row in res.all()]
+                if posted:
+                    values, params = _values(posted)
+                    posted_cte = f"WITH posted (rule_id, due_on) AS (VALUES {values})"
+                    await session.execute(
+                        text(
+                            f"""
+                            {posted_cte}
+                            INSERT INTO transactions
+                                (account_id, user_id, type, amount, category_id, comment, created_at)
+                            SELECT r.account_id, r.user_id, r.type, r.amount, r.category_id, r.comment, p.due_on
+                            FROM posted p JOIN recurring_rules r ON r.id = p.rule_id
+                            """
+                        ),
+                        params,
+                    )
+                    await session.execute(
+                        text(
+                            f"""
+                            {posted_cte}
+                            INSERT INTO budget_limit_usage (limit_id, month, spent)
+                            SELECT l.id, strftime('%Y-%m-01', p.due_on), SUM(r.amount)
+                            FROM posted p
+                            JOIN recurring_rules r ON r.id = p.rule_id
+                            JOIN budget_limits l ON l.category_id = r.category_id
+                                AND ((l.account_id IS NULL AND l.user_id = r.user_id) OR l.account_id = r.account_id)
+                            WHERE r.type = 'expense'
+                            GROUP BY l.id, strftime('%Y-%m-01', p.due_on)
+                            ON CONFLICT (limit_id, month) DO UPDATE SET spent = spent + excluded.spent
+                            """
+                        ),
+                        params,
+                    )
+                    await session.execute(
+                        text(
+                            """
+                            DELETE FROM balance_checkpoints
+                            WHERE month >= :since
+                              AND account_id IN (SELECT account_id FROM recurring_rules WHERE id IN :ids)
+                            """
+                        ).bindparams(bindparam("ids", expanding=True)),
+                        {"since": min(p[1] for p in posted).date().replace(day=1), "ids": [p[0] for p in posted]},
+                    )
+            await session.execute(
+                text("UPDATE recurring_rules SET next_run = :next_run WHERE id = :id"),
+                [{"id": rule_id, "next_run": next_run} for rule_id, next_run in schedule.items()],
+            )
+            return schedule
+
+    async def claim_digest_deliveries(self, kind: str, period_start: date, user_ids: List[int]) -> List[int]:
+        if not user_ids:
+            return []
+        values, params = _values([(kind, period_start, uid) for uid in user_ids])
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    INSERT INTO digest_deliveries (kind, period_start, user_id) VALUES {values}
+                    ON CONFLICT DO NOTHING
+                    RETURNING user_id
+                    """
+                ),
+                params,
+            )
+            return [int(row[0]) for row in res.all()]
+
+    async def search_transactions(self, user_id: int, query: str, limit: int = 20) -> List[Dict]:
+        # Без pg_trgm: подстрока через LIKE, свежие операции сверху
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        async with self.session_scope(read_only=True) as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    SELECT t.id, t.created_at, t.type, t.amount, t.comment,
+                           acc.name AS account, acc.currency, c.name AS category
+                    FROM {ALL_TRANSACTIONS} t
+                    JOIN accounts acc ON acc.id = t.account_id
+                    LEFT JOIN categories c ON c.id = t.category_id
+                    WHERE t.account_id IN (
+                          SELECT a.id FROM accounts a
+                          WHERE {ACCOUNT_ACCESS}
+                      )
+                      AND t.comment LIKE :pattern ESCAPE '\\'
+                    ORDER BY t.created_at DESC, t.id DESC
+                    LIMIT :limit
+                    """
+                ).columns(created_at=DateTime),
+                {"uid": user_id, "pattern": pattern, "limit": limit},
+            )
+            return [
+                {
+                    "id": int(row["id"]),
+                    "created_at": row["created_at"],
+                    "type": row["type"],
+                    "amount": float(row["amount"]),
+                    "comment": row["comment"],
+                    "account": row["account"],
+                    "currency": row["currency"],
+                    "category": row["category"],
+                }
+                for row in res.mappings().all()
+            ]
+
+    async def archive_transactions(self, before: datetime, limit: int) -> int:
+        # В SQLite нет DELETE ... RETURNING внутри CTE: те же шаги отдельными запросами в одной транзакции
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text("SELECT id FROM transactions WHERE created_at < :before ORDER BY id LIMIT :limit"),
+                {"before": before, "limit": limit},
+            )
+            ids = [int(row[0]) for row in res.all()]
+            if not ids:
+                return 0
+            params = {"ids": ids, "before": before}
+            await session.execute(
+                text(
+                    """
+                    INSERT INTO transactions_archive
+                        (id, account_id, user_id, type, amount, category_id, comment, created_at)
+                    SELECT id, account_id, user_id, type, amount, category_id, comment, created_at
+                    FROM transactions WHERE id IN :ids
+                    """
+                ).bindparams(bindparam("ids", expanding=True)),
+                params,
+            )
+            await session.execute(
+                text(
+                    """
+                    INSERT INTO account_balance_carry (account_id, balance, archived_before)
+                    SELECT account_id, SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END), :before
+                    FROM transactions
+                    WHERE id IN :ids AND account_id IS NOT NULL
+                    GROUP BY account_id
+                    ON CONFLICT (account_id) DO UPDATE
+                    SET balance = balance + excluded.balance,
+                        archived_before = MAX(archived_before, excluded.archived_before)
+                    """
+                ).bindparams(bindparam("ids", expanding=True)),
+                params,
+            )
+            await session.execute(
+                text("DELETE FROM transactions WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": ids},
+            )
+            return len(ids)
+
+    async def update_balance_checkpoints(self, until: date) -> int:
+        async with self.session_scope() as session:
+            res = await session.execute(
+                text(
+                    f"""
+                    WITH base AS (
+                        SELECT c.account_id, c.month, c.closing_balance
+                        FROM balance_checkpoints c
+                        JOIN (
+                            SELECT account_id, MAX(month) AS month FROM balance_checkpoints GROUP BY account_id
+                        ) last ON last.account_id = c.account_id AND last.month = c.month
+                    ), monthly AS (
+                        SELECT t.account_id, strftime('%Y-%m-01', t.created_at) AS month,
+                               SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE -t.amount END) AS net
+                        FROM {ALL_TRANSACTIONS} t
+                        LEFT JOIN base b ON b.account_id = t.account_id
+                        WHERE t.account_id IS NOT NULL AND t.created_at < :until
+                          AND (b.month IS NULL OR t.created_at >= date(b.month, '+1 month'))
+                        GROUP BY 1, 2
+                    )
+                    INSERT INTO balance_checkpoints (account_id, month, closing_balance)
+                    SELECT m.account_id, m.month,
+                           COALESCE(b.closing_balance, 0) + SUM(m.net) OVER (PARTITION BY m.account_id ORDER BY m.month)
+                    FROM monthly m
+                    LEFT JOIN base b ON b.account_id = m.account_id
+                    WHERE true
+                    ON CONFLICT (account_id, month) DO NOTHING
+                    RETURNING account_id
+                    """
+                ),
+                {"until": until},
+            )
+            return len(res.all())
+
+    async def delete_notifications(self, ids: List[int]) -> None:
+        async with self.session_scope() as session:
+            await session.execute(
+                text("DELETE FROM notification_outbox WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": ids},
+            )
@@ -29,13 +29,13 @@ def create_if_not_exist_database(url: str):
             result = connection.execute(text(f"SELECT 1 FROM pg_database WHERE datname = '{db_name}'")).fetchone()
 
             if not result:
-                logging.info(f"База данных не существует. Создаём: {db_name}")
+                logging.info("База данных не существует. Создаём: %s", db_name)
                 connection.execute(text(f"CREATE DATABASE {db_name}"))
             else:
-                logging.info(f"База данных {db_name} уже существует.")
+                logging.info("База данных %s уже существует.", db_name)
 
     except OperationalError as e:
-        logging.error(f"Ошибка при создании базы данных: {e}")
+        logging.error("Ошибка при создании базы данных: %s", e)
         raise
     finally:
         engine.dispose()
@@ -1,13 +1,128 @@
+import atexit
+import json
 import logging
+import queue
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional, Tuple
+
 from app.config import settings
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO if not settings.debug else logging.DEBUG,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-    ],
-)
+# Контекст текущего обновления: update_id, user, handler. Словарь заводит мидлварь обновления,
+# вложенные мидлвари дописывают в него, а фильтр копирует поля в каждую запись лога
+log_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar("log_context", default=None)
+
+# Поля записи, которые попадают в JSON, если заданы (через контекст или extra=)
+CONTEXT_FIELDS = ("update_id", "user", "handler", "duration_ms", "suppressed")
+
+
+class ContextFilter(logging.Filter):
+    """Дописывает в запись поля контекста обновления. Работает в потоке, который пишет в лог,
+    поэтому видит contextvar текущей задачи"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = log_context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return True
+
+
+class WarningSampler(logging.Filter):
+    """
+    Ограничение повторяющихся предупреждений: не больше burst записей с одним шаблоном
+    сообщения (record.msg до подстановки аргументов) за window секунд. Первая запись
+    следующего окна получает поле suppressed — сколько повторов было отброшено.
+    Ошибки и записи ниже WARNING проходят всегда.
+    """
+
+    def __init__(self, burst: int, window: float, clock=time.monotonic):
+        super().__init__()
+        self._burst = burst
+        self._window = window
+        self._clock = clock
+        # (логгер, шаблон) -> [начало окна, выведено записей, отброшено записей]
+        self._seen: Dict[Tuple[str, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.WARNING:
+            return True
+        now = self._clock()
+        key = (record.name, str(record.msg))
+        entry = self._seen.get(key)
+        if entry is None or now - entry[0] >= self._window:
+            suppressed = entry[2] if entry else 0
+            if suppressed:
+                record.suppressed = suppressed
+            self._seen[key] = [now, 1, 0]
+            if len(self._seen) > 1000:
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self._window}
+            return True
+        if entry[1] < self._burst:
+            entry[1] += 1
+            return True
+        entry[2] += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение и поля контекста"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке: в очередь уходит запись как есть,
+    сообщение собирается в потоке QueueListener"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            # traceback нельзя передать между потоками после выхода из except — форматируем сразу
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging() -> QueueListener:
+    """Корневой логгер пишет в очередь; вывод в stdout — в фоновом потоке QueueListener"""
+    stream = logging.StreamHandler()
+    if settings.log_format == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(WarningSampler(settings.log_warning_burst, settings.log_warning_window))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(logging.INFO if not settings.debug else logging.DEBUG)
+
+    listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
 
+listener = setup_logging()
 logger = logging.getLogger(__name__)
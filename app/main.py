@@ -1,96 +1,254 @@
 import asyncio
-from app.logger import logger
+import hashlib
+import hmac
+import json
+import time
+from typing import List, Optional
+
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler
-from aiohttp import web
-from aiohttp.web import middleware
-from aiohttp.web_middlewares import normalize_path_middleware
 
+from app.application.charts import StatsCharts
+from app.application.recurring_scheduler import RecurringScheduler
 from app.config import settings
 from app.infrastructure.database import Database
+from app.logger import logger
+from app.middlewares.actor import ActorMiddleware
+from app.middlewares.profiling import ProfilingMiddleware
+from app.middlewares.throttling import ThrottlingMiddleware
+from app.middlewares.update_log import HandlerLogMiddleware, UpdateLogMiddleware
+from app.startup import FirstUpdateMiddleware, StartupTimer
 from handlers import setup_handlers
 
+# Список команд бота
+COMMANDS = [
+    BotCommand(command="start", description="Начать работу"),
+    BotCommand(command="new_account", description="Создать счёт"),
+    BotCommand(command="accounts", description="Мои счета"),
+    BotCommand(command="income", description="Добавить доход (команда)"),
+    BotCommand(command="expense", description="Добавить расход (команда)"),
+    BotCommand(command="batch", description="Несколько расходов сразу"),
+    BotCommand(command="history", description="История операций"),
+    BotCommand(command="balance", description="Баланс счёта на дату"),
+    BotCommand(command="search", description="Поиск по комментариям"),
+    BotCommand(command="stats", description="Статистика (week|month)"),
+    BotCommand(command="currency", description="Базовая валюта и курсы"),
+    BotCommand(command="trend", description="Тренд и прогноз расходов"),
+    BotCommand(command="limit", description="Лимиты по категориям"),
+    BotCommand(command="recurring", description="Повторяющиеся операции"),
+    BotCommand(command="share", description="Поделиться счётом"),
+    BotCommand(command="household", description="Семья и общие счета"),
+]
+
 
 async def on_startup(_: Dispatcher, bot: Bot):
     if settings.webhook_url:
         resp = await bot.set_webhook(settings.webhook_url)
-        logger.info(f"Webhook set response: {resp}")
+        logger.info("Webhook set response: %s", resp)
 
 
 async def on_shutdown(_: Dispatcher, bot: Bot):
     await bot.delete_webhook()
 
 
-@middleware
-async def log_requests_middleware(request, handler):
-    response = await handler(request)
-    if response.status != 200:
-        logger.warning(f"Request error: {request.method} {request.path} -> {response.status}")
-    return response
-
-
-async def main():
-    """Основная функция запуска бота (поддержка Polling/Webhook)"""
+def _commands_hash(commands: List[BotCommand]) -> str:
+    payload = json.dumps([(c.command, c.description) for c in commands], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def sync_bot_commands(bot: Bot, db: Database) -> bool:
+    """Обновить команды в Telegram, только если их список изменился. True — если обновляли"""
+    # ключ привязан к боту: при смене токена команды выставятся заново
+    key = f"bot_commands_hash:{settings.bot_token.split(':', 1)[0]}"
+    digest = _commands_hash(COMMANDS)
+    if await db.get_meta(key) == digest:
+        return False
+    await bot.set_my_commands(COMMANDS)
+    await db.set_meta(key, digest)
+    return True
+
+
+def profiling_control(profiler: ProfilingMiddleware):
+    """aiohttp-обработчик ручки профилирования:
+    GET — состояние, POST ?enabled=1&every=10&handler=cmd_stats&user_id=123 — изменить"""
+    from aiohttp import web
+
+    async def handle(request):
+        if not hmac.compare_digest(request.headers.get("X-Profile-Token", ""), settings.profile_control_token):
+            return web.json_response({"error": "forbidden"}, status=403)
+        if request.method == "GET":
+            return web.json_response(profiler.state())
+        query = request.query
+        try:
+            state = profiler.configure(
+                enabled=query["enabled"] in ("1", "true", "on") if "enabled" in query else None,
+                every=int(query["every"]) if "every" in query else None,
+                handler=query.get("handler"),
+                user_id=int(query["user_id"] or 0) if "user_id" in query else None,
+            )
+        except ValueError:
+            return web.json_response({"error": "bad parameters"}, status=400)
+        if not profiler.enabled:
+            await profiler.flush()
+        return web.json_response(state)
+
+    return handle
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, profiler: Optional[ProfilingMiddleware] = None):
+    # aiohttp-сервер нужен только в режиме вебхуков
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+    from aiohttp import web
+    from aiohttp.web import middleware
+    from aiohttp.web_middlewares import normalize_path_middleware
+
+    @middleware
+    async def log_requests_middleware(request, handler):
+        response = await handler(request)
+        if response.status != 200:
+            logger.warning("Request error: %s %s -> %s", request.method, request.path, response.status)
+        return response
+
+    logger.info("Включен режим Webhook: %s", settings.webhook_url)
+    app = web.Application(middlewares=[normalize_path_middleware()])
+    app.middlewares.append(log_requests_middleware)
+
+    # Регистрация обработчика вебхуков
+    SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=settings.webhook_path)
+    if profiler is not None and settings.profile_control_token:
+        handle = profiling_control(profiler)
+        app.router.add_get(settings.profile_control_path, handle)
+        app.router.add_post(settings.profile_control_path, handle)
+
+    # Старт aiohttp сервера
+    await on_startup(dp, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.webhook_host, port=int(settings.webhook_port))
+    logger.info("Запуск aiohttp-сервера на %s:%s", settings.webhook_host, settings.webhook_port)
+    await site.start()
+    logger.info("Сервер вебхуков запущен. Ожидание событий...")
+    await asyncio.Event().wait()
+
+
+async def main(started: Optional[float] = None):
+    """Основная функция запуска бота (поддержка Polling/Webhook).
+    started — perf_counter() до импортов (ставит python -m app), иначе отсчёт с вызова"""
+    timer = StartupTimer(time.perf_counter() if started is None else started)
+    timer.mark("импорты")
 
     # Создание бота и диспетчера
     bot = Bot(token=settings.bot_token)
     dp = Dispatcher(storage=MemoryStorage())
+    dp.update.outer_middleware(UpdateLogMiddleware())
+    dp.update.outer_middleware(ActorMiddleware())
+    dp.update.outer_middleware(FirstUpdateMiddleware(timer))
 
     # Инициализация базы данных
     db = Database(settings.database_url)
     await db.connect()
-    await db.init_tables()
-    logger.info("База данных инициализирована")
+    timer.mark("подключение к БД")
+    if await db.init_tables():
+        logger.info("База данных инициализирована")
+    else:
+        logger.info("Схема БД актуальна, DDL пропущен")
+    timer.mark("схема БД")
+
+    # Планировщик повторяющихся операций (догоняет пропущенные при старте)
+    scheduler = RecurringScheduler(db)
+    await scheduler.start()
+    timer.mark("планировщик")
+
+    # Графики к статистике (процессы пула стартуют при первом графике)
+    charts = StatsCharts(db) if settings.stats_charts_enabled else None
 
     # Настройка обработчиков
-    handlers_router = setup_handlers(db)
+    handlers_router = setup_handlers(db, scheduler=scheduler, charts=charts)
+    handlers_router.message.middleware(HandlerLogMiddleware())
+    handlers_router.callback_query.middleware(HandlerLogMiddleware())
+    throttling = ThrottlingMiddleware()
+    handlers_router.message.middleware(throttling)
+    handlers_router.callback_query.middleware(throttling)
+    # после ограничения частоты: в профиль попадает только сам обработчик
+    profiler = ProfilingMiddleware()
+    handlers_router.message.middleware(profiler)
+    handlers_router.callback_query.middleware(profiler)
     dp.include_router(handlers_router)
 
-    # Устанавливаем список команд бота
-    commands = [
-        BotCommand(command="start", description="Начать работу"),
-        BotCommand(command="new_account", description="Создать счёт"),
-        BotCommand(command="accounts", description="Мои счета"),
-        BotCommand(command="income", description="Добавить доход (команда)"),
-        BotCommand(command="expense", description="Добавить расход (команда)"),
-        BotCommand(command="stats", description="Статистика (week|month)"),
-        BotCommand(command="share", description="Поделиться счётом"),
-    ]
-    await bot.set_my_commands(commands)
+    # Устанавливаем список команд бота (только если он изменился)
+    if await sync_bot_commands(bot, db):
+        logger.info("Команды бота обновлены")
+    timer.mark("команды")
+
+    # Еженедельные/ежемесячные сводки
+    digest = None
+    if settings.digest_enabled:
+        from app.application.digest import DigestJob
+
+        digest = DigestJob(bot, db)
+        digest.start()
+
+    # Уведомления участникам общих счетов из outbox
+    notifier = None
+    if settings.notifications_enabled:
+        from app.application.notifications import NotificationDispatcher
+
+        notifier = NotificationDispatcher(bot, db)
+        notifier.start()
+
+    # Перенос старых операций в архив
+    archiver = None
+    if settings.archive_enabled:
+        from app.application.archive import ArchiveJob
+
+        archiver = ArchiveJob(db)
+        archiver.start()
+
+    # Месячные отметки остатка для баланса на дату
+    checkpoints = None
+    if settings.checkpoints_enabled:
+        from app.application.checkpoints import CheckpointJob
+
+        checkpoints = CheckpointJob(db)
+        checkpoints.start()
+    timer.mark("фоновые задачи")
 
     try:
-        await bot.delete_webhook()
         if settings.webhook_url:
-            logger.info(f"Включен режим Webhook: {settings.webhook_url}")
-            app = web.Application(middlewares=[normalize_path_middleware()])
-            app.middlewares.append(log_requests_middleware)
-
-            # Регистрация обработчика вебхуков
-            SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=settings.webhook_path)
-
-            # Старт aiohttp сервера
-            await on_startup(dp, bot)
-            runner = web.AppRunner(app)
-            await runner.setup()
-            site = web.TCPSite(runner, host=settings.webhook_host, port=int(settings.webhook_port))
-            logger.info(f"Запуск aiohttp-сервера на {settings.webhook_host}:{settings.webhook_port}")
-            await site.start()
-            logger.info("Сервер вебхуков запущен. Ожидание событий...")
-            await asyncio.Event().wait()
+            logger.info(timer.summary())
+            await run_webhook(dp, bot, profiler)
         else:
+            await bot.delete_webhook()
+            timer.mark("сброс вебхука")
+            logger.info(timer.summary())
             logger.info("Включен режим Polling.")
             await dp.start_polling(bot)
     finally:
         if settings.webhook_url:
             await on_shutdown(dp, bot)
+        if digest is not None:
+            await digest.stop()
+        if notifier is not None:
+            await notifier.stop()
+        if archiver is not None:
+            await archiver.stop()
+        if checkpoints is not None:
+            await checkpoints.stop()
+        if charts is not None:
+            charts.shutdown()
+        await profiler.flush()
+        await scheduler.stop()
         await db.close()
         await bot.session.close()
 
 
-if __name__ == "__main__":
+def run(started: Optional[float] = None) -> None:
     try:
-        asyncio.run(main())
+        asyncio.run(main(started))
     except KeyboardInterrupt:
         print("Бот остановлен")
+
+
+if __name__ == "__main__":
+    run()
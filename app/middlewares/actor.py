@@ -0,0 +1,24 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from app.infrastructure.routing import current_actor
+
+
+class ActorMiddleware(BaseMiddleware):
+    """Запоминает автора обновления в contextvar: по нему хранилище решает,
+    можно ли читать с реплики (read-your-writes)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        token = current_actor.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            current_actor.reset(token)
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from types import FrameType
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from app.config import settings
+from app.logger import logger
+
+
+def handler_name(data: Dict[str, Any]) -> str:
+    """Имя функции обработчика (cmd_stats, quick_entry, ...) из данных внутренней мидлвари"""
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    return getattr(callback, "__name__", "unknown")
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Сэмплер стека потока цикла событий: фоновый поток раз в interval секунд снимает текущий
+    стек этого потока. Сэмпл засчитывается, только если в стеке есть кадр anchor (корутина
+    мидлвари, которая ждёт обработчик), — значит, сейчас выполняется задача профилируемого
+    обработчика. Пока она ждёт ввода-вывода, цикл выполняет чужие задачи — эти сэмплы
+    отбрасываются. Стек пишется от anchor вниз в формате «свёрнутых стеков» (a;b;c).
+    """
+
+    def __init__(self, root: str, anchor: FrameType, interval: float):
+        self.stacks: Counter = Counter()
+        self._root = root
+        self._anchor = anchor
+        self._interval = interval
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            labels = []
+            while frame is not None and frame is not self._anchor:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            if frame is self._anchor:
+                labels.append(self._root)
+                self.stacks[";".join(reversed(labels))] += 1
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """
+    Выборочное профилирование обработчиков: сэмплер стека (StackSampler) для каждого N-го
+    подходящего обновления.
+
+    Подключается к message/callback_query роутера после ограничения частоты, поэтому
+    профилируется только сам обработчик. Фильтры: имя обработчика и/или Telegram ID.
+    В профиль попадают только сэмплы задачи обработчика: чужие обновления, планировщики
+    и рассылки, которые цикл выполняет, пока обработчик ждёт БД или Telegram, отбрасываются.
+    Сэмплы копятся по обработчикам и раз в profile_flush_every замеров сбрасываются файлом
+    .folded в profile_dir; старше profile_max_files файлов удаляются. В один момент
+    профилируется не больше одного обновления — один поток сэмплера на процесс.
+    Включается и настраивается на лету через configure() (ручка вебхук-сервера).
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        every: Optional[int] = None,
+        handler: Optional[str] = None,
+        user_id: Optional[int] = None,
+        directory: Optional[str] = None,
+    ):
+        self.enabled = settings.profile_enabled if enabled is None else enabled
+        self.every = max(1, every or settings.profile_every)
+        self.handler = handler or settings.profile_handler
+        self.user_id = user_id or settings.profile_user_id
+        self._directory = directory or settings.profile_dir
+        self._seen = 0
+        self._active = False
+        self._stacks: Dict[str, Counter] = {}
+        self._samples: Dict[str, int] = {}
+        self._files = 0
+
+    def configure(
+        self,
+        enabled: Optional[bool] = None,
+        every: Optional[int] = None,
+        handler: Optional[str] = None,
+        user_id: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Поменять настройки на лету; пустая строка/0 снимает фильтр. Возвращает текущее состояние"""
+        if enabled is not None:
+            self.enabled = enabled
+        if every is not None:
+            self.every = max(1, every)
+        if handler is not None:
+            self.handler = handler or None
+        if user_id is not None:
+            self.user_id = user_id or None
+        logger.info("Профилирование: %s", self.state())
+        return self.state()
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "every": self.every,
+            "handler": self.handler,
+            "user_id": self.user_id,
+            "pending": dict(self._samples),
+        }
+
+    def _should_profile(self, name: str, user: Optional[User]) -> bool:
+        if not self.enabled or self._active:
+            return False
+        if self.handler and name != self.handler:
+            return False
+        if self.user_id and (user is None or user.id != self.user_id):
+            return False
+        self._seen += 1
+        return self._seen % self.every == 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        """Обработчик под сэмплером; якорь — кадр этой корутины, он в стеке, только пока идёт наша задача"""
+        name = handler_name(data)
+        if not self._should_profile(name, data.get("event_from_user")):
+            return await handler(event, data)
+
+        self._active = True
+        sampler = StackSampler(name, sys._getframe(), settings.profile_interval_ms / 1000)
+        sampler.start()
+        try:
+            return await handler(event, data)
+        finally:
+            stacks = sampler.stop()
+            self._active = False
+            await self._collect(name, stacks)
+
+    async def _collect(self, name: str, stacks: Counter) -> None:
+        self._stacks.setdefault(name, Counter()).update(stacks)
+        self._samples[name] = self._samples.get(name, 0) + 1
+        if self._samples[name] >= settings.profile_flush_every:
+            await self.flush(name)
+
+    async def flush(self, name: Optional[str] = None) -> None:
+        """Записать накопленные профили (одного обработчика или всех) и начать копить заново"""
+        for key in [name] if name else list(self._stacks):
+            stacks = self._stacks.pop(key, None)
+            samples = self._samples.pop(key, 0)
+            if stacks is None:
+                continue
+            self._files += 1
+            stamp = f"{datetime.utcnow():%Y%m%d-%H%M%S}-{self._files:04d}"
+            path = os.path.join(self._directory, f"{key}-{stamp}-n{samples}.folded")
+            try:
+                await asyncio.to_thread(self._write, stacks, path)
+            except OSError as e:
+                logger.warning("Профиль %s не записан: %s", key, e)
+
+    def _write(self, stacks: Counter, path: str) -> None:
+        os.makedirs(self._directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        files = sorted(
+            (os.path.join(self._directory, f) for f in os.listdir(self._directory) if f.endswith(".folded")),
+            key=lambda f: (os.path.getmtime(f), f),
+        )
+        for old in files[: max(0, len(files) - settings.profile_max_files)]:
+            os.remove(old)
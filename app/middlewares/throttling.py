@@ -0,0 +1,114 @@
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
+
+from app.config import settings
+from app.logger import logger
+
+READ = "read"
+WRITE = "write"
+# Флаг обработчика: @router.message(..., flags=READ_FLAGS). Без флага обработчик считается записью:
+# всё, что не помечено явно как чтение, ограничивается строже
+READ_FLAGS = {"throttle": READ}
+
+SLOW_DOWN = "⏳ Слишком много запросов, подождите пару секунд."
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst. Хранит только остаток и время"""
+
+    __slots__ = ("tokens", "updated", "notified")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+        self.notified = False
+
+    def take(self, rate: float, burst: float, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничение частоты запросов пользователя: отдельные вёдра для чтения и записи.
+
+    Подключается к message/callback_query роутера, чтобы видеть флаги обработчика.
+    Ограниченное обновление не доходит до обработчика; пользователь получает одно
+    предупреждение до тех пор, пока снова не уложится в лимит. Вёдра пользователей,
+    простаивавших дольше throttle_idle_seconds, удаляются при периодической чистке.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        idle_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._limits = limits or {
+            READ: (settings.throttle_read_rate, settings.throttle_read_burst),
+            WRITE: (settings.throttle_write_rate, settings.throttle_write_burst),
+        }
+        self._idle = idle_seconds or settings.throttle_idle_seconds
+        self._clock = clock
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._next_sweep = clock() + self._idle
+        self.throttled: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, user_id: int, kind: str) -> Tuple[bool, bool]:
+        """(пропустить ли обновление, нужно ли отправить предупреждение)"""
+        now = self._clock()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        rate, burst = self._limits[kind]
+        bucket = self._buckets.get((user_id, kind))
+        if bucket is None:
+            bucket = self._buckets[(user_id, kind)] = TokenBucket(burst, now)
+        if bucket.take(rate, burst, now):
+            bucket.notified = False
+            return True, False
+        self.throttled[kind] += 1
+        notify = not bucket.notified
+        bucket.notified = True
+        return False, notify
+
+    def _sweep(self, now: float) -> None:
+        idle = [key for key, bucket in self._buckets.items() if now - bucket.updated >= self._idle]
+        for key in idle:
+            del self._buckets[key]
+        self._next_sweep = now + self._idle
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        kind = get_flag(data, "throttle", default=WRITE)
+        allowed, notify = self.allow(user.id, kind)
+        if allowed:
+            return await handler(event, data)
+
+        if notify:
+            logger.info("Пользователь %s ограничен (%s), всего ограничено: %s", user.id, kind, dict(self.throttled))
+            # для колбэка — всплывающее уведомление, для сообщения — ответ в чат
+            if isinstance(event, (CallbackQuery, Message)):
+                await event.answer(SLOW_DOWN)
+        elif isinstance(event, CallbackQuery):
+            # без ответа на колбэк кнопка остаётся с часиками до таймаута Telegram
+            await event.answer()
+        return None
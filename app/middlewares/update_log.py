@@ -0,0 +1,56 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update, User
+
+from app.config import settings
+from app.logger import log_context, logger
+from app.middlewares.profiling import handler_name
+
+
+class UpdateLogMiddleware(BaseMiddleware):
+    """
+    Контекст логов на время обновления: update_id и пользователь попадают в каждую запись,
+    по окончании пишется итог с обработчиком и длительностью (debug, для медленных — warning).
+    Подключается к dp.update как внешняя мидлварь; имя обработчика дописывает HandlerLogMiddleware.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        context: Dict[str, Any] = {
+            "update_id": event.update_id if isinstance(event, Update) else None,
+            "user": user.id if user else None,
+        }
+        token = log_context.set(context)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            duration = time.perf_counter() - started
+            context["duration_ms"] = round(duration * 1000, 1)
+            if duration >= settings.log_slow_update_seconds:
+                logger.warning("Медленное обновление: %.0f мс", duration * 1000)
+            else:
+                logger.debug("Обновление обработано за %.1f мс", duration * 1000)
+            log_context.reset(token)
+
+
+class HandlerLogMiddleware(BaseMiddleware):
+    """Дописывает в контекст логов имя выбранного обработчика (внутренняя мидлварь роутера)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        context = log_context.get()
+        if context is not None:
+            context["handler"] = handler_name(data)
+        return await handler(event, data)
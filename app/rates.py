@@ -0,0 +1,46 @@
+"""
+Загрузка курсов валют в exchange_rates.
+
+    python -m app.rates rates.csv        # строки "2025-03-01,USD,91.5" или "USD 91.5"
+    python -m app.rates USD 91.5 [дата]  # один курс на сегодня или на дату YYYY-MM-DD
+
+Курс — рублей за единицу валюты. Курс на ту же дату перезаписывается.
+"""
+import asyncio
+import sys
+from datetime import date
+from typing import List
+
+from app.domain.money import parse_rate_lines
+from app.infrastructure.database import Database
+
+
+async def main(args: List[str]) -> int:
+    if not args:
+        print(__doc__)
+        return 2
+    if len(args) == 1:
+        with open(args[0], encoding="utf-8") as f:
+            lines = f.readlines()
+    else:
+        lines = [",".join([args[2], args[0], args[1]]) if len(args) > 2 else " ".join(args[:2])]
+    rates, errors = parse_rate_lines(lines, date.today())
+    for error in errors:
+        print(error, file=sys.stderr)
+    if errors:
+        print("Ничего не загружено, исправьте строки", file=sys.stderr)
+        return 1
+
+    db = Database("")
+    await db.connect()
+    try:
+        await db.init_tables()
+        count = await db.load_exchange_rates(rates)
+    finally:
+        await db.close()
+    print(f"Загружено курсов: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,48 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.logger import logger
+
+
+class StartupTimer:
+    """Замеры этапов запуска для лога: сколько заняли импорты, БД, команды и т.д."""
+
+    def __init__(self, started: float):
+        self._started = started
+        self._last = started
+        self._phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self._phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def summary(self) -> str:
+        parts = ", ".join(f"{name} {duration * 1000:.0f} мс" for name, duration in self._phases)
+        return f"Старт за {self.elapsed * 1000:.0f} мс: {parts}"
+
+
+class FirstUpdateMiddleware(BaseMiddleware):
+    """Один раз пишет в лог время от старта процесса до первого обновления"""
+
+    def __init__(self, timer: StartupTimer):
+        self._timer = timer
+        self._seen = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self._seen:
+            self._seen = True
+            logger.info("Первое обновление через %.0f мс после старта", self._timer.elapsed * 1000)
+        return await handler(event, data)
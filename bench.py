@@ -0,0 +1,59 @@
+"""
+Сравнение задержки горячих запросов двух бэкендов хранилища.
+
+    DATABASE_URL=postgresql://... python bench.py [итераций]
+
+Пишет в БД тестового пользователя и счёт, поэтому запускать на тестовой базе.
+"""
+import asyncio
+import sys
+import time
+from statistics import median
+
+from app.infrastructure.database import Database
+
+BENCH_TELEGRAM_ID = 990000001
+
+
+async def _measure(name: str, call, iterations: int) -> tuple:
+    await call()  # прогрев: подготовка выражений, соединения пула
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return name, median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+async def bench_backend(backend: str, iterations: int) -> list:
+    db = Database("", backend=backend)
+    await db.connect()
+    await db.init_tables()
+    user_id = await db.create_or_get_user(BENCH_TELEGRAM_ID, "bench")
+    await db.create_account(user_id, "Bench")
+    account = await db.get_account_by_name(user_id, "Bench")
+    category_id = await db.get_category_by_name("еда")
+    calls = [
+        ("create_or_get_user", lambda: db.create_or_get_user(BENCH_TELEGRAM_ID, "bench")),
+        ("get_account_by_name", lambda: db.get_account_by_name(user_id, "Bench")),
+        ("get_category_by_name", lambda: db.get_category_by_name("еда")),
+        ("get_account_balance", lambda: db.get_account_balance(account["id"])),
+        ("get_user_accounts", lambda: db.get_user_accounts(user_id)),
+        ("add_expense", lambda: db.add_expense(account["id"], user_id, 1.0, category_id, "bench")),
+    ]
+    try:
+        return [await _measure(name, call, iterations) for name, call in calls]
+    finally:
+        await db.close()
+
+
+async def main(iterations: int):
+    results = {backend: await bench_backend(backend, iterations) for backend in ("sqlalchemy", "asyncpg")}
+    print(f"{'call':<22}{'sqlalchemy p50':>16}{'p95':>10}{'asyncpg p50':>14}{'p95':>10}   (мкс)")
+    for (name, sa_p50, sa_p95), (_, pg_p50, pg_p95) in zip(results["sqlalchemy"], results["asyncpg"]):
+        print(f"{name:<22}{sa_p50:>16.0f}{sa_p95:>10.0f}{pg_p50:>14.0f}{pg_p95:>10.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -1,5 +1,8 @@
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
 from aiogram import Router, F
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.types import (
     Message,
     CallbackQuery,
@@ -11,21 +14,34 @@ from aiogram.types import (
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
+from app.application.charts import StatsCharts
+from app.application.recurring_scheduler import RecurringScheduler
+from app.domain.dto import AccountWithBalance
+from app.domain.entry import QUICK_ENTRY, parse_date, parse_expense_lines, parse_quick_entry
+from app.domain.history import decode_cursor, encode_cursor
+from app.domain.idempotency import message_key
+from app.domain.money import DEFAULT_CURRENCY, fmt_amount as _fmt_amount, fmt_money as _fmt_money, parse_currency
+from app.domain.recurrence import WEEKLY, WEEKDAYS, parse_day
 from app.infrastructure.database import Database
-
-# Helpers for money formatting
+from app.middlewares.throttling import READ_FLAGS
 
 
-def _fmt_amount(amount: float, decimals: int = 2) -> str:
-    try:
-        return format(amount, f",.{decimals}f").replace(",", " ")
-    except Exception:
-        # Fallback to simple format
-        return f"{amount:.{decimals}f}"
+def _message_key(message: Message) -> str:
+    # повторная доставка апдейта (медленный ответ вебхука) несёт то же сообщение
+    return message_key(message.chat.id, message.message_id)
 
 
-def _fmt_money(amount: float, decimals: int = 2) -> str:
-    return f"{_fmt_amount(amount, decimals)} ₽"
+def _fmt_limit_alerts(alerts: list, category_name: str, account_name: str) -> str:
+    lines = []
+    for alert in alerts:
+        scope = f"счёт {account_name}" if alert["scope"] == "account" else "ваши расходы"
+        icon = "🚨" if alert["level"] >= 100 else "⚠️"
+        state = "превышен" if alert["spent"] > alert["limit"] else f"израсходован на {alert['level']}%"
+        lines.append(
+            f"{icon} Лимит '{category_name}' ({scope}) {state}:"
+            f" {_fmt_money(alert['spent'], 0)} из {_fmt_money(alert['limit'], 0)}"
+        )
+    return "\n".join(lines)
 
 
 router = Router()
@@ -64,10 +80,79 @@ def _main_menu() -> ReplyKeyboardMarkup:
     )
 
 
-def setup_handlers(db: Database):
+def _accounts_keyboard(accounts: List[AccountWithBalance], prefix: str) -> InlineKeyboardMarkup:
+    """Инлайн-кнопки счетов по две в ряд; callback_data: <prefix>:<id>:<название>"""
+    rows = []
+    row = []
+    for i, acc in enumerate(accounts, 1):
+        row.append(
+            InlineKeyboardButton(
+                text=f"{acc.name} ({_fmt_money(acc.balance, 0, acc.currency)})",
+                callback_data=f"{prefix}:{acc.id}:{acc.name}",
+            )
+        )
+        if i % 2 == 0:
+            rows.append(row)
+            row = []
+    if row:
+        rows.append(row)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def _categories_keyboard(suggested: Optional[str] = None) -> InlineKeyboardMarkup:
+    """Кнопки категорий; suggested — подсказка по комментарию, отмечается звёздочкой"""
+
+    def button(cat: str) -> InlineKeyboardButton:
+        mark = "⭐ " if cat == suggested else ""
+        return InlineKeyboardButton(text=mark + cat.capitalize(), callback_data=f"cat:{cat}")
+
+    rows = [[button(cat) for cat in CATEGORIES[:3]], [button(cat) for cat in CATEGORIES[3:]]]
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+HISTORY_PAGE_SIZE = 10
+SEARCH_LIMIT = 20
+SEARCH_MIN_LENGTH = 3  # короче триграммы индекс не помогает
+
+
+def _history_page(
+    header: str, account_id: int, rows: list, has_newer: bool, has_older: bool, currency: str = DEFAULT_CURRENCY
+):
+    text = header + "\n\n"
+    if not rows:
+        text += "📭 Операций нет"
+    for row in rows:
+        sign = "+" if row["type"] == "income" else "−"
+        what = row["category"] or ("доход" if row["type"] == "income" else "без категории")
+        who = f" @{row['username']}" if row["username"] else ""
+        comment = f" — {row['comment']}" if row["comment"] else ""
+        text += f"{row['created_at']:%d.%m %H:%M} {sign}{_fmt_money(row['amount'], 0, currency)} {what}{comment}{who}\n"
+    buttons = []
+    if rows and has_newer:
+        cursor = encode_cursor(rows[0]["created_at"], rows[0]["id"])
+        buttons.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"hist:{account_id}:n:{cursor}"))
+    if rows and has_older:
+        cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+        buttons.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"hist:{account_id}:o:{cursor}"))
+    markup = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return text, markup
+
+
+def _fmt_recurrence(period: str, day: int) -> str:
+    if period == WEEKLY:
+        weekday = next(name for name, num in WEEKDAYS.items() if num == day)
+        return f"каждый {weekday}"
+    return f"{day}-го числа"
+
+
+def setup_handlers(
+    db: Database, scheduler: Optional[RecurringScheduler] = None, charts: Optional[StatsCharts] = None
+):
     """Настройка обработчиков с базой данных"""
+    # сервис /trend создаётся при первом запросе: NumPy не нужен на старте
+    trends = None
 
-    @router.message(Command("start"))
+    @router.message(Command("start"), flags=READ_FLAGS)
     async def cmd_start(message: Message):
         """Команда /start"""
         await db.create_or_get_user(message.from_user.id, message.from_user.username)
@@ -77,9 +162,10 @@ def setup_handlers(db: Database):
             reply_markup=_main_menu(),
         )
 
-    @router.message(F.text == BTN_ADD_EXPENSE)
+    @router.message(F.text == BTN_ADD_EXPENSE, flags=READ_FLAGS)
     async def start_expense_flow(message: Message, state: FSMContext):
         """Запуск FSM добавления расхода"""
+        await state.clear()
         user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
         accounts = await db.get_user_accounts(user_id)
 
@@ -95,34 +181,16 @@ def setup_handlers(db: Database):
 
         if len(accounts) == 1:
             # Автовыбор
-            await state.update_data(account_id=accounts[0]["id"], account_name=accounts[0]["name"])
+            await state.update_data(account_id=accounts[0].id, account_name=accounts[0].name)
             # Переходим к выбору категории
-            builder = [
-                [InlineKeyboardButton(text=cat.capitalize(), callback_data=f"cat:{cat}") for cat in CATEGORIES[:3]],
-                [InlineKeyboardButton(text=cat.capitalize(), callback_data=f"cat:{cat}") for cat in CATEGORIES[3:]],
-            ]
-            await message.answer("Выберите категорию:", reply_markup=InlineKeyboardMarkup(inline_keyboard=builder))
+            await message.answer("Выберите категорию:", reply_markup=_categories_keyboard())
             await state.set_state(ExpenseFSM.ChoosingCategory)
         else:
             # Показать список счетов инлайн-кнопками
-            rows = []
-            row = []
-            for i, acc in enumerate(accounts, 1):
-                row.append(
-                    InlineKeyboardButton(
-                        text=f"{acc['name']} ({_fmt_money(acc['balance'], 0)})",
-                        callback_data=f"acc:{acc['id']}:{acc['name']}",
-                    )
-                )
-                if i % 2 == 0:
-                    rows.append(row)
-                    row = []
-            if row:
-                rows.append(row)
-            await message.answer("Выберите счёт:", reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+            await message.answer("Выберите счёт:", reply_markup=_accounts_keyboard(accounts, "acc"))
             await state.set_state(ExpenseFSM.ChoosingAccount)
 
-    @router.message(F.text == BTN_STATS)
+    @router.message(F.text == BTN_STATS, flags=READ_FLAGS)
     async def stats_menu(message: Message):
         """Показать выбор периода статистики"""
         kb = InlineKeyboardMarkup(
@@ -135,9 +203,10 @@ def setup_handlers(db: Database):
         )
         await message.answer("Выберите период статистики:", reply_markup=kb)
 
-    @router.message(F.text == BTN_ADD_INCOME)
+    @router.message(F.text == BTN_ADD_INCOME, flags=READ_FLAGS)
     async def start_income_flow(message: Message, state: FSMContext):
         """Запуск пополнения (доход) через кнопки"""
+        await state.clear()
         user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
         accounts = await db.get_user_accounts(user_id)
 
@@ -151,37 +220,68 @@ def setup_handlers(db: Database):
             return
 
         if len(accounts) == 1:
-            await state.update_data(account_id=accounts[0]["id"], account_name=accounts[0]["name"])
+            await state.update_data(account_id=accounts[0].id, account_name=accounts[0].name)
             await message.answer("Введите сумму, при желании добавьте комментарий через пробел.")
             await state.set_state(IncomeFSM.EnteringAmount)
         else:
-            rows = []
-            row = []
-            for i, acc in enumerate(accounts, 1):
-                row.append(
-                    InlineKeyboardButton(
-                        text=f"{acc['name']} ({_fmt_money(acc['balance'], 0)})",
-                        callback_data=f"incacc:{acc['id']}:{acc['name']}",
-                    )
-                )
-                if i % 2 == 0:
-                    rows.append(row)
-                    row = []
-            if row:
-                rows.append(row)
-            await message.answer("Выберите счёт:", reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+            await message.answer("Выберите счёт:", reply_markup=_accounts_keyboard(accounts, "incacc"))
             await state.set_state(IncomeFSM.ChoosingAccount)
 
+    async def _callback_account(cb: CallbackQuery):
+        """(user_id, счёт) из callback_data вида <prefix>:<id>[:...]. Доступ проверяется
+        по справочнику счетов; без доступа — (user_id, None) и уведомление пользователю"""
+        user_id = await db.create_or_get_user(cb.from_user.id, cb.from_user.username)
+        try:
+            account = await db.get_account(user_id, int(cb.data.split(":")[1]))
+        except (IndexError, ValueError):
+            account = None
+        if account is None:
+            await cb.answer("⛔ Счёт недоступен", show_alert=True)
+        return user_id, account
+
+    async def _account_currency(user_id: int, account_id: int) -> str:
+        account = await db.get_account(user_id, account_id)
+        return account.currency if account else DEFAULT_CURRENCY
+
+    async def _accounts_text(user_id: int, accounts: List[AccountWithBalance]) -> str:
+        """Список счетов с балансами в их валютах; при нескольких счетах — итог в базовой валюте"""
+        text = "💳 Ваши счета:\n\n"
+        for account in accounts:
+            role_emoji = "👑" if account.role == "owner" else "🤝"
+            owner_info = "" if account.role == "owner" else f" (владелец: @{account.owner_username})"
+            balance = _fmt_money(account.balance, 2, account.currency)
+            text += f"{role_emoji} {account.name}: {balance}{owner_info}\n"
+        if len(accounts) > 1:
+            base = await db.get_base_currency(user_id)
+            total, missing = 0.0, []
+            for account in accounts:
+                converted = await db.convert(account.balance, account.currency, base)
+                if converted is None:
+                    missing.append(account.currency)
+                else:
+                    total += converted
+            text += f"\n💰 Итого: {_fmt_money(total, 2, base)}"
+            if missing:
+                text += f" (без {', '.join(sorted(set(missing)))}: нет курса)"
+        return text
+
     @router.callback_query(F.data.startswith("incacc:"))
     async def income_choose_account(cb: CallbackQuery, state: FSMContext):
         if await state.get_state() != IncomeFSM.ChoosingAccount:
             await cb.answer()
             return
-        _, acc_id, acc_name = cb.data.split(":", 2)
-        await state.update_data(account_id=int(acc_id), account_name=acc_name)
+        user_id, account = await _callback_account(cb)
+        if account is None:
+            return
+        data = await state.update_data(account_id=account.id, account_name=account.name)
+        await cb.answer()
+        if "amount" in data:
+            # сумма уже известна из быстрого ввода
+            await _post_income(cb.message, user_id, data, data["amount"], data["comment"], data["entry_key"])
+            await state.clear()
+            return
         await cb.message.answer("Введите сумму, при желании добавьте комментарий через пробел.")
         await state.set_state(IncomeFSM.EnteringAmount)
-        await cb.answer()
 
     @router.message(IncomeFSM.EnteringAmount)
     async def income_enter_amount(message: Message, state: FSMContext):
@@ -197,19 +297,28 @@ def setup_handlers(db: Database):
         comment = " ".join(rest)
         data = await state.get_data()
         user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+        if await _post_income(message, user_id, data, amount, comment, _message_key(message)):
+            await state.clear()
+
+    async def _post_income(
+        message: Message, user_id: int, data: dict, amount: float, comment: str, key: str
+    ) -> bool:
+        """Записать доход на счёт из data и ответить. False — повторная доставка"""
         account_id = data.get("account_id")
         account_name = data.get("account_name")
-        await db.add_transaction(account_id, user_id, "income", amount, None, comment)
+        if not await db.add_transaction(account_id, user_id, "income", amount, None, comment, idempotency_key=key):
+            return False
         new_balance = await db.get_account_balance(account_id)
+        currency = await _account_currency(user_id, account_id)
         await message.answer(
             f"✅ Пополнение: +{_fmt_amount(amount, 0)}"
-            f" (счёт: {account_name}). Комментарий: {comment if comment else '—'}",
+            f" (счёт: {account_name}). Комментарий: {comment if comment else '—'}\n"
+            f"🏦 Баланс счёта '{account_name}': {_fmt_money(new_balance, 2, currency)}",
             reply_markup=_main_menu(),
         )
-        await message.answer(f"🏦 Баланс счёта '{account_name}': {_fmt_money(new_balance)}")
-        await state.clear()
+        return True
 
-    @router.message(F.text == BTN_ACCOUNTS)
+    @router.message(F.text == BTN_ACCOUNTS, flags=READ_FLAGS)
     async def accounts_menu(message: Message):
         """Список счетов по кнопке"""
         user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
@@ -219,14 +328,9 @@ def setup_handlers(db: Database):
                 "📭 У вас пока нет счетов. Создайте первый: /new_account <название>", reply_markup=_main_menu()
             )
             return
-        text = "💳 Ваши счета:\n\n"
-        for account in accounts:
-            role_emoji = "👑" if account["role"] == "owner" else "🤝"
-            owner_info = "" if account["role"] == "owner" else f" (владелец: @{account['owner_username']})"
-            text += f"{role_emoji} {account['name']}: {_fmt_money(account['balance'])}{owner_info}\n"
-        await message.answer(text, reply_markup=_main_menu())
+        await message.answer(await _accounts_text(user_id, accounts), reply_markup=_main_menu())
 
-    @router.message(F.text == BTN_CANCEL)
+    @router.message(F.text == BTN_CANCEL, flags=READ_FLAGS)
     async def cancel_anytime(message: Message, state: FSMContext):
         await state.clear()
         await message.answer("❌ Действие отменено.", reply_markup=_main_menu())
@@ -236,16 +340,19 @@ def setup_handlers(db: Database):
         if await state.get_state() != ExpenseFSM.ChoosingAccount:
             await cb.answer()
             return
-        _, acc_id, acc_name = cb.data.split(":", 2)
-        await state.update_data(account_id=int(acc_id), account_name=acc_name)
+        user_id, account = await _callback_account(cb)
+        if account is None:
+            return
+        data = await state.update_data(account_id=account.id, account_name=account.name)
+        await cb.answer()
+        if "amount" in data and data.get("category"):
+            # быстрый ввод: не хватало только счёта
+            if await _post_expense(cb.message, user_id, data, data["amount"], data["comment"], data["entry_key"]):
+                await state.clear()
+            return
         # Кнопки категорий
-        rows = [
-            [InlineKeyboardButton(text=cat.capitalize(), callback_data=f"cat:{cat}") for cat in CATEGORIES[:3]],
-            [InlineKeyboardButton(text=cat.capitalize(), callback_data=f"cat:{cat}") for cat in CATEGORIES[3:]],
-        ]
-        await cb.message.answer("Выберите категорию:", reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+        await cb.message.answer("Выберите категорию:", reply_markup=_categories_keyboard(data.get("suggested")))
         await state.set_state(ExpenseFSM.ChoosingCategory)
-        await cb.answer()
 
     @router.callback_query(F.data.startswith("cat:"))
     async def choose_category(cb: CallbackQuery, state: FSMContext):
@@ -253,14 +360,68 @@ def setup_handlers(db: Database):
             await cb.answer()
             return
         _, cat = cb.data.split(":", 1)
-        await state.update_data(category=cat)
+        data = await state.update_data(category=cat)
+        await cb.answer()
+        if "amount" in data:
+            # сумма уже известна из быстрого ввода
+            user_id = await db.create_or_get_user(cb.from_user.id, cb.from_user.username)
+            if await _post_expense(cb.message, user_id, data, data["amount"], data["comment"], data["entry_key"]):
+                await state.clear()
+            return
         await cb.message.answer("Введите сумму, при желании добавьте комментарий через пробел.")
         await state.set_state(ExpenseFSM.EnteringAmount)
-        await cb.answer()
+
+    async def _category_ids() -> dict:
+        return {name.lower(): cid for cid, name in (await db.get_categories()).items()}
+
+    async def _suggest_category(user_id: int, comment: str) -> Optional[Tuple[str, int, bool]]:
+        """Категория по словам комментария: (название, id, уверенно) или None"""
+        guess = await db.suggest_category(user_id, comment)
+        if guess is None:
+            return None
+        category_id, confident = guess
+        name = (await db.get_categories()).get(category_id)
+        return (name.lower(), category_id, confident) if name else None
+
+    async def _post_expense_batch(
+        message: Message, user_id: int, account_id: int, account_name: str, entries: list
+    ) -> bool:
+        """Записать разобранные строки одним запросом и ответить одной сводкой. False — повторная доставка"""
+        items = [(e["amount"], e["category_id"], e["comment"]) for e in entries]
+        alerts = await db.add_expenses(account_id, user_id, items, idempotency_key=_message_key(message))
+        if alerts is None:
+            return False
+        new_balance = await db.get_account_balance(account_id)
+        currency = await _account_currency(user_id, account_id)
+        total = sum(e["amount"] for e in entries)
+        text = f"✅ Списано {len(entries)} поз. на {_fmt_money(total, 0, currency)} (счёт: {account_name}):\n"
+        for e in entries:
+            comment = f" — {e['comment']}" if e["comment"] else ""
+            text += f"• {_fmt_amount(e['amount'], 0)} {e['category']}{comment}\n"
+        text += f"\n🏦 Баланс счёта '{account_name}': {_fmt_money(new_balance, 2, currency)}"
+        for e in entries:
+            # предупреждение по категории — один раз, на её первой строке
+            category_alerts = alerts.pop(e["category_id"], None)
+            if category_alerts:
+                text += "\n" + _fmt_limit_alerts(category_alerts, e["category"], account_name)
+        await message.answer(text, reply_markup=_main_menu())
+        return True
 
     @router.message(ExpenseFSM.EnteringAmount)
     async def enter_amount(message: Message, state: FSMContext):
         text = message.text.strip()
+        if "\n" in text:
+            # несколько строк "500 еда обед": категория строки или выбранная на предыдущем шаге
+            data = await state.get_data()
+            categories = await _category_ids()
+            entries, errors = parse_expense_lines(text, categories, default_category=data.get("category"))
+            if errors:
+                await message.answer("Ничего не записано, исправьте строки:\n" + "\n".join(errors))
+                return
+            user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+            if await _post_expense_batch(message, user_id, data.get("account_id"), data.get("account_name"), entries):
+                await state.clear()
+            return
         # ожидается: "500" или "500 ужин в кафе"
         first, *rest = text.split()
         try:
@@ -273,44 +434,61 @@ def setup_handlers(db: Database):
         comment = " ".join(rest)
         data = await state.get_data()
         user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
-        # Проверим категорию id
-        category_id = await db.get_category_by_name(data.get("category"))
-        if not category_id:
-            await message.answer("Ошибка: категория не найдена. Начните сначала.", reply_markup=_main_menu())
+        if await _post_expense(message, user_id, data, amount, comment, _message_key(message)):
             await state.clear()
-            return
+
+    async def _post_expense(
+        message: Message, user_id: int, data: dict, amount: float, comment: str, key: str
+    ) -> bool:
+        """Записать расход на счёт и категорию из data и ответить одним сообщением.
+        False — ничего не записано: повторная доставка или неизвестная категория (состояние не сбрасывать)"""
+        category_name = data.get("category")
+        category_id = data.get("category_id") or (await _category_ids()).get(category_name)
+        if not category_id:
+            await message.answer(f"Ошибка: категория не найдена. Нажмите «{BTN_CANCEL}» и начните сначала.")
+            return False
         account_id = data.get("account_id")
         account_name = data.get("account_name")
-        await db.add_transaction(account_id, user_id, "expense", amount, category_id, comment)
+        alerts = await db.add_expense(account_id, user_id, amount, category_id, comment, idempotency_key=key)
+        if alerts is None:
+            return False
         new_balance = await db.get_account_balance(account_id)
-        category_name = data.get("category")
-        await message.answer(
-            f"✅ Списание: {_fmt_amount(amount, 0)} ({category_name},"
-            f" счёт: {account_name}). Комментарий: {comment if comment else '—'}",
-            reply_markup=_main_menu(),
+        currency = await _account_currency(user_id, account_id)
+        auto = " — по комментарию" if data.get("category_auto") else ""
+        text = (
+            f"✅ Списание: {_fmt_amount(amount, 0)} ({category_name}{auto},"
+            f" счёт: {account_name}). Комментарий: {comment if comment else '—'}\n"
+            f"🏦 Баланс счёта '{account_name}': {_fmt_money(new_balance, 2, currency)}"
         )
-        await message.answer(f"🏦 Баланс счёта '{account_name}': {_fmt_money(new_balance)}")
-        await state.clear()
+        if alerts:
+            text += "\n" + _fmt_limit_alerts(alerts, category_name, account_name)
+        await message.answer(text, reply_markup=_main_menu())
+        return True
 
     # Оставляем существующие командные обработчики ниже
     @router.message(Command("new_account"))
     async def cmd_new_account(message: Message):
-        """Создание нового счета"""
+        """Создание нового счета: /new_account <название> [валюта]"""
         args = message.text.split(maxsplit=1)
         if len(args) < 2:
-            await message.answer("❌ Укажите название счета: /new_account <название>")
+            await message.answer("❌ Укажите название счета: /new_account <название> [валюта]")
             return
 
         account_name = args[1].strip()
+        currency = DEFAULT_CURRENCY
+        name, _, last = account_name.rpartition(" ")
+        if name and parse_currency(last):
+            # последнее слово — валюта счёта: "/new_account Наличные USD"
+            account_name, currency = name.strip(), parse_currency(last)
         user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
 
-        success = await db.create_account(user_id, account_name)
+        success = await db.create_account(user_id, account_name, currency)
         if success:
-            await message.answer(f"✅ Счет '{account_name}' создан!")
+            await message.answer(f"✅ Счет '{account_name}' ({currency}) создан!")
         else:
             await message.answer(f"❌ Счет '{account_name}' уже существует!")
 
-    @router.message(Command("accounts"))
+    @router.message(Command("accounts"), flags=READ_FLAGS)
     async def cmd_accounts(message: Message):
         """Список счетов пользователя"""
         user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
@@ -320,13 +498,7 @@ def setup_handlers(db: Database):
             await message.answer("📭 У вас пока нет счетов. Создайте первый: /new_account <название>")
             return
 
-        text = "💳 Ваши счета:\n\n"
-        for account in accounts:
-            role_emoji = "👑" if account["role"] == "owner" else "🤝"
-            owner_info = "" if account["role"] == "owner" else f" (владелец: @{account['owner_username']})"
-            text += f"{role_emoji} {account['name']}: {_fmt_money(account['balance'])}{owner_info}\n"
-
-        await message.answer(text)
+        await message.answer(await _accounts_text(user_id, accounts))
 
     @router.message(Command("income"))
     async def cmd_income(message: Message):
@@ -358,26 +530,31 @@ def setup_handlers(db: Database):
             await message.answer(f"❌ Счет '{account_name}' не найден!")
             return
 
-        await db.add_transaction(account["id"], user_id, "income", amount, None, comment)
+        if not await db.add_transaction(
+            account.id, user_id, "income", amount, None, comment, idempotency_key=_message_key(message)
+        ):
+            return
 
-        new_balance = await db.get_account_balance(account["id"])
+        new_balance = await db.get_account_balance(account.id)
         await message.answer(
             f"✅ Доход добавлен!\n"
-            f"💳 Счет: {account['name']}\n"
-            f"💰 Сумма: +{_fmt_money(amount)}\n"
+            f"💳 Счет: {account.name}\n"
+            f"💰 Сумма: +{_fmt_money(amount, 2, account.currency)}\n"
             f"💬 Комментарий: {comment}\n"
-            f"🏦 Баланс: {_fmt_money(new_balance)}"
+            f"🏦 Баланс: {_fmt_money(new_balance, 2, account.currency)}"
         )
 
     @router.message(Command("expense"))
     async def cmd_expense(message: Message):
         """Добавление расхода"""
         args = message.text.split()
-        if len(args) < 5:
+        if len(args) < 4:
             await message.answer(
                 "❌ Неверный формат команды!\n"
-                "Правильный формат: /expense <счет> <сумма> <категория> <комментарий>\n"
+                "Правильный формат: /expense <счет> <сумма> [категория] <комментарий>\n"
                 "Пример: /expense Карта 5000 продукты магазин\n"
+                "Без категории, с комментарием из одного слова, она подбирается по прошлым расходам:"
+                " /expense Карта 350 пятёрочка\n"
                 "Категории: еда, транспорт, жильё, развлечения, другое"
             )
             return
@@ -402,7 +579,115 @@ def setup_handlers(db: Database):
             await message.answer(f"❌ Счет '{account_name}' не найден!")
             return
 
-        # Проверяем категорию
+        # Проверяем категорию. Единственное слово после суммы может быть комментарием — тогда
+        # категорию подбираем по нему; при нескольких словах первое — опечатка в категории
+        category_id = await db.get_category_by_name(category_name)
+        auto = ""
+        if not category_id:
+            guess = await _suggest_category(user_id, " ".join(args[3:]))
+            if len(args) > 4 or not guess or not guess[2]:
+                hint = f"\nПохоже на «{guess[0]}»?" if guess else ""
+                await message.answer(
+                    f"❌ Категория '{category_name}' не найдена!{hint}\n"
+                    "Доступные категории: еда, транспорт, жильё, развлечения, другое"
+                )
+                return
+            category_name, category_id, _ = guess
+            comment = " ".join(args[3:])
+            auto = " (по комментарию)"
+
+        alerts = await db.add_expense(
+            account.id, user_id, amount, category_id, comment, idempotency_key=_message_key(message)
+        )
+        if alerts is None:
+            return
+
+        new_balance = await db.get_account_balance(account.id)
+        await message.answer(
+            f"✅ Расход добавлен!\n"
+            f"💳 Счет: {account.name}\n"
+            f"💸 Сумма: -{_fmt_money(amount, 2, account.currency)}\n"
+            f"📂 Категория: {category_name}{auto}\n"
+            f"💬 Комментарий: {comment}\n"
+            f"🏦 Баланс: {_fmt_money(new_balance, 2, account.currency)}"
+        )
+        if alerts:
+            await message.answer(_fmt_limit_alerts(alerts, category_name, account.name))
+
+    @router.message(Command("batch"))
+    async def cmd_batch(message: Message):
+        """Несколько расходов одним сообщением: по строке на расход"""
+        head, _, body = message.text.partition("\n")
+        args = head.split(maxsplit=1)
+        if not body.strip():
+            await message.answer(
+                "❌ Неверный формат команды!\n"
+                "Правильный формат: /batch [счет], дальше по строке на расход: <сумма> <категория> [комментарий]\n"
+                "Пример:\n/batch Карта\n500 еда обед\n120 транспорт метро"
+            )
+            return
+
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+        if len(args) > 1:
+            account = await db.get_account_by_name(user_id, args[1].strip())
+            if not account:
+                await message.answer(f"❌ Счет '{args[1].strip()}' не найден!")
+                return
+        else:
+            accounts = list((await db.get_accessible_accounts(user_id)).values())
+            if len(accounts) != 1:
+                await message.answer("❌ Укажите счет: /batch <счет>")
+                return
+            account = accounts[0]
+
+        entries, errors = parse_expense_lines(body, await _category_ids())
+        if errors:
+            await message.answer("Ничего не записано, исправьте строки:\n" + "\n".join(errors))
+            return
+        await _post_expense_batch(message, user_id, account.id, account.name, entries)
+
+    @router.message(Command("limit"))
+    async def cmd_limit(message: Message):
+        """Месячный лимит по категории: /limit <категория> <сумма> [счет]"""
+        args = message.text.split(maxsplit=3)
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+
+        if len(args) == 1:
+            limits = await db.get_limits(user_id)
+            if not limits:
+                await message.answer(
+                    "📭 Лимиты не заданы.\n"
+                    "Формат: /limit <категория> <сумма> [счет]\n"
+                    "Пример: /limit еда 20000"
+                )
+                return
+            text = "🎯 Лимиты на текущий месяц:\n\n"
+            for item in limits:
+                scope = f" (счёт: {item['account']})" if item["account"] else ""
+                text += (
+                    f"• {item['category']}{scope}: {_fmt_money(item['spent'], 0)}"
+                    f" из {_fmt_money(item['limit'], 0)}\n"
+                )
+            await message.answer(text)
+            return
+
+        if len(args) < 3:
+            await message.answer(
+                "❌ Неверный формат команды!\n"
+                "Правильный формат: /limit <категория> <сумма> [счет]\n"
+                "Пример: /limit еда 20000 Карта"
+            )
+            return
+
+        category_name = args[1]
+        try:
+            amount = float(args[2].replace(",", "."))
+            if amount <= 0:
+                raise ValueError()
+        except ValueError:
+            await message.answer("❌ Сумма должна быть положительным числом!")
+            return
+
         category_id = await db.get_category_by_name(category_name)
         if not category_id:
             await message.answer(
@@ -411,19 +696,255 @@ def setup_handlers(db: Database):
             )
             return
 
-        await db.add_transaction(account["id"], user_id, "expense", amount, category_id, comment)
+        account_id = None
+        if len(args) > 3:
+            account_name = args[3].strip()
+            account = await db.get_account_by_name(user_id, account_name)
+            if not account:
+                await message.answer(f"❌ Счет '{account_name}' не найден!")
+                return
+            account_id = account.id
+
+        await db.set_limit(user_id, category_id, amount, account_id)
+        scope = f"счёт '{args[3].strip()}'" if account_id else "ваши расходы"
+        await message.answer(f"✅ Лимит '{category_name}' на месяц ({scope}): {_fmt_money(amount, 0)}")
+
+    @router.message(Command("recurring"))
+    async def cmd_recurring(message: Message):
+        """Повторяющиеся операции: /recurring <счет> <день> <сумма> <категория|доход> [комментарий]"""
+        args = message.text.split()
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+
+        if len(args) == 1:
+            rules = await db.get_recurring(user_id)
+            if not rules:
+                await message.answer(
+                    "📭 Повторяющихся операций нет.\n"
+                    "Формат: /recurring <счет> <день> <сумма> <категория|доход> [комментарий]\n"
+                    "Пример: /recurring Карта 5 30000 жильё аренда"
+                )
+                return
+            text = "🔁 Повторяющиеся операции:\n\n"
+            for rule in rules:
+                sign = "+" if rule["type"] == "income" else "-"
+                what = rule["category"] or "доход"
+                text += (
+                    f"#{rule['id']} {rule['account']}: {sign}{_fmt_money(rule['amount'], 0)} ({what}),"
+                    f" {_fmt_recurrence(rule['period'], rule['day'])},"
+                    f" следующая {rule['next_run']:%d.%m.%Y}\n"
+                )
+            text += "\nОтключить: /recurring_off <номер>"
+            await message.answer(text)
+            return
+
+        if len(args) < 5:
+            await message.answer(
+                "❌ Неверный формат команды!\n"
+                "Правильный формат: /recurring <счет> <день> <сумма> <категория|доход> [комментарий]\n"
+                "День: число месяца (1-31) или день недели (пн, вт, ...)\n"
+                "Пример: /recurring Карта 10 100000 доход зарплата"
+            )
+            return
+
+        account_name = args[1]
+        try:
+            period, day = parse_day(args[2])
+        except ValueError:
+            await message.answer("❌ День должен быть числом от 1 до 31 или днём недели (пн, вт, ...)!")
+            return
+        try:
+            amount = float(args[3].replace(",", "."))
+            if amount <= 0:
+                raise ValueError()
+        except ValueError:
+            await message.answer("❌ Сумма должна быть положительным числом!")
+            return
+
+        account = await db.get_account_by_name(user_id, account_name)
+        if not account:
+            await message.answer(f"❌ Счет '{account_name}' не найден!")
+            return
+
+        if args[4] == "доход":
+            transaction_type, category_id = "income", None
+        else:
+            transaction_type = "expense"
+            category_id = await db.get_category_by_name(args[4])
+            if not category_id:
+                await message.answer(
+                    f"❌ Категория '{args[4]}' не найдена!\n"
+                    "Доступные категории: еда, транспорт, жильё, развлечения, другое"
+                )
+                return
+        comment = " ".join(args[5:])
 
-        new_balance = await db.get_account_balance(account["id"])
+        rule = await db.add_recurring(
+            user_id, account.id, transaction_type, amount, category_id, comment, period, day
+        )
+        if scheduler is not None:
+            scheduler.schedule(rule["id"], rule["next_run"])
         await message.answer(
-            f"✅ Расход добавлен!\n"
-            f"💳 Счет: {account['name']}\n"
-            f"💸 Сумма: -{_fmt_money(amount)}\n"
-            f"📂 Категория: {category_name}\n"
-            f"💬 Комментарий: {comment}\n"
-            f"🏦 Баланс: {_fmt_money(new_balance)}"
+            f"✅ Повтор #{rule['id']} создан: {_fmt_recurrence(period, day)},"
+            f" первая операция {rule['next_run']:%d.%m.%Y}"
+        )
+
+    @router.message(Command("recurring_off"))
+    async def cmd_recurring_off(message: Message):
+        """Отключить повторяющуюся операцию"""
+        args = message.text.split()
+        try:
+            rule_id = int(args[1].lstrip("#"))
+        except (IndexError, ValueError):
+            await message.answer("❌ Укажите номер операции: /recurring_off <номер>")
+            return
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+        if await db.disable_recurring(user_id, rule_id):
+            await message.answer(f"✅ Повтор #{rule_id} отключён")
+        else:
+            await message.answer(f"❌ Повтор #{rule_id} не найден!")
+
+    @router.message(Command("history"), flags=READ_FLAGS)
+    async def cmd_history(message: Message):
+        """История операций по счёту: /history [счет]"""
+        args = message.text.split(maxsplit=1)
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+
+        if len(args) > 1:
+            account_name = args[1].strip()
+            account = await db.get_account_by_name(user_id, account_name)
+            if not account:
+                await message.answer(f"❌ Счет '{account_name}' не найден!")
+                return
+            await _send_history_first_page(message, user_id, account.id, account.name)
+            return
+
+        accounts = list((await db.get_accessible_accounts(user_id)).values())
+        if not accounts:
+            await message.answer("📭 У вас пока нет счетов. Создайте первый: /new_account <название>")
+            return
+        if len(accounts) == 1:
+            await _send_history_first_page(message, user_id, accounts[0].id, accounts[0].name)
+            return
+        rows = [
+            [InlineKeyboardButton(text=acc.name, callback_data=f"histacc:{acc.id}:{acc.name}")]
+            for acc in accounts
+        ]
+        await message.answer("Выберите счёт:", reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+
+    async def _send_history_first_page(message: Message, user_id: int, account_id: int, account_name: str):
+        rows, has_older = await db.get_history(user_id, account_id, limit=HISTORY_PAGE_SIZE)
+        currency = await _account_currency(user_id, account_id)
+        text, markup = _history_page(
+            f"📜 История счёта '{account_name}':", account_id, rows, False, has_older, currency
         )
+        await message.answer(text, reply_markup=markup)
+
+    @router.callback_query(F.data.startswith("histacc:"), flags=READ_FLAGS)
+    async def history_choose_account(cb: CallbackQuery):
+        user_id, account = await _callback_account(cb)
+        if account is None:
+            return
+        await _send_history_first_page(cb.message, user_id, account.id, account.name)
+        await cb.answer()
 
-    @router.message(Command("stats"))
+    @router.callback_query(F.data.startswith("hist:"), flags=READ_FLAGS)
+    async def history_page(cb: CallbackQuery):
+        try:
+            direction, raw_cursor = cb.data.split(":", 3)[2:]
+            cursor = decode_cursor(raw_cursor)
+        except ValueError:
+            # испорченная или подделанная кнопка: только убираем часики
+            await cb.answer()
+            return
+        user_id, account = await _callback_account(cb)
+        if account is None:
+            return
+        newer = direction == "n"
+        rows, has_more = await db.get_history(user_id, account.id, cursor, newer, HISTORY_PAGE_SIZE)
+        header = (cb.message.text or "").split("\n", 1)[0] or "📜 История счёта:"
+        has_newer, has_older = (has_more, True) if newer else (True, has_more)
+        text, markup = _history_page(header, account.id, rows, has_newer, has_older, account.currency)
+        await cb.message.edit_text(text, reply_markup=markup)
+        await cb.answer()
+
+    @router.message(Command("balance"), flags=READ_FLAGS)
+    async def cmd_balance(message: Message):
+        """Баланс счёта на конец дня: /balance [счет] <дата>"""
+        args = message.text.split(maxsplit=1)
+        usage = "❌ Использование: /balance [счет] <дата>\nПример: /balance Карта 01.03.2025"
+        if len(args) < 2:
+            await message.answer(usage)
+            return
+        parts = args[1].strip().rsplit(maxsplit=1)
+        day = parse_date(parts[-1], date.today())
+        if day is None:
+            await message.answer(usage)
+            return
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+        if len(parts) == 2:
+            account = await db.get_account_by_name(user_id, parts[0])
+            if not account:
+                await message.answer(f"❌ Счет '{parts[0]}' не найден!")
+                return
+        else:
+            accounts = list((await db.get_accessible_accounts(user_id)).values())
+            if len(accounts) != 1:
+                await message.answer("❌ Укажите счет: /balance <счет> <дата>")
+                return
+            account = accounts[0]
+        balance = await db.get_balance_at(account.id, datetime(day.year, day.month, day.day) + timedelta(days=1))
+        await message.answer(
+            f"💳 Баланс счета '{account.name}' на {day:%d.%m.%Y}: {_fmt_money(balance, 2, account.currency)}"
+        )
+
+    @router.message(Command("search"), flags=READ_FLAGS)
+    async def cmd_search(message: Message):
+        """Поиск операций по комментарию: /search <текст>"""
+        args = message.text.split(maxsplit=1)
+        query = args[1].strip() if len(args) > 1 else ""
+        if len(query) < SEARCH_MIN_LENGTH:
+            await message.answer(
+                f"❌ Укажите текст для поиска (от {SEARCH_MIN_LENGTH} символов): /search <текст>\n"
+                "Пример: /search стоматолог"
+            )
+            return
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+        found = await db.search_transactions(user_id, query, SEARCH_LIMIT)
+        if not found:
+            await message.answer(f"🔍 По запросу '{query}' ничего не найдено")
+            return
+        text = f"🔍 Найдено по запросу '{query}':\n\n"
+        for row in found:
+            sign = "+" if row["type"] == "income" else "−"
+            what = f" {row['category']}" if row["category"] else ""
+            amount = _fmt_money(row["amount"], 0, row["currency"])
+            text += f"{row['created_at']:%d.%m.%Y} {row['account']}: {sign}{amount}{what} — {row['comment']}\n"
+        await message.answer(text)
+
+    @router.message(Command("currency"))
+    async def cmd_currency(message: Message):
+        """Базовая валюта статистики и итогов: /currency [код]"""
+        args = message.text.split(maxsplit=1)
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+        if len(args) < 2:
+            base = await db.get_base_currency(user_id)
+            rates = await db.get_rates()
+            text = f"💱 Базовая валюта: {base}\n"
+            if rates:
+                text += "Курсы (₽ за единицу):\n" + "".join(
+                    f"• {code}: {_fmt_amount(rate, 4)}\n" for code, rate in sorted(rates.items())
+                )
+            text += "Сменить: /currency USD"
+            await message.answer(text)
+            return
+        currency = parse_currency(args[1])
+        if currency is None:
+            await message.answer(f"❌ Неизвестная валюта '{args[1].strip()}'. Пример: /currency EUR")
+            return
+        await db.set_base_currency(user_id, currency)
+        await message.answer(f"✅ Статистика и итоги теперь в {currency}")
+
+    @router.message(Command("stats"), flags=READ_FLAGS)
     async def cmd_stats(message: Message):
         """Статистика за период (команда)"""
         args = message.text.split()
@@ -435,7 +956,7 @@ def setup_handlers(db: Database):
         period = args[1]
         await _send_stats(message, period, message.from_user)
 
-    @router.callback_query(F.data.startswith("period:"))
+    @router.callback_query(F.data.startswith("period:"), flags=READ_FLAGS)
     async def stats_period(cb: CallbackQuery):
         period = cb.data.split(":", 1)[1]
         await _send_stats(cb.message, period, cb.from_user)
@@ -450,21 +971,38 @@ def setup_handlers(db: Database):
         # Используем пользователя-инициатора (сообщение или колбэк)
         user_id = await db.create_or_get_user(user.id, user.username)
         stats = await db.get_stats(user_id, days)
+        currency = stats.currency
         text = f"📊 Статистика за {period_name}:\n\n"
-        text += f"💰 Доходы: {_fmt_money(stats['total_income'])}\n"
-        text += f"💸 Расходы: {_fmt_money(stats['total_expense'])}\n"
-        text += f"💵 Разница: {_fmt_money(stats['total_income'] - stats['total_expense'])}\n\n"
-        if stats["categories"]:
+        text += f"💰 Доходы: {_fmt_money(stats.total_income, 2, currency)}\n"
+        text += f"💸 Расходы: {_fmt_money(stats.total_expense, 2, currency)}\n"
+        text += f"💵 Разница: {_fmt_money(stats.total_income - stats.total_expense, 2, currency)}\n\n"
+        if stats.categories:
             text += "📂 Расходы по категориям:\n"
-            for cat in stats["categories"]:
-                text += f"• {cat['name']}: {_fmt_money(cat['amount'])} ({cat['percentage']:.1f}%)\n"
+            for cat in stats.categories:
+                text += f"• {cat.name}: {_fmt_money(cat.amount, 2, currency)} ({cat.percentage:.1f}%)\n"
         else:
             text += "📭 Нет расходов за данный период"
+        if stats.missing_rates:
+            text += f"\n⚠️ Без операций в {', '.join(stats.missing_rates)}: нет курса"
         await message.answer(text)
+        if charts is not None:
+            await charts.send_stats(message, user_id, period, days, stats)
+
+    @router.message(Command("trend"), flags=READ_FLAGS)
+    async def cmd_trend(message: Message):
+        """Тренд расходов и прогноз на конец месяца"""
+        from app.application.analytics import TrendService, render_trend
+
+        nonlocal trends
+        if trends is None:
+            trends = TrendService(db)
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+        trend = await trends.trend(user_id)
+        await message.answer(render_trend(trend))
 
     @router.message(Command("share"))
     async def cmd_share(message: Message):
-        """Поделиться счетом с другим пользователем"""
+        """Поделиться счетом: пользователь становится участником семьи счета"""
         args = message.text.split()
         if len(args) < 3:
             await message.answer(
@@ -490,17 +1028,91 @@ def setup_handlers(db: Database):
             return
 
         # Проверяем, что пользователь является владельцем
-        if account["owner_id"] != user_id:
+        if account.owner_id != user_id:
             await message.answer("❌ Вы не являетесь владельцем этого счета!")
             return
 
         # Получаем или создаем целевого пользователя
         target_user_id = await db.create_or_get_user(target_user_telegram_id)
 
-        success = await db.share_account(account["id"], user_id, target_user_id)
+        success = await db.share_account(account.id, user_id, target_user_id)
         if success:
-            await message.answer(f"✅ Счет '{account_name}' успешно расшарен пользователю {target_user_telegram_id}!")
+            await message.answer(
+                f"✅ Счет '{account_name}' успешно расшарен пользователю {target_user_telegram_id}!\n"
+                "Общие счета и их участники: /household"
+            )
         else:
             await message.answer("❌ Ошибка при расшаривании счета. Возможно, доступ уже предоставлен.")
 
+    @router.message(Command("household"), flags=READ_FLAGS)
+    async def cmd_household(message: Message):
+        """Семьи пользователя: участники и общие счета"""
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+        households = await db.get_households(user_id)
+        if not households:
+            await message.answer("👨‍👩‍👧 Вы пока не в семье. Поделитесь счетом: /share <счет> <user_id>")
+            return
+        text = ""
+        for household in households:
+            text += f"👨‍👩‍👧 {household['name']}\n"
+            for member in household["members"]:
+                name = f"@{member['username']}" if member["username"] else str(member["telegram_id"])
+                text += f"{'👑' if member['owner'] else '•'} {name}\n"
+            accounts = ", ".join(household["accounts"]) or "—"
+            text += f"💳 Общие счета: {accounts}\n\n"
+        await message.answer(text.strip())
+
+    # Быстрый ввод без кнопок: "350 еда кофе", "-350 Карта кофе", "+5000 зарплата".
+    # Регистрируется последним и только вне сценариев, чтобы не перехватывать их шаги
+    @router.message(StateFilter(None), F.text.regexp(QUICK_ENTRY))
+    async def quick_entry(message: Message, state: FSMContext):
+        user_id = await db.create_or_get_user(message.from_user.id, message.from_user.username)
+        accounts = list((await db.get_accessible_accounts(user_id)).values())
+        if not accounts:
+            await message.answer("📭 У вас нет счетов. Создайте счёт командой: /new_account <название>")
+            return
+        entry = parse_quick_entry(message.text, {acc.name.lower(): acc for acc in accounts}, await _category_ids())
+        if entry is None:
+            return
+        account = entry["account"] or (accounts[0] if len(accounts) == 1 else None)
+        data = {
+            "amount": entry["amount"],
+            "comment": entry["comment"],
+            "entry_key": _message_key(message),
+            "category": entry["category"],
+            "category_id": entry["category_id"],
+        }
+        if account is not None:
+            data.update(account_id=account.id, account_name=account.name)
+        if entry["type"] == "expense" and not entry["category"]:
+            # категория не названа — подбираем по комментарию; неуверенную только подсвечиваем
+            guess = await _suggest_category(user_id, entry["comment"])
+            if guess and guess[2]:
+                data.update(category=guess[0], category_id=guess[1], category_auto=True)
+            elif guess:
+                data["suggested"] = guess[0]
+
+        if entry["type"] == "income":
+            if account is not None:
+                await _post_income(message, user_id, data, entry["amount"], entry["comment"], data["entry_key"])
+                return
+            await state.update_data(**data)
+            accounts = await db.get_user_accounts(user_id)
+            await message.answer("Выберите счёт для пополнения:", reply_markup=_accounts_keyboard(accounts, "incacc"))
+            await state.set_state(IncomeFSM.ChoosingAccount)
+            return
+
+        if account is not None and data["category"]:
+            await _post_expense(message, user_id, data, entry["amount"], entry["comment"], data["entry_key"])
+            return
+        # неоднозначно — уточняем недостающее через обычный сценарий, сумма уже сохранена
+        await state.update_data(**data)
+        if account is None:
+            accounts = await db.get_user_accounts(user_id)
+            await message.answer("Выберите счёт для списания:", reply_markup=_accounts_keyboard(accounts, "acc"))
+            await state.set_state(ExpenseFSM.ChoosingAccount)
+        else:
+            await message.answer("Выберите категорию:", reply_markup=_categories_keyboard(data.get("suggested")))
+            await state.set_state(ExpenseFSM.ChoosingCategory)
+
     return router
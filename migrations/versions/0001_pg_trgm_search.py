@@ -0,0 +1,42 @@
+"""pg_trgm для поиска по комментариям (/search)
+
+Разовый шаг администратора: CREATE EXTENSION требует прав суперпользователя или владельца
+базы, которых у роли бота обычно нет. Запуск с привилегированной ролью:
+
+    DATABASE_URL=postgresql://admin@host/db alembic upgrade head
+
+Бот при старте только проверяет, что расширение установлено, и без него ищет без индекса.
+
+Revision ID: 0001_pg_trgm_search
+Revises:
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_pg_trgm_search"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # таблицы создаёт бот; если он уже запускался, индексы создаются здесь, иначе — при его старте
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    for table in ("transactions", "transactions_archive"):
+        if table in tables:
+            op.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_comment_trgm ON {table} USING gin (comment gin_trgm_ops)"
+            )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_transactions_archive_comment_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_transactions_comment_trgm")
+    op.execute("DROP EXTENSION IF EXISTS pg_trgm")